@@ -133,7 +133,7 @@ export default function Component() {
             <div className="space-y-4">
               {chatMessages.map((msg) => (
                 <div
-                  key={msg.id}
+                  key={msg.id ?? msg.clientId}
                   className={`flex items-start space-x-2 ${
                     msg.user.id === currentUser.id ? "justify-end" : ""
                   }`}
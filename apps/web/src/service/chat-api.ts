@@ -3,8 +3,10 @@ import { env } from "@/env.mjs"
 import { constructSearchParams, interpolate } from "@/lib/utils"
 import {
   ChatGroupListResponse,
+  MESSAGE_STATUS,
   MessageListResponse,
   NewMessageRequest,
+  SocketReceiveAction,
   SocketReceiveMessage,
   SocketSendAction,
   SocketSendMessage,
@@ -82,9 +84,7 @@ export const ChatApi = ConfigApi.injectEndpoints({
           // if it is a message and for the appropriate channel,
           // update our query result with the received message
           const listener = (event: MessageEvent) => {
-            const data = JSON.parse(
-              event.data
-            ) as SocketReceiveMessage<SocketSendAction.MESSAGE>
+            const data = JSON.parse(event.data) as SocketReceiveMessage<any>
             console.log("data", data)
             console.log("isSocketMessage", !isSocketMessage(data))
             console.log(
@@ -109,6 +109,28 @@ export const ChatApi = ConfigApi.injectEndpoints({
                 console.log("draft", draft.data.results)
               })
             }
+
+            if (data.action === SocketReceiveAction.MESSAGE_STATUS) {
+              const statusEvent = (
+                data as SocketReceiveMessage<SocketReceiveAction.MESSAGE_STATUS>
+              ).data
+              updateCachedData((draft) => {
+                // match the messages received before they were written
+                for (const message of draft.data.results) {
+                  const update = statusEvent.messages.find(
+                    (written) =>
+                      message.clientId && written.clientId === message.clientId
+                  )
+                  if (!update) continue
+                  message.status = statusEvent.status
+                  if (statusEvent.status === MESSAGE_STATUS.SAVED) {
+                    message.id = update.id ?? undefined
+                    message.seq = update.seq ?? undefined
+                    message.createdAt = update.createdAt
+                  }
+                }
+              })
+            }
           }
 
           ws.addEventListener("message", listener)
@@ -1,4 +1,5 @@
 import { ListApiResponse } from "."
+import { Nullable } from "./mixins"
 import { User } from "./user"
 
 export enum CHAT_GROUP_TYPE {
@@ -30,8 +31,20 @@ export enum MESSAGE_TYPE {
   TEXT = "text",
 }
 
+export enum MESSAGE_STATUS {
+  SAVED = "saved",
+  FAILED = "failed",
+}
+
 export interface ChatMessage {
-  id: number
+  // unset until a message received over the websocket is written
+  id?: number
+  // order of the message in its chat group, set along with `id`
+  seq?: number
+  // temporary id of a message received over the websocket, matched by the
+  // `chat_message_status` event once it is written
+  clientId?: string
+  status?: MESSAGE_STATUS
   text: string
   messageType: MESSAGE_TYPE
   chatGroup: number
@@ -66,12 +79,32 @@ export type SocketSendMessage<T> = {
   data: T extends SocketSendAction.MESSAGE ? NewMessageRequest : null
 }
 
+export enum SocketReceiveAction {
+  MESSAGE_STATUS = "chat_message_status",
+}
+
+// messages are received before they are written, their ids, numbers and
+// dates follow once they are saved, or they could not be
+export type MessageStatusEvent = {
+  chatGroup: number
+  status: MESSAGE_STATUS
+  messages: {
+    clientId: string
+    seq: Nullable<number>
+    id: Nullable<number>
+    createdAt: string
+  }[]
+}
+
 export type SocketReceiveMessage<T> = {
   action: T
+  // typing events are coalesced, each carries every member typing meanwhile
   data: T extends SocketSendAction.TYPING
-    ? { user: User }
+    ? { users: User[] }
     : T extends SocketSendAction.MESSAGE
     ? ChatMessage
+    : T extends SocketReceiveAction.MESSAGE_STATUS
+    ? MessageStatusEvent
     : null
 }
 
@@ -80,6 +113,7 @@ export const isSocketMessage = (
 ): data is SocketReceiveMessage<any> => {
   return (
     data.action === SocketSendAction.MESSAGE ||
-    data.action === SocketSendAction.TYPING
+    data.action === SocketSendAction.TYPING ||
+    data.action === SocketReceiveAction.MESSAGE_STATUS
   )
 }
@@ -15,7 +15,10 @@ class AccountQuerySet(models.QuerySet):
 
     def user_profiles(self):
         UserProfile = apps.get_model("accounts", "UserProfile")
-        return UserProfile.objects.filter(id__in=self.values_list("id", flat=True))
+        # profiles are serialized with their user's flags
+        return UserProfile.objects.filter(
+            id__in=self.values_list("id", flat=True)
+        ).select_related("user")
 
 
 class AccountManager(UserManager):
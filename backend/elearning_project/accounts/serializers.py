@@ -6,15 +6,16 @@ from accounts.models import (
     UserProfile,
 )
 from core.enums import USER_TYPES
+from core.serializers import SparseFieldsetsMixin
 
 
-class UserMinimalSerializer(serializers.ModelSerializer):
+class UserMinimalSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     class Meta:
         model = UserProfile
         fields = ("id", "email", "first_name", "last_name", "avatar", "bio", "title")
 
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     email = serializers.EmailField(required=False)
     phone = serializers.CharField(required=False)
     is_active = serializers.BooleanField(source="user.is_active", read_only=True)
@@ -62,7 +63,9 @@ class UserProfileSerializer(serializers.ModelSerializer):
         return instance
 
 
-class CustomUserSerializer(RegisterValidateMixin, serializers.ModelSerializer):
+class CustomUserSerializer(
+    SparseFieldsetsMixin, RegisterValidateMixin, serializers.ModelSerializer
+):
     email = serializers.EmailField(required=True)
     password = serializers.CharField(write_only=True, required=True)
 
@@ -1,6 +1,13 @@
+from model_mommy import mommy
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
+from core.enums import USER_TYPES
 from core.tests import BaseAPITestCase
+from accounts.views import UserViewSet
+from courses.models import Course, CourseFeedback, CourseMembership
 
 
 class AccountsAPITestCase(BaseAPITestCase):
@@ -127,3 +134,66 @@ class AccountsAPITestCase(BaseAPITestCase):
         response = self.roger_client.post(url, payload)
         self.assertEqual(response.status_code, 400)
         self.assertEqual(response.json().get("detail"), "Wrong password provided")
+
+    def test_instructor_dashboard_is_cached_until_courses_change(self):
+        """
+        Test if the instructor dashboard is cached until its courses change
+        """
+        self.sally_user.user_type = USER_TYPES.INSTRUCTOR
+        self.sally_user.save()
+        published = mommy.make(Course, owner=self.sally_user, status="published")
+        draft = mommy.make(Course, owner=self.sally_user)
+        for course in (published, draft):
+            mommy.make(CourseMembership, course=course, user=self.roger_user)
+        mommy.make(
+            CourseMembership,
+            course=published,
+            user=self.james_user,
+            is_course_completed=True,
+        )
+        mommy.make(CourseFeedback, course=published, user=self.james_user, rating=4)
+
+        url = reverse("user-my-course-stats")
+        response = self.sally_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        data = response.json().get("data")
+        self.assertEqual(data.get("totalCourseCount"), 2)
+        self.assertEqual(data.get("publishedCourseCount"), 1)
+        self.assertEqual(data.get("totalStudentsCount"), 3)
+        self.assertEqual(data.get("distinctStudentsCount"), 2)
+        self.assertAlmostEqual(data.get("completionRate"), 1 / 3)
+        self.assertEqual(data.get("averageRating"), 4)
+
+        with CaptureQueriesContext(connection) as cached:
+            self.sally_client.get(url)
+        self.assertEqual([query for query in cached if "tb_course" in query["sql"]], [])
+
+        draft.status = "published"
+        draft.save()
+        response = self.sally_client.get(url)
+        self.assertEqual(response.json().get("data").get("publishedCourseCount"), 2)
+
+        # the previous owner of a transferred course is refreshed too
+        draft = Course.objects.get(pk=draft.pk)
+        draft.owner = self.james_user
+        draft.save()
+        response = self.sally_client.get(url)
+        self.assertEqual(response.json().get("data").get("totalCourseCount"), 1)
+
+    def test_account_endpoints_stay_within_query_budget(self):
+        """
+        Test if the account endpoints run a bounded number of queries
+        """
+        # held to the `query_budgets` of the view
+        actions = {
+            "user-me": "me",
+            "user-my-courses": "my_courses",
+            "user-my-course-stats": "my_course_stats",
+        }
+        for course in mommy.make(Course, status="published", _quantity=3):
+            mommy.make(CourseMembership, course=course, user=self.roger_user)
+        for name, action in actions.items():
+            budget = UserViewSet.query_budgets[action]
+            with self.subTest(endpoint=name), self.assertQueryBudget(budget):
+                response = self.roger_client.get(reverse(name))
+                self.assertEqual(response.status_code, 200)
@@ -4,9 +4,12 @@ from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 
 from core.utils import success_response
-from core.enums import USER_TYPES, COURSE_STATUS
+from core.enums import USER_TYPES, COURSE_ROLES, COURSE_STATUS
 from core.pagination import DefaultResultsSetPagination
+from core.views import QueryBudgetViewMixin, SparseFieldsetsViewMixin
 
+from chat.models import ChatMembership
+from courses.dashboard import get_instructor_dashboard
 from courses.models import Course
 from accounts.models import (
     User,
@@ -20,17 +23,23 @@ from accounts.serializers import (
 from courses.serializers import CourseSerializer
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(
+    QueryBudgetViewMixin, SparseFieldsetsViewMixin, viewsets.ModelViewSet
+):
     queryset = User.objects.all()
     course_queryset = Course.objects.all()
     serializer_class = CustomUserSerializer
     pagination_class = DefaultResultsSetPagination
+    # whatever the number of courses listed
+    query_budgets = {"me": 1, "my_courses": 5, "my_course_stats": 2}
 
-    def get_student_course_queryset(self, request):
-        return request.user.courses.all().filter(status=COURSE_STATUS.PUBLISHED)
+    def get_student_course_queryset(self, request, **lookups):
+        return self.course_queryset.of_user(
+            request.user, is_member=True, **lookups
+        ).filter(status=COURSE_STATUS.PUBLISHED)
 
     def get_instructor_course_queryset(self, request):
-        return request.user.my_courses.all()
+        return self.course_queryset.of_user(request.user, role=COURSE_ROLES.OWNER)
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -56,7 +65,10 @@ class UserViewSet(viewsets.ModelViewSet):
             raise exceptions.ParseError(detail=serializer.errors)
 
         return success_response(
-            detail="User Profile created and verification email has been sent successfully.",
+            detail=(
+                "User Profile created and verification email has been sent "
+                "successfully."
+            ),
             code=201,
             **serializer.data
         )
@@ -67,7 +79,9 @@ class UserViewSet(viewsets.ModelViewSet):
             raise exceptions.ParseError(detail="User profile does not exist.")
 
         try:
-            serializer = UserProfileSerializer(instance.profile)
+            serializer = UserProfileSerializer(
+                instance.profile, **self.get_sparse_fieldsets()
+            )
             return success_response(
                 detail="User data fetched successfully", **serializer.data
             )
@@ -82,7 +96,9 @@ class UserViewSet(viewsets.ModelViewSet):
     def me(self, request):  # noqa
         if request.method == "GET":
             try:
-                serializer = UserProfileSerializer(request.user.profile)
+                serializer = UserProfileSerializer(
+                    request.user.profile, **self.get_sparse_fieldsets()
+                )
                 return success_response(
                     detail="User data fetched successfully", **serializer.data
                 )
@@ -106,7 +122,9 @@ class UserViewSet(viewsets.ModelViewSet):
     @action(detail=True, permission_classes=[IsAuthenticated], methods=["get"])
     def profile(self, request, pk=None):
         instance = User.objects.get(pk=pk)
-        serializer = UserProfileSerializer(instance.profile)
+        serializer = UserProfileSerializer(
+            instance.profile, **self.get_sparse_fieldsets()
+        )
         return success_response(
             detail="Profile data fetched successfully", **serializer.data
         )
@@ -138,18 +156,27 @@ class UserViewSet(viewsets.ModelViewSet):
             queryset = self.get_instructor_course_queryset(request)
         else:
             queryset = self.get_student_course_queryset(request)
+        queryset = queryset.with_list_data(
+            user, fields=self.get_rendered_fields(CourseSerializer)
+        )
 
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = CourseSerializer(
-                page, many=True, context={"user": user, "request": request}
+                page,
+                many=True,
+                context={"user": user, "request": request},
+                **self.get_sparse_fieldsets(),
             )
             return self.paginator.get_paginated_response(
                 detail="Fetched all course" if page != [] else "No course found",
                 data=serializer.data,
             )
         serializer = CourseSerializer(
-            queryset, many=True, context={"user": user, "request": request}
+            queryset,
+            many=True,
+            context={"user": user, "request": request},
+            **self.get_sparse_fieldsets(),
         )
         return success_response(detail="Fetched all course", results=serializer.data)
 
@@ -163,26 +190,28 @@ class UserViewSet(viewsets.ModelViewSet):
         is_instructor = user.user_type == USER_TYPES.INSTRUCTOR
 
         if is_instructor:
-            queryset = self.get_instructor_course_queryset(request)
-            total_course_count = queryset.count()
-            published_course_count = queryset.filter(
-                status=COURSE_STATUS.PUBLISHED
-            ).count()
-            total_students_count = sum([course.members.count() for course in queryset])
             return success_response(
-                detail="Fetched all course stats",
-                total_course_count=total_course_count,
-                published_course_count=published_course_count,
-                total_students_count=total_students_count,
+                detail="Fetched all course stats", **get_instructor_dashboard(user)
             )
         else:
             queryset = self.get_student_course_queryset(request)
             course_count = queryset.count()
-            total_completed_courses = queryset.filter(
-                course_memberships__is_course_completed=True
+            total_completed_courses = self.get_student_course_queryset(
+                request, is_course_completed=True
             ).count()
             return success_response(
                 detail="Fetched all course stats",
                 course_count=course_count,
                 total_completed_courses=total_completed_courses,
             )
+
+    @action(
+        detail=False,
+        permission_classes=[IsAuthenticated],
+        methods=["get"],
+    )
+    def my_unread(self, request):
+        return success_response(
+            detail="Fetched unread messages",
+            **ChatMembership.objects.unread_totals(request.user),
+        )
@@ -1,8 +1,7 @@
 from django.contrib import admin
-from chat.models import ChatGroup, ChatMessage, ChatMembership, ChatMessageRead
+from chat.models import ChatGroup, ChatMessage, ChatMembership
 
 
 admin.site.register(ChatGroup)
 admin.site.register(ChatMessage)
 admin.site.register(ChatMembership)
-admin.site.register(ChatMessageRead)
@@ -0,0 +1,244 @@
+import json
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from accounts.models import User
+from chat.models import ChatGroup, ChatMessage, ChatMessageSegment, MessageFile
+from chat.search import unindex_messages
+
+__all__ = [
+    "ChatArchive",
+    "archive_messages",
+    "get_archive_cutoff",
+]
+
+
+# fields of the archived records, files are nested under "files"
+MESSAGE_FIELDS = (
+    "id",
+    "seq",
+    "user_id",
+    "created_by_id",
+    "message_type",
+    "text",
+    "created_at",
+    "updated_at",
+    "removed_at",
+    "is_deleted_by_sender",
+    "is_deleted_by_admin",
+)
+FILE_FIELDS = ("id", "url", "file_type", "file_name", "thumbnail_url", "created_at")
+DATETIME_FIELDS = ("created_at", "updated_at", "removed_at")
+
+
+def get_archive_cutoff(days=None):
+    """Return the date before which messages are archived, `days` defaults
+    to `CHAT_ARCHIVE_AFTER_DAYS`"""
+    if days is None:
+        days = settings.CHAT_ARCHIVE_AFTER_DAYS
+    return timezone.now() - timedelta(days=days)
+
+
+def to_record(instance, fields):
+    record = {}
+    for name in fields:
+        value = getattr(instance, name)
+        if name in DATETIME_FIELDS and value is not None:
+            value = value.isoformat()
+        record[name] = value
+    return record
+
+
+def from_record(model, record, **extra):
+    values = {
+        name: parse_datetime(value) if name in DATETIME_FIELDS and value else value
+        for name, value in record.items()
+    }
+    return model(**values, **extra)
+
+
+def encode_segment(messages):
+    records = [
+        {
+            **to_record(message, MESSAGE_FIELDS),
+            "files": [to_record(file, FILE_FIELDS) for file in message.files.all()],
+        }
+        for message in messages
+    ]
+    return zlib.compress(json.dumps(records, separators=(",", ":")).encode())
+
+
+def decode_segment(segment):
+    """Return the records of a segment, oldest first"""
+    return json.loads(zlib.decompress(segment.payload))
+
+
+def archive_messages(before=None, batch_size=1000, chat_group_ids=None):
+    """Move the messages sent before `before` (the archive cutoff by
+    default) into compressed segments of at most `batch_size` messages,
+    one group and batch per transaction, so that the command can be stopped
+    and resumed at any point. The last message of each group stays hot.
+
+    Returns:
+        dict: number of messages archived and of segments written
+    """
+    if before is None:
+        before = get_archive_cutoff()
+    candidates = ChatMessage.objects.filter(created_at__lt=before, seq__isnull=False)
+    if chat_group_ids is not None:
+        candidates = candidates.filter(chat_group__in=chat_group_ids)
+    group_ids = list(
+        candidates.order_by("chat_group")
+        .values_list("chat_group", flat=True)
+        .distinct()
+    )
+
+    stats = {"messages": 0, "segments": 0}
+    for chat_group_id in group_ids:
+        while True:
+            archived = archive_batch(chat_group_id, before, batch_size)
+            if archived:
+                stats["messages"] += archived
+                stats["segments"] += 1
+            if archived < batch_size:
+                break
+    return stats
+
+
+@transaction.atomic
+def archive_batch(chat_group_id, before, batch_size):
+    # locked so that the last message does not move while the batch is cut
+    last_message_id = (
+        ChatGroup.objects.select_for_update()
+        .filter(pk=chat_group_id)
+        .values_list("last_message", flat=True)
+        .first()
+    )
+    messages = list(
+        ChatMessage.objects.filter(
+            chat_group=chat_group_id, created_at__lt=before, seq__isnull=False
+        )
+        .exclude(pk=last_message_id)
+        .order_by("created_at", "pk")
+        .prefetch_related("files")[:batch_size]
+    )
+    if not messages:
+        return 0
+
+    ChatMessageSegment.objects.create(
+        chat_group_id=chat_group_id,
+        first_id=min(message.pk for message in messages),
+        last_id=max(message.pk for message in messages),
+        first_seq=min(message.seq for message in messages),
+        last_seq=max(message.seq for message in messages),
+        first_created_at=messages[0].created_at,
+        last_created_at=messages[-1].created_at,
+        messages_count=len(messages),
+        payload=encode_segment(messages),
+    )
+    message_ids = [message.pk for message in messages]
+    unindex_messages(message_ids)
+    MessageFile.objects.filter(message__in=message_ids).delete()
+    # raw delete: the post_delete receivers would refresh the last message of
+    # the group and the search index once per message, both are already done
+    queryset = ChatMessage.objects.filter(pk__in=message_ids)
+    queryset._raw_delete(queryset.db)
+    return len(messages)
+
+
+class ChatArchive:
+    """
+    Read side of the archived messages of a chat group, shaped after the
+    windows of `ChatMessageQueryset.history`, which falls back to it past
+    the hot rows. Messages are rebuilt as unsaved `ChatMessage` objects
+    flagged `is_archived`, with their user, profile and files loaded.
+    """
+
+    def __init__(self, chat_group_id):
+        self.chat_group_id = int(chat_group_id)
+
+    @property
+    def segments(self):
+        return ChatMessageSegment.objects.filter(chat_group=self.chat_group_id)
+
+    def get(self, pk):
+        """
+        Raises:
+            DoesNotExist: when no segment holds the message
+        """
+        segments = self.segments.filter(first_id__lte=pk, last_id__gte=pk)
+        for segment in segments:
+            for record in decode_segment(segment):
+                if record["id"] == pk:
+                    return self.to_messages([record])[0]
+        raise ChatMessage.DoesNotExist(
+            "Archived chat message matching query does not exist."
+        )
+
+    def older_than(self, anchor, count):
+        """Return at most `count` archived messages before `anchor`, or the
+        latest ones when None, newest first"""
+        segments = self.segments.order_by("-last_created_at", "-last_id")
+        if anchor is not None:
+            segments = segments.filter(first_created_at__lte=anchor.created_at)
+            key = (anchor.created_at, anchor.pk)
+        records = []
+        for segment in segments.iterator():
+            # segments of a group overlap in time when older messages were
+            # imported after an archive run, so stop only once the window
+            # is full and the remaining segments are all older than it
+            if len(records) >= count:
+                records.sort(key=self.key, reverse=True)
+                if segment.last_created_at < self.key(records[count - 1])[0]:
+                    break
+            for record in reversed(decode_segment(segment)):
+                if anchor is None or self.key(record) < key:
+                    records.append(record)
+        records.sort(key=self.key, reverse=True)
+        return self.to_messages(records[:count])
+
+    def newer_than(self, anchor, count):
+        """Return at most `count` archived messages after `anchor`, oldest
+        first"""
+        segments = self.segments.filter(
+            last_created_at__gte=anchor.created_at
+        ).order_by("first_created_at", "first_id")
+        key = (anchor.created_at, anchor.pk)
+        records = []
+        for segment in segments.iterator():
+            if len(records) >= count:
+                records.sort(key=self.key)
+                if segment.first_created_at > self.key(records[count - 1])[0]:
+                    break
+            for record in decode_segment(segment):
+                if self.key(record) > key:
+                    records.append(record)
+        records.sort(key=self.key)
+        return self.to_messages(records[:count])
+
+    @staticmethod
+    def key(record):
+        return parse_datetime(record["created_at"]), record["id"]
+
+    def to_messages(self, records):
+        user_ids = {record["user_id"] for record in records} - {None}
+        users = User.objects.select_related("profile").in_bulk(user_ids)
+        messages = []
+        for record in records:
+            record = dict(record)
+            files = record.pop("files")
+            message = from_record(ChatMessage, record, chat_group_id=self.chat_group_id)
+            message.is_archived = True
+            if message.user_id is not None:
+                # a deleted user shows as no user, as SET_NULL would
+                message.user = users.get(message.user_id)
+            message.cache_files(
+                from_record(MessageFile, file, message=message) for file in files
+            )
+            messages.append(message)
+        return messages
@@ -0,0 +1,67 @@
+from django.conf import settings
+
+__all__ = [
+    "HISTORY_ANCHORS",
+    "get_history",
+    "parse_history_params",
+]
+
+
+# message ids a history window can be anchored on, at most one per request
+HISTORY_ANCHORS = ("before", "after", "around")
+
+
+def parse_history_params(params):
+    """Read the anchor and limit of a history window from query params or a
+    websocket payload, the limit is clamped to `CHAT_HISTORY_MAX_LIMIT`
+
+    Returns:
+        dict: keyword arguments of `ChatMessageQueryset.history`
+
+    Raises:
+        ValueError: on a malformed id or limit, or more than one anchor
+    """
+    values = {
+        name: params.get(name)
+        for name in (*HISTORY_ANCHORS, "limit")
+        if params.get(name) not in (None, "")
+    }
+    try:
+        values = {name: int(value) for name, value in values.items()}
+    except (TypeError, ValueError):
+        raise ValueError(f"{', '.join(values)} must be integers")
+    limit = values.pop("limit", settings.CHAT_HISTORY_LIMIT)
+    if len(values) > 1:
+        raise ValueError("Only one of before, after and around can be given")
+    if limit <= 0:
+        raise ValueError("limit must be positive")
+    return {**values, "limit": min(limit, settings.CHAT_HISTORY_MAX_LIMIT)}
+
+
+def get_history(queryset, params, archive=None):
+    """Load the history window described by `params` from `queryset`,
+    continued into `archive` when given, see `chat.archive`
+
+    Returns:
+        dict: `results` newest first, `has_more` in the paged direction
+            (older unless paging `after` a message), `has_older` and
+            `has_newer`
+
+    Raises:
+        ValueError: on malformed params
+        DoesNotExist: when the anchor message is not in the queryset
+    """
+    kwargs = parse_history_params(params)
+    results, has_older, has_newer = queryset.history(**kwargs, archive=archive)
+    if "after" in kwargs:
+        has_more = has_newer
+    elif "around" in kwargs:
+        has_more = has_older or has_newer
+    else:
+        has_more = has_older
+    return {
+        "results": results,
+        "has_more": has_more,
+        "has_older": has_older,
+        "has_newer": has_newer,
+    }
@@ -0,0 +1,299 @@
+import json
+import tempfile
+import time
+from collections import Counter
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from chat.models import ChatGroup, ChatMembership, ChatMessage, MessageFile
+
+__all__ = [
+    "MessageImportError",
+    "import_messages",
+]
+
+
+MESSAGE_TYPES = {value for value, _ in ChatMessage.MESSAGE_TYPE_CHOICES}
+FILE_TYPES = {value for value, _ in MessageFile.FILE_TYPE_CHOICES}
+FILE_FIELDS = ("url", "file_type", "file_name", "thumbnail_url")
+# bytes of the import kept in memory while checked, the rest goes to disk
+SPOOL_SIZE = 16 * 1024 * 1024
+
+
+class MessageImportError(ValueError):
+    """
+    Invalid line of an import, `stats` counts what was imported before it
+    """
+
+    def __init__(self, line_number, message):
+        super().__init__(f"Line {line_number}: {message}")
+        self.line_number = line_number
+        self.stats = None
+
+
+def parse_lines(lines):
+    """Yield `(line number, record)` for the non blank lines of a JSONL
+    stream, checking the shape of each record"""
+    for line_number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode("utf8")
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise MessageImportError(line_number, "invalid JSON")
+        if not isinstance(record, dict):
+            raise MessageImportError(line_number, "expected an object")
+        yield line_number, clean_record(line_number, record)
+
+
+def spool_lines(lines, spool):
+    """Yield `lines` as bytes, copying each into the binary file `spool` so
+    that the stream can be read again"""
+    for line in lines:
+        if isinstance(line, str):
+            line = line.encode("utf8")
+        if not line.endswith(b"\n"):
+            line += b"\n"
+        spool.write(line)
+        yield line
+
+
+def read_chunks(records, batch_size):
+    """Yield lists of at most `batch_size` records"""
+    while True:
+        chunk = list(islice(records, batch_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def clean_record(line_number, record):
+    try:
+        chat_group = int(record["chat_group"])
+        user = None if record.get("user") is None else int(record["user"])
+    except (KeyError, TypeError, ValueError):
+        raise MessageImportError(line_number, "chat_group and user must be ids")
+    message_type = record.get("message_type") or "text"
+    if message_type not in MESSAGE_TYPES:
+        raise MessageImportError(line_number, f"unknown message_type {message_type}")
+    created_at = record.get("created_at")
+    if created_at is not None:
+        created_at = parse_datetime(str(created_at))
+        if created_at is None:
+            raise MessageImportError(line_number, "created_at must be ISO 8601")
+        if timezone.is_naive(created_at):
+            created_at = timezone.make_aware(created_at)
+    files = record.get("files") or []
+    if not isinstance(files, list) or not all(isinstance(f, dict) for f in files):
+        raise MessageImportError(line_number, "files must be a list of objects")
+    for attachment in files:
+        if attachment.get("file_type", "image") not in FILE_TYPES:
+            raise MessageImportError(
+                line_number, f"unknown file_type {attachment['file_type']}"
+            )
+    return {
+        "chat_group": chat_group,
+        "user": user,
+        "text": record.get("text"),
+        "message_type": message_type,
+        "created_at": created_at,
+        "files": [
+            {name: attachment[name] for name in FILE_FIELDS if name in attachment}
+            for attachment in files
+        ],
+    }
+
+
+def check_references(chunk, chat_groups):
+    """Fail on the first record of `chunk` referencing an unknown chat group
+    or user, or a chat group outside of `chat_groups` when given"""
+    group_ids = {record["chat_group"] for _, record in chunk}
+    user_ids = {record["user"] for _, record in chunk} - {None}
+    existing_groups = ChatGroup.objects.filter(pk__in=group_ids)
+    if chat_groups is not None:
+        existing_groups = existing_groups.filter(pk__in=chat_groups)
+    existing_groups = set(existing_groups.values_list("pk", flat=True))
+    existing_users = set(
+        get_user_model().objects.filter(pk__in=user_ids).values_list("pk", flat=True)
+    )
+    for line_number, record in chunk:
+        if record["chat_group"] not in existing_groups:
+            raise MessageImportError(
+                line_number, f"unknown chat group {record['chat_group']}"
+            )
+        if record["user"] is not None and record["user"] not in existing_users:
+            raise MessageImportError(line_number, f"unknown user {record['user']}")
+
+
+def check_order(chunk, latest):
+    """Fail on the first record of `chunk` older than the last message of
+    its chat group: imports append to the history of a chat, so that
+    sequence numbers, read watermarks and the inbox keep following time.
+    `latest` maps chat group ids to the time of their last message, the
+    missing ones are read from the database, and is updated with `chunk`"""
+    missing = {record["chat_group"] for _, record in chunk} - set(latest)
+    latest.update(
+        ChatGroup.objects.filter(pk__in=missing).values_list("pk", "last_message_at")
+    )
+    for line_number, record in chunk:
+        last_message_at = latest[record["chat_group"]]
+        if last_message_at is not None and record["created_at"] < last_message_at:
+            raise MessageImportError(
+                line_number,
+                f"created_at is before the last message of chat group "
+                f"{record['chat_group']}, only newer messages can be imported",
+            )
+    for _, record in chunk:
+        last_message_at = latest[record["chat_group"]]
+        if last_message_at is None or record["created_at"] > last_message_at:
+            latest[record["chat_group"]] = record["created_at"]
+
+
+def set_created_at(chunk):
+    """Date the records of `chunk` without `created_at` now"""
+    now = timezone.now()
+    for _, record in chunk:
+        record["created_at"] = record["created_at"] or now
+
+
+def check_chunks(chunks, chat_groups=None):
+    """Check the references and the order of all `chunks` before any is
+    written, so that an invalid line fails the import as a whole"""
+    latest = {}
+    for chunk in chunks:
+        check_references(chunk, chat_groups)
+        set_created_at(chunk)
+        check_order(chunk, latest)
+
+
+def import_chunk(chunk, chat_groups=None):
+    """Write the messages of `chunk` with their files and the memberships of
+    their authors in one transaction, a few statements per table
+
+    Returns:
+        Counter: number of messages, files and memberships created
+    """
+    check_references(chunk, chat_groups)
+    set_created_at(chunk)
+    with transaction.atomic():
+        # `bulk_create` skips the signals numbering messages one at a time,
+        # reserve a range of sequence numbers per chat group instead, which
+        # also locks the groups until the chunk is written
+        next_seq = {}
+        for chat_group_id, count in Counter(
+            record["chat_group"] for _, record in chunk
+        ).items():
+            last = ChatGroup.objects.next_message_seq(chat_group_id, count)
+            next_seq[chat_group_id] = last - count + 1
+        # again, messages may have been sent since the import was checked
+        check_order(chunk, {})
+        # numbered in time order, whatever the order of the lines
+        records = sorted(
+            (record for _, record in chunk), key=lambda record: record["created_at"]
+        )
+        messages = []
+        for record in records:
+            seq = next_seq[record["chat_group"]]
+            next_seq[record["chat_group"]] += 1
+            messages.append(
+                ChatMessage(
+                    chat_group_id=record["chat_group"],
+                    user_id=record["user"],
+                    text=record["text"],
+                    message_type=record["message_type"],
+                    seq=seq,
+                    created_at=record["created_at"],
+                )
+            )
+        files = ChatMessage.objects.bulk_insert(
+            messages,
+            [
+                MessageFile(message=message, **attachment)
+                for message, record in zip(messages, records)
+                for attachment in record["files"]
+            ],
+            count_unread=False,
+        )
+
+        pairs = {
+            (record["chat_group"], record["user"])
+            for record in records
+            if record["user"] is not None
+        }
+        existing = set(
+            ChatMembership.objects.filter(
+                chat_group__in={chat_group for chat_group, _ in pairs},
+                user__in={user for _, user in pairs},
+            ).values_list("chat_group", "user")
+        )
+        memberships = ChatMembership.objects.bulk_create(
+            [
+                ChatMembership(chat_group_id=chat_group, user_id=user)
+                for chat_group, user in pairs - existing
+            ],
+            ignore_conflicts=True,
+        )
+    return Counter(
+        messages=len(messages), files=len(files), memberships=len(memberships)
+    )
+
+
+def import_messages(lines, chat_groups=None, batch_size=1000):
+    """Import chat messages from a stream of JSONL lines, one message per
+    line. The stream is checked whole first, copied aside as it is read,
+    then written in chunks of `batch_size` committed one by one:
+
+        {"chat_group": 1, "user": 2, "text": "Hi", "message_type": "text",
+         "created_at": "2024-01-01T10:00:00Z", "files": [{"url": "..."}]}
+
+    Messages are appended to the history of their chat group: a message
+    older than the last one of its chat group, or than a message of an
+    earlier chunk, is rejected, so import the history of a chat before it
+    gets new messages and sort the lines by time. Messages are numbered
+    after the existing ones in time order and indexed for search, their
+    authors are made members, unread counters are left alone.
+
+    Args:
+        lines: iterable of str or bytes lines, read lazily
+        chat_groups: ids the messages may be imported into, any when None
+        batch_size: number of messages written per chunk
+
+    Returns:
+        dict: messages, files and memberships created, seconds spent and
+            messages_per_second
+
+    Raises:
+        MessageImportError: on the first invalid line, before anything is
+            imported unless a message was sent to the chat group during the
+            import, then the chunks before it stay imported
+    """
+    stats = Counter(messages=0, files=0, memberships=0)
+    start = time.perf_counter()
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as spool:
+            check_chunks(
+                read_chunks(parse_lines(spool_lines(lines, spool)), batch_size),
+                chat_groups,
+            )
+            spool.seek(0)
+            for chunk in read_chunks(parse_lines(spool), batch_size):
+                stats.update(import_chunk(chunk, chat_groups))
+    except MessageImportError as error:
+        error.stats = get_stats(stats, start)
+        raise
+    return get_stats(stats, start)
+
+
+def get_stats(counts, start):
+    seconds = time.perf_counter() - start
+    return {
+        **counts,
+        "seconds": round(seconds, 3),
+        "messages_per_second": round(counts["messages"] / seconds, 1) if seconds else 0,
+    }
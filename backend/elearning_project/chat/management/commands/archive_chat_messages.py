@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat.archive import archive_messages, get_archive_cutoff
+
+
+class Command(BaseCommand):
+    help = (
+        "Move old chat messages into compressed per group segments, in "
+        "batches, can be stopped and run again at any point"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than-days",
+            type=int,
+            default=settings.CHAT_ARCHIVE_AFTER_DAYS,
+            help="Age in days past which messages are archived",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of messages per segment and transaction",
+        )
+
+    def handle(self, *args, **options):
+        stats = archive_messages(
+            before=get_archive_cutoff(options["older_than_days"]),
+            batch_size=options["batch_size"],
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Archived {stats['messages']} chat messages into "
+                f"{stats['segments']} segments"
+            )
+        )
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from chat.models import ChatGroup
+
+
+class Command(BaseCommand):
+    help = "Number chat messages and set the last message of every chat group"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of messages updated per query",
+        )
+
+    def handle(self, *args, **options):
+        total = ChatGroup.objects.backfill(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Numbered {total} chat messages"))
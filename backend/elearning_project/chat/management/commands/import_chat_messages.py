@@ -0,0 +1,36 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.importer import MessageImportError, import_messages
+
+
+class Command(BaseCommand):
+    help = "Import chat messages from a JSONL file, one message per line"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="JSONL file to import, - for stdin")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of messages written per transaction",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        stream = sys.stdin if path == "-" else open(path, encoding="utf8")
+        try:
+            stats = import_messages(stream, batch_size=options["batch_size"])
+        except MessageImportError as error:
+            raise CommandError(f"{error} ({error.stats['messages']} imported before)")
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {stats['messages']} chat messages, {stats['files']} "
+                f"files and {stats['memberships']} memberships in "
+                f"{stats['seconds']}s ({stats['messages_per_second']} messages/s)"
+            )
+        )
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from chat.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full text search index of chat messages"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of messages indexed per batch",
+        )
+
+    def handle(self, *args, **options):
+        total = rebuild_search_index(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {total} chat messages"))
@@ -0,0 +1,100 @@
+# Generated by Django 5.1.1 on 2026-10-18 20:13
+
+import core.models
+import django.db.models.deletion
+import django.db.models.expressions
+from django.conf import settings
+from django.db import migrations, models
+
+
+def number_messages(apps, schema_editor, batch_size=1000):
+    ChatGroup = apps.get_model("chat", "ChatGroup")
+    ChatMessage = apps.get_model("chat", "ChatMessage")
+
+    for chat_group_id in ChatGroup.objects.order_by("pk").values_list("pk", flat=True):
+        seq = 0
+        last_message = None
+        batch = []
+        for message in (
+            ChatMessage.objects.filter(chat_group=chat_group_id)
+            .order_by("created_at", "pk")
+            .only("pk", "created_at")
+            .iterator(chunk_size=batch_size)
+        ):
+            seq += 1
+            message.seq = seq
+            last_message = message
+            batch.append(message)
+            if len(batch) == batch_size:
+                ChatMessage.objects.bulk_update(batch, ["seq"])
+                batch = []
+        ChatMessage.objects.bulk_update(batch, ["seq"])
+        ChatGroup.objects.filter(pk=chat_group_id).update(
+            message_seq=seq,
+            last_message=last_message,
+            last_message_at=last_message.created_at if last_message else None,
+        )
+
+
+class Migration(migrations.Migration):
+    """
+    Existing messages are numbered in creation order and the last one of
+    each group becomes its last message.
+    """
+
+    dependencies = [
+        ("chat", "0001_initial"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatgroup",
+            name="last_message",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="chat.chatmessage",
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatgroup",
+            name="last_message_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="chatgroup",
+            name="message_seq",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="chatmessage",
+            name="seq",
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="chatgroup",
+            index=core.models.NullsOrderIndex(
+                django.db.models.expressions.OrderBy(
+                    django.db.models.expressions.F("last_message_at"),
+                    descending=True,
+                    nulls_last=True,
+                ),
+                django.db.models.expressions.OrderBy(
+                    django.db.models.expressions.F("created_at"), descending=True
+                ),
+                name="chat_group_inbox",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="chatmessage",
+            constraint=models.UniqueConstraint(
+                fields=("chat_group", "seq"), name="chat_message_seq_unique"
+            ),
+        ),
+        # last, PostgreSQL refuses schema changes to a table with the foreign
+        # key checks of updated rows still pending
+        migrations.RunPython(number_messages, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.1.1 on 2026-10-18 20:17
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def delete_duplicates(model, fields):
+    """Keep the oldest row of each `fields` combination"""
+    duplicates = (
+        model.objects.order_by()
+        .values(*fields)
+        .annotate(keep=Min("pk"), rows=Count("pk"))
+        .filter(rows__gt=1)
+    )
+    for row in duplicates:
+        keep = row.pop("keep")
+        row.pop("rows")
+        model.objects.filter(**row).exclude(pk=keep).delete()
+
+
+def delete_duplicate_rows(apps, schema_editor):
+    delete_duplicates(apps.get_model("chat", "ChatMembership"), ["chat_group", "user"])
+    delete_duplicates(apps.get_model("chat", "ChatMessageRead"), ["user", "message"])
+
+
+class Migration(migrations.Migration):
+    """
+    Duplicate memberships and message reads are deleted, keeping the oldest
+    row, before the unique constraints are added.
+    """
+
+    dependencies = [
+        ("chat", "0002_chatgroup_last_message"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_rows, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="chatmembership",
+            index=models.Index(
+                fields=["user", "chat_group"], name="chat_membership_user"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="chatmessage",
+            index=models.Index(
+                fields=["chat_group", "-created_at", "-id"], name="chat_message_recent"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="chatmembership",
+            constraint=models.UniqueConstraint(
+                fields=("chat_group", "user"), name="chat_membership_unique"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="chatmessageread",
+            constraint=models.UniqueConstraint(
+                fields=("user", "message"), name="chat_message_read_unique"
+            ),
+        ),
+    ]
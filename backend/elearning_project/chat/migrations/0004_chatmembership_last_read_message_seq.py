@@ -0,0 +1,85 @@
+# Generated by Django 5.1.1 on 2026-10-18 20:24
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def collapse_message_reads(apps, schema_editor):
+    ChatMembership = apps.get_model("chat", "ChatMembership")
+    ChatMessage = apps.get_model("chat", "ChatMessage")
+    ChatMessageRead = apps.get_model("chat", "ChatMessageRead")
+
+    # everything sent before the member last opened the chat is read
+    ChatMembership.objects.filter(last_read__isnull=False).update(
+        last_read_message_seq=Coalesce(
+            Subquery(
+                ChatMessage.objects.filter(
+                    chat_group=OuterRef("chat_group"),
+                    created_at__lte=OuterRef("last_read"),
+                    seq__isnull=False,
+                )
+                .order_by("-seq")
+                .values("seq")[:1]
+            ),
+            Value(0),
+        )
+    )
+
+    # and so is everything up to the newest message with a read row
+    watermarks = {
+        (row["message__chat_group"], row["user"]): row["seq"]
+        for row in ChatMessageRead.objects.filter(message__seq__isnull=False)
+        .order_by()
+        .values("message__chat_group", "user")
+        .annotate(seq=Max("message__seq"))
+    }
+    batch = []
+    for membership in ChatMembership.objects.only(
+        "pk", "chat_group", "user", "last_read_message_seq"
+    ).iterator(chunk_size=1000):
+        seq = watermarks.get((membership.chat_group_id, membership.user_id), 0)
+        if seq > membership.last_read_message_seq:
+            membership.last_read_message_seq = seq
+            batch.append(membership)
+        if len(batch) == 1000:
+            ChatMembership.objects.bulk_update(batch, ["last_read_message_seq"])
+            batch = []
+    ChatMembership.objects.bulk_update(batch, ["last_read_message_seq"])
+
+
+class Migration(migrations.Migration):
+    """
+    Per message read rows are collapsed into the read watermark of each
+    membership, then dropped. Messages are numbered by 0002, so that no
+    read is lost.
+    """
+
+    dependencies = [
+        ("chat", "0003_chat_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatmembership",
+            name="last_read_message_seq",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="chatmembership",
+            index=models.Index(
+                fields=["chat_group", "last_read_message_seq"],
+                name="chat_membership_read",
+            ),
+        ),
+        migrations.RunPython(collapse_message_reads, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="chatmessage",
+            name="reads",
+        ),
+        migrations.DeleteModel(
+            name="ChatMessageRead",
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.1.1 on 2026-10-18 20:27
+
+import django.db.models.deletion
+import django.db.models.functions.comparison
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chat", "0004_chatmembership_last_read_message_seq"),
+        ("courses", "0008_coursemembership_course_membership_user"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatgroup",
+            name="high_user",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatgroup",
+            name="low_user",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="chatgroup",
+            constraint=models.UniqueConstraint(
+                django.db.models.functions.comparison.Coalesce(
+                    django.db.models.functions.comparison.Cast(
+                        "course", models.BigIntegerField()
+                    ),
+                    models.Value(0),
+                ),
+                models.F("low_user"),
+                models.F("high_user"),
+                condition=models.Q(("chat_type", "individual")),
+                name="chat_group_individual_pair",
+            ),
+        ),
+    ]
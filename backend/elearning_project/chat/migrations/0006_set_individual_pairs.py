@@ -0,0 +1,53 @@
+# Generated by Django 5.1.1 on 2026-10-18 20:27
+
+from django.db import migrations
+
+
+def set_individual_pairs(apps, schema_editor):
+    ChatGroup = apps.get_model("chat", "ChatGroup")
+    ChatMembership = apps.get_model("chat", "ChatMembership")
+
+    members = {}
+    for chat_group_id, user_id in (
+        ChatMembership.objects.filter(chat_group__chat_type="individual")
+        .order_by()
+        .values_list("chat_group", "user")
+    ):
+        members.setdefault(chat_group_id, set()).add(user_id)
+
+    pairs = set()
+    batch = []
+    for chat_group in (
+        ChatGroup.objects.filter(chat_type="individual")
+        .order_by("created_at", "pk")
+        .only("pk", "course")
+    ):
+        users = members.get(chat_group.pk, set())
+        if len(users) != 2:
+            continue
+        low_user_id, high_user_id = sorted(users)
+        pair = (chat_group.course_id, low_user_id, high_user_id)
+        # duplicates created before the constraint keep their members but
+        # are no longer returned by the pair lookup
+        if pair in pairs:
+            continue
+        pairs.add(pair)
+        chat_group.low_user_id, chat_group.high_user_id = low_user_id, high_user_id
+        batch.append(chat_group)
+    ChatGroup.objects.bulk_update(batch, ["low_user", "high_user"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    """
+    The oldest individual chat of each pair of users gets the pair key.
+    Kept apart from 0005, PostgreSQL refuses schema changes to a table with
+    the foreign key checks of updated rows still pending.
+    """
+
+    dependencies = [
+        ("chat", "0005_chatgroup_individual_pair"),
+    ]
+
+    operations = [
+        migrations.RunPython(set_individual_pairs, migrations.RunPython.noop),
+    ]
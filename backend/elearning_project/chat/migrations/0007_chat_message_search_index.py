@@ -0,0 +1,72 @@
+from django.db import migrations
+
+# the index as of this migration, later changes to `chat.search` must not
+# change what this migration does
+SEARCH_TABLE = "tb_chat_message_search"
+
+CREATE_INDEX = {
+    "sqlite": [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+        "USING fts5(text, tokenize='porter unicode61')",
+    ],
+    "postgresql": [
+        f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+        "message_id bigint PRIMARY KEY REFERENCES tb_chat_messages (id) "
+        "ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+        "document tsvector NOT NULL)",
+        f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_gin "
+        f"ON {SEARCH_TABLE} USING GIN (document)",
+    ],
+}
+
+INSERT_DOCUMENT = {
+    "sqlite": f"INSERT INTO {SEARCH_TABLE} (rowid, text) VALUES (%s, %s)",
+    "postgresql": f"INSERT INTO {SEARCH_TABLE} (message_id, document) "
+    "VALUES (%s, to_tsvector('english', %s))",
+}
+
+
+def create_search_index(apps, schema_editor, batch_size=1000):
+    vendor = schema_editor.connection.vendor
+    if vendor not in CREATE_INDEX:
+        return
+    ChatMessage = apps.get_model("chat", "ChatMessage")
+    # deleted and empty messages are kept out of the index
+    documents = (
+        ChatMessage.objects.exclude(text__isnull=True)
+        .exclude(text="")
+        .filter(is_deleted_by_sender=False, is_deleted_by_admin=False)
+        .order_by("pk")
+        .values_list("pk", "text")
+    )
+    with schema_editor.connection.cursor() as cursor:
+        for statement in CREATE_INDEX[vendor]:
+            cursor.execute(statement)
+        batch = []
+        for document in documents.iterator(chunk_size=batch_size):
+            batch.append(document)
+            if len(batch) == batch_size:
+                cursor.executemany(INSERT_DOCUMENT[vendor], batch)
+                batch = []
+        if batch:
+            cursor.executemany(INSERT_DOCUMENT[vendor], batch)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE_INDEX:
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+class Migration(migrations.Migration):
+    """
+    The search index is created and filled with the existing messages.
+    """
+
+    dependencies = [
+        ("chat", "0006_set_individual_pairs"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
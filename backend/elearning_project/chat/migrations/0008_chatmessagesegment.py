@@ -0,0 +1,74 @@
+# Generated by Django 5.1.1 on 2026-10-18 20:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """
+    Messages are moved to the segments by
+    `manage.py archive_chat_messages`, run it periodically.
+    """
+
+    dependencies = [
+        ("chat", "0007_chat_message_search_index"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChatMessageSegment",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("first_id", models.PositiveBigIntegerField()),
+                ("last_id", models.PositiveBigIntegerField()),
+                ("first_seq", models.PositiveBigIntegerField()),
+                ("last_seq", models.PositiveBigIntegerField()),
+                ("first_created_at", models.DateTimeField()),
+                ("last_created_at", models.DateTimeField()),
+                ("messages_count", models.PositiveIntegerField()),
+                ("payload", models.BinaryField()),
+                (
+                    "chat_group",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="message_segments",
+                        to="chat.chatgroup",
+                    ),
+                ),
+                (
+                    "created_by",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="%(class)s_created_by",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "tb_chat_message_segments",
+                "ordering": ["chat_group", "first_seq"],
+                "indexes": [
+                    models.Index(
+                        fields=["chat_group", "-last_created_at"],
+                        name="chat_segment_recent",
+                    ),
+                    models.Index(
+                        fields=["chat_group", "first_id"], name="chat_segment_ids"
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -1,7 +1,13 @@
 from django.db import models
+from django.db.models import F
 
-from core.models import BaseModel
-from .querysets import ChatGroupQueryset
+from core.models import AtomicSaveMixin, BaseModel, NullsOrderIndex
+from .querysets import (
+    INDIVIDUAL_PAIR_COURSE,
+    ChatGroupQueryset,
+    ChatMembershipQueryset,
+    ChatMessageQueryset,
+)
 
 
 class ChatGroup(BaseModel):
@@ -12,6 +18,26 @@ class ChatGroup(BaseModel):
     class Meta:
         db_table = "tb_chat_groups"
         ordering = ["-created_at"]
+        indexes = [
+            # inbox order, see `ChatGroupQueryset.mine`
+            NullsOrderIndex(
+                F("last_message_at").desc(nulls_last=True),
+                F("created_at").desc(),
+                name="chat_group_inbox",
+            ),
+        ]
+        constraints = [
+            # one individual chat per pair of users and course, see
+            # `ChatGroupQueryset.get_or_create_individual`. Chats without a
+            # course are keyed by 0, nulls would never collide
+            models.UniqueConstraint(
+                INDIVIDUAL_PAIR_COURSE,
+                F("low_user"),
+                F("high_user"),
+                condition=models.Q(chat_type="individual"),
+                name="chat_group_individual_pair",
+            ),
+        ]
 
     objects = ChatGroupQueryset.as_manager()
 
@@ -50,6 +76,31 @@ class ChatGroup(BaseModel):
         through="ChatMembership",
         through_fields=("chat_group", "user"),
     )
+    # denormalized from the messages of the group, see `chat.signals`
+    message_seq = models.PositiveBigIntegerField(default=0)
+    last_message = models.ForeignKey(
+        "ChatMessage",
+        on_delete=models.SET_NULL,
+        related_name="+",
+        null=True,
+        blank=True,
+    )
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    # members of an individual chat, lowest user id first
+    low_user = models.ForeignKey(
+        "accounts.User",
+        on_delete=models.SET_NULL,
+        related_name="+",
+        null=True,
+        blank=True,
+    )
+    high_user = models.ForeignKey(
+        "accounts.User",
+        on_delete=models.SET_NULL,
+        related_name="+",
+        null=True,
+        blank=True,
+    )
 
     def __str__(self):
         return self.name
@@ -63,6 +114,22 @@ class ChatMembership(BaseModel):
     class Meta:
         db_table = "tb_chat_memberships"
         ordering = ["-created_at"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["chat_group", "user"], name="chat_membership_unique"
+            ),
+        ]
+        indexes = [
+            # chats of a user, see `ChatGroupQueryset.mine`
+            models.Index(fields=["user", "chat_group"], name="chat_membership_user"),
+            # readers of a message, see `ChatMembershipQueryset.read_by`
+            models.Index(
+                fields=["chat_group", "last_read_message_seq"],
+                name="chat_membership_read",
+            ),
+        ]
+
+    objects = ChatMembershipQueryset.as_manager()
 
     chat_group = models.ForeignKey(
         ChatGroup, on_delete=models.CASCADE, related_name="chat_memberships"
@@ -71,6 +138,9 @@ class ChatMembership(BaseModel):
         "accounts.User", on_delete=models.CASCADE, related_name="chat_memberships"
     )
     last_read = models.DateTimeField(blank=True, null=True)
+    # every message up to this `ChatMessage.seq` is read by the member
+    last_read_message_seq = models.PositiveBigIntegerField(default=0)
+    # counted on message creation, recounted when the chat is marked read
     unread_messages = models.IntegerField(default=0)
     cleared = models.DateTimeField(blank=True, null=True)
     last_date = models.DateTimeField(blank=True, null=True)
@@ -83,7 +153,7 @@ class ChatMembership(BaseModel):
         return self.user.email
 
 
-class ChatMessage(BaseModel):
+class ChatMessage(AtomicSaveMixin, BaseModel):
     """
     ChatMessage Model for storing chat message details
     """
@@ -91,6 +161,19 @@ class ChatMessage(BaseModel):
     class Meta:
         db_table = "tb_chat_messages"
         ordering = ["-created_at"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["chat_group", "seq"], name="chat_message_seq_unique"
+            ),
+        ]
+        indexes = [
+            # history of a chat group, newest first
+            models.Index(
+                fields=["chat_group", "-created_at", "-id"], name="chat_message_recent"
+            ),
+        ]
+
+    objects = ChatMessageQueryset.as_manager()
 
     MESSAGE_TYPE_CHOICES = (
         ("text", "Text"),
@@ -122,12 +205,8 @@ class ChatMessage(BaseModel):
         blank=True,
     )
     text = models.TextField(null=True, blank=True)
-    reads = models.ManyToManyField(
-        "accounts.User",
-        related_name="read_messages",
-        through="ChatMessageRead",
-        through_fields=("message", "user"),
-    )
+    # position of the message in its group, assigned on insert
+    seq = models.PositiveBigIntegerField(null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True)
     removed_at = models.DateTimeField(blank=True, null=True)
     # message deleted by sender
@@ -140,27 +219,12 @@ class ChatMessage(BaseModel):
             self.text if self.text else f"No Text - Message Type: {self.message_type}"
         )
 
-
-class ChatMessageRead(BaseModel):
-    """
-    ChatMessageRead Model for storing chat message read details
-    """
-
-    class Meta:
-        db_table = "tb_chat_message_reads"
-        ordering = ["-created_at"]
-
-    message = models.ForeignKey(
-        ChatMessage, on_delete=models.CASCADE, related_name="message_reads"
-    )
-    user = models.ForeignKey(
-        "accounts.User", on_delete=models.CASCADE, related_name="message_reads"
-    )
-    read_at = models.DateTimeField(auto_now=True)
-    is_active = models.BooleanField(default=True)
-
-    def __str__(self):
-        return self.read_at
+    def cache_files(self, files):
+        """Cache `files` as `prefetch_related("files")` would, so that
+        rendering the message does not query them"""
+        queryset = self.files.all()
+        queryset._result_cache, queryset._prefetch_done = list(files), True
+        self._prefetched_objects_cache = {"files": queryset}
 
 
 class MessageFile(BaseModel):
@@ -190,3 +254,36 @@ class MessageFile(BaseModel):
     file_name = models.CharField(max_length=200, default="", null=True, blank=True)
     # Required if file_type is video
     thumbnail_url = models.URLField(default="", max_length=2000, null=True, blank=True)
+
+
+class ChatMessageSegment(BaseModel):
+    """
+    Append-only batch of archived messages of a chat group, stored as
+    compressed JSON, see `chat.archive`
+    """
+
+    class Meta:
+        db_table = "tb_chat_message_segments"
+        ordering = ["chat_group", "first_seq"]
+        indexes = [
+            models.Index(
+                fields=["chat_group", "-last_created_at"], name="chat_segment_recent"
+            ),
+            models.Index(fields=["chat_group", "first_id"], name="chat_segment_ids"),
+        ]
+
+    chat_group = models.ForeignKey(
+        ChatGroup, related_name="message_segments", on_delete=models.CASCADE
+    )
+    # bounds of the archived messages, to find the segments of a window
+    first_id = models.PositiveBigIntegerField()
+    last_id = models.PositiveBigIntegerField()
+    first_seq = models.PositiveBigIntegerField()
+    last_seq = models.PositiveBigIntegerField()
+    first_created_at = models.DateTimeField()
+    last_created_at = models.DateTimeField()
+    messages_count = models.PositiveIntegerField()
+    payload = models.BinaryField()
+
+    def __str__(self):
+        return f"{self.chat_group_id}: {self.first_seq}-{self.last_seq}"
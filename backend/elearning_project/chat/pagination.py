@@ -0,0 +1,53 @@
+from types import SimpleNamespace
+
+from django.db.models import Sum
+
+from core.pagination import CursorResultsSetPagination
+
+from .models import ChatMessage
+
+__all__ = [
+    "ArchiveCursorPagination",
+]
+
+
+class ArchiveCursorPagination(CursorResultsSetPagination):
+    """
+    Cursor pagination of the messages of a chat continued into its archive
+    past the hot rows, with the archive of the view's `get_archive`, see
+    `chat.archive.ChatArchive`. Pages mix both the same way as the history
+    windows of `ChatMessageQueryset.history`, on the default `created_at`
+    ordering only. Other querysets of the view, eg. the memberships of
+    its `reads` action, are paged without the archive.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.archive = None
+        if (
+            view is not None
+            and hasattr(view, "get_archive")
+            and queryset.model is ChatMessage
+        ):
+            self.archive = view.get_archive()
+        page = super().paginate_queryset(queryset, request, view)
+        if self.count is not None and self.archive is not None:
+            archived = self.archive.segments.aggregate(count=Sum("messages_count"))
+            self.count += archived["count"] or 0
+        return page
+
+    def get_rows(self, queryset, cursor, descending):
+        rows = super().get_rows(queryset, cursor, descending)
+        if self.archive is None or self.field != "created_at":
+            return rows
+        anchor = None
+        if cursor is not None:
+            anchor = SimpleNamespace(created_at=cursor["value"], pk=cursor["pk"])
+        count = self.page_size + 1
+        if descending:
+            if len(rows) >= count:
+                return rows
+            rows.extend(self.archive.older_than(anchor, count))
+        elif anchor is not None:
+            rows.extend(self.archive.newer_than(anchor, count))
+        rows.sort(key=lambda row: (row.created_at, row.pk), reverse=descending)
+        return rows[:count]
@@ -1,6 +1,28 @@
-from django.db import models
+from collections import Counter, defaultdict
 
-from django.db.models import F, Max
+from django.apps import apps
+from django.db import IntegrityError, models, transaction
+
+from django.db.models import (
+    Case,
+    Count,
+    Exists,
+    F,
+    Max,
+    OuterRef,
+    Prefetch,
+    Q,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Cast, Coalesce
+from django.utils import timezone
+
+
+# course part of the pair key of individual chats, see
+# `ChatGroupQueryset.get_or_create_individual`
+INDIVIDUAL_PAIR_COURSE = Coalesce(Cast("course", models.BigIntegerField()), Value(0))
 
 
 class ChatGroupQueryset(models.QuerySet):
@@ -10,18 +32,485 @@ class ChatGroupQueryset(models.QuerySet):
         Returns:
             Queryset: Queryset of all chat group objects
         """
+        # ordered on the denormalized last message time, see `chat.signals`
+        return self.filter(chat_memberships__user=user).order_by(
+            F("last_message_at").desc(nulls_last=True), "-created_at"
+        )
+
+    def get_or_create_individual(self, course, user, other_user_id, **defaults):
+        """Return the individual chat of `user` and `other_user_id` in a
+        course, creating it along with both memberships when missing. The
+        lookup is a single row of the `chat_group_individual_pair`
+        constraint, which also settles concurrent creations
+
+        Returns:
+            tuple: (chat group, whether it was created)
+        """
+        ChatMembership = apps.get_model("chat", "ChatMembership")
+
+        low_user_id, high_user_id = sorted([user.pk, int(other_user_id)])
+        lookup = {
+            "course_id": getattr(course, "pk", course),
+            "chat_type": "individual",
+            "low_user_id": low_user_id,
+            "high_user_id": high_user_id,
+        }
+        pairs = self.alias(pair_course=INDIVIDUAL_PAIR_COURSE).filter(
+            pair_course=lookup["course_id"] or 0,
+            chat_type="individual",
+            low_user_id=low_user_id,
+            high_user_id=high_user_id,
+        )
+        chat_group = pairs.first()
+        if chat_group is not None:
+            return chat_group, False
+        try:
+            with transaction.atomic():
+                chat_group = self.create(
+                    **lookup, admin=user, created_by=user, **defaults
+                )
+                ChatMembership.objects.bulk_create(
+                    [
+                        ChatMembership(
+                            chat_group=chat_group, user_id=user_id, is_admin=True
+                        )
+                        for user_id in (user.pk, int(other_user_id))
+                    ]
+                )
+        except IntegrityError:
+            # created by a concurrent request meanwhile
+            return pairs.get(), False
+        return chat_group, True
+
+    def next_message_seq(self, chat_group_id, count=1):
+        """Reserve the next `count` message sequence numbers of a chat
+        group. The row stays locked until the transaction ends, so numbers
+        are handed out in commit order
+
+        Returns:
+            int: last reserved sequence number, the sequence number of the
+                new message when `count` is 1
+        """
+        self.filter(pk=chat_group_id).update(message_seq=F("message_seq") + count)
+        return self.filter(pk=chat_group_id).values_list("message_seq", flat=True)[0]
+
+    def set_last_message(self, message):
+        """Point the chat group of `message` at it, unless a later message
+        was numbered meanwhile
+
+        Returns:
+            int: number of chat groups updated
+        """
+        return self.filter(pk=message.chat_group_id, message_seq=message.seq).update(
+            last_message=message, last_message_at=message.created_at
+        )
+
+    def advance_last_message(self, messages):
+        """Point the chat groups of `messages` at the latest of them, unless
+        they already point at a later message, eg. once older history is
+        inserted"""
+        latest = {}
+        for message in sorted(messages, key=lambda message: message.created_at):
+            latest[message.chat_group_id] = message
+        for chat_group_id, message in latest.items():
+            self.filter(
+                Q(last_message_at__isnull=True)
+                | Q(last_message_at__lte=message.created_at),
+                pk=chat_group_id,
+            ).update(last_message=message, last_message_at=message.created_at)
+
+    def refresh_last_message(self, chat_group_ids):
+        """Point the given chat groups at their latest remaining message"""
+        ChatMessage = apps.get_model("chat", "ChatMessage")
+
+        for chat_group_id in chat_group_ids:
+            message = (
+                ChatMessage.objects.filter(chat_group=chat_group_id)
+                .order_by(F("seq").desc(nulls_last=True), "-created_at", "-pk")
+                .only("pk", "created_at")
+                .first()
+            )
+            self.filter(pk=chat_group_id).update(
+                last_message=message,
+                last_message_at=message.created_at if message else None,
+            )
+
+    def backfill(self, batch_size=1000):
+        """Number the messages without a sequence number in creation order,
+        after the numbered ones, and set the last message of every group
+
+        Returns:
+            int: number of messages numbered
+        """
+        ChatMessage = apps.get_model("chat", "ChatMessage")
+
+        total = 0
+        for chat_group_id in self.order_by("pk").values_list("pk", flat=True):
+            with transaction.atomic():
+                # lock the group so that no message is numbered meanwhile
+                list(self.select_for_update().filter(pk=chat_group_id).values("pk"))
+                messages = ChatMessage.objects.filter(chat_group=chat_group_id)
+                seq = messages.aggregate(seq=Max("seq"))["seq"] or 0
+                batch = []
+                for message in (
+                    messages.filter(seq__isnull=True)
+                    .order_by("created_at", "pk")
+                    .only("pk")
+                    .iterator(chunk_size=batch_size)
+                ):
+                    seq += 1
+                    message.seq = seq
+                    batch.append(message)
+                    if len(batch) == batch_size:
+                        ChatMessage.objects.bulk_update(batch, ["seq"])
+                        total += len(batch)
+                        batch = []
+                ChatMessage.objects.bulk_update(batch, ["seq"])
+                total += len(batch)
+                self.filter(pk=chat_group_id).update(message_seq=seq)
+                self.refresh_last_message([chat_group_id])
+        return total
+
+    def course_group(self):
+        """Return the group chats of courses, the one created along with the
+        course first
+
+        Returns:
+            Queryset: Queryset of chat group objects
+        """
+        return self.filter(chat_type="group").order_by("created_at")
+
+    def with_viewer_state(self, user, counterparts=True, fields=None):
+        """Load what `ChatGroupSerializer` renders for `user`, so that a
+        page of chat groups is serialized in a constant number of queries:
+        the membership of `user`, the last message with its author and
+        files and, unless `counterparts` is False, the other member of
+        individual chats with their profile
+
+        Args:
+            user: requesting user, whose membership holds the chat state
+            counterparts: whether to load the other member of individual chats
+            fields: names of the rendered fields, the joins and prefetches
+                only read by other fields are skipped. All when None
+
+        Returns:
+            Queryset: Queryset of chat group objects
+        """
+        ChatMembership = apps.get_model("chat", "ChatMembership")
+
+        def renders(*names):
+            return fields is None or any(name in fields for name in names)
+
+        authenticated = user is not None and user.is_authenticated
         queryset = self
-        queryset = (
-            queryset.filter(
-                chat_memberships__user=user,
+        prefetches = []
+        if renders("last_message", "blocked", "unread"):
+            if authenticated:
+                memberships = ChatMembership.objects.filter(user=user)
+            else:
+                memberships = ChatMembership.objects.none()
+            prefetches.append(
+                Prefetch(
+                    "chat_memberships",
+                    queryset=memberships,
+                    to_attr="viewer_memberships",
+                )
+            )
+        if renders("last_message"):
+            queryset = queryset.select_related("last_message__user__profile")
+            prefetches.append("last_message__files")
+        if counterparts and renders("user"):
+            others = ChatMembership.objects.filter(
+                chat_group__chat_type="individual"
+            ).select_related("user__profile")
+            if authenticated:
+                others = others.exclude(user=user)
+            prefetches.append(
+                Prefetch(
+                    "chat_memberships",
+                    queryset=others,
+                    to_attr="counterpart_memberships",
+                )
+            )
+        return queryset.prefetch_related(*prefetches)
+
+
+class ChatMessageQueryset(models.QuerySet):
+    def visible_to(self, user):
+        """Return the messages of the chats of `user`, leaving out the ones
+        sent before the chat was cleared by `user` and deleted ones
+
+        Returns:
+            Queryset: Queryset of chat message objects
+        """
+        ChatMembership = apps.get_model("chat", "ChatMembership")
+
+        memberships = ChatMembership.objects.filter(
+            Q(cleared__isnull=True) | Q(cleared__lt=OuterRef("created_at")),
+            chat_group=OuterRef("chat_group"),
+            user=user,
+        )
+        return self.filter(
+            Exists(memberships), is_deleted_by_sender=False, is_deleted_by_admin=False
+        )
+
+    def search(self, text):
+        """Return the messages whose indexed text matches `text`, see
+        `chat.search`
+
+        Returns:
+            Queryset: Queryset of chat message objects annotated with
+                `search_rank` and `search_snippet`
+        """
+        from chat.search import search_messages
+
+        return search_messages(self, text)
+
+    def bulk_insert(self, messages, files=(), count_unread=True):
+        """Insert numbered `messages` with their `files` in a few statements,
+        keeping the `created_at` they were given, then do per chat group what
+        the post_save receivers do per message: move the last message
+        pointer forward, count the messages unread (unless `count_unread` is false)
+        and index them for search
+
+        Returns:
+            list: inserted files
+        """
+        ChatGroup = apps.get_model("chat", "ChatGroup")
+        ChatMembership = apps.get_model("chat", "ChatMembership")
+        MessageFile = apps.get_model("chat", "MessageFile")
+        from chat.search import SEARCH_FIELDS, index_messages
+
+        with transaction.atomic():
+            created_at = [message.created_at for message in messages]
+            self.bulk_create(messages)
+            # `auto_now_add` overwrites timestamps on insert, restore the
+            # given ones in a single UPDATE
+            dated = []
+            for message, value in zip(messages, created_at):
+                if value is not None:
+                    message.created_at = value
+                    dated.append(message)
+            self.bulk_update(dated, ["created_at"])
+            files = MessageFile.objects.bulk_create(files)
+            if count_unread:
+                ChatMembership.objects.count_unread_many(messages)
+            ChatGroup.objects.advance_last_message(messages)
+            index_messages(
+                [message.pk for message in messages],
+                messages=[
+                    {name: getattr(message, name) for name in SEARCH_FIELDS}
+                    for message in messages
+                ],
+            )
+        return files
+
+    def older_than(self, message):
+        """Return the messages before `message` in `(created_at, id)` order,
+        written as a range on `created_at` so that the index is searched
+
+        Returns:
+            Queryset: Queryset of chat message objects
+        """
+        return self.filter(
+            Q(created_at__lt=message.created_at) | Q(pk__lt=message.pk),
+            created_at__lte=message.created_at,
+        )
+
+    def newer_than(self, message):
+        """Return the messages after `message` in `(created_at, id)` order
+
+        Returns:
+            Queryset: Queryset of chat message objects
+        """
+        return self.filter(
+            Q(created_at__gt=message.created_at) | Q(pk__gt=message.pk),
+            created_at__gte=message.created_at,
+        )
+
+    def history(self, before=None, after=None, around=None, limit=50, archive=None):
+        """Return a window of at most `limit` messages read from the
+        `chat_message_recent` index: the latest ones, the ones `before` or
+        `after` a message id, or the ones `around` it, that message included.
+        Windows are anchored on a message so that messages sent meanwhile
+        never shift them. With an `archive` (see `chat.archive.ChatArchive`)
+        windows continue into the archived messages past the hot rows
+
+        Returns:
+            tuple: messages newest first, whether older messages remain and
+                whether newer messages remain
+
+        Raises:
+            DoesNotExist: when the anchor message is not in the queryset
+        """
+
+        if around is not None:
+            anchor = self._history_anchor(around, archive)
+            older_count = (limit - 1) // 2
+            older, has_older = self._history_older(anchor, older_count, archive)
+            newer, has_newer = self._history_newer(
+                anchor, limit - 1 - older_count, archive
+            )
+            return [*reversed(newer), anchor, *older], has_older, has_newer
+        if after is not None:
+            anchor = self._history_anchor(after, archive)
+            newer, has_newer = self._history_newer(anchor, limit, archive)
+            return list(reversed(newer)), True, has_newer
+        anchor = self._history_anchor(before, archive) if before is not None else None
+        older, has_older = self._history_older(anchor, limit, archive)
+        return older, has_older, before is not None
+
+    def _history_anchor(self, pk, archive):
+        try:
+            return self.get(pk=pk)
+        except self.model.DoesNotExist:
+            if archive is None:
+                raise
+            return archive.get(pk)
+
+    def _history_older(self, anchor, count, archive):
+        # at most `count` messages before `anchor`, the latest when None
+        queryset = self.order_by("-created_at", "-pk")
+        if anchor is not None:
+            queryset = queryset.older_than(anchor)
+        rows = list(queryset[: count + 1])
+        archived = getattr(anchor, "is_archived", False)
+        if archive is not None and (len(rows) <= count or archived):
+            rows.extend(archive.older_than(anchor, count + 1))
+            rows.sort(key=lambda row: (row.created_at, row.pk), reverse=True)
+        return rows[:count], len(rows) > count
+
+    def _history_newer(self, anchor, count, archive):
+        # at most `count` messages after `anchor`
+        rows = list(self.order_by("created_at", "pk").newer_than(anchor)[: count + 1])
+        if archive is not None and getattr(anchor, "is_archived", False):
+            rows.extend(archive.newer_than(anchor, count + 1))
+            rows.sort(key=lambda row: (row.created_at, row.pk))
+        return rows[:count], len(rows) > count
+
+
+class ChatMembershipQueryset(models.QuerySet):
+    def count_unread(self, message):
+        """Add `message` to the unread counter of the members of its chat
+        group, other than its author, in a single UPDATE
+
+        Returns:
+            int: number of memberships updated
+        """
+        return (
+            self.filter(
+                chat_group=message.chat_group_id, is_blocked=False, is_suspended=False
             )
-            .annotate(
-                last_message=Max("chat_messages__created_at"),
+            .exclude(user=message.user_id)
+            .update(unread_messages=F("unread_messages") + 1)
+        )
+
+    def count_unread_many(self, messages):
+        """Same as `count_unread` for a batch of messages, in one UPDATE per
+        chat group
+
+        Returns:
+            int: number of memberships updated
+        """
+        authors = defaultdict(Counter)
+        for message in messages:
+            authors[message.chat_group_id][message.user_id] += 1
+        updated = 0
+        for chat_group_id, counts in authors.items():
+            # members are not counted their own messages
+            own = Case(
+                *(
+                    When(user=user_id, then=Value(count))
+                    for user_id, count in counts.items()
+                    if user_id is not None
+                ),
+                default=Value(0),
             )
-            .order_by(
-                F("last_message").desc(nulls_last=True),
-                "-created_at",
+            updated += self.filter(
+                chat_group=chat_group_id, is_blocked=False, is_suspended=False
+            ).update(unread_messages=F("unread_messages") + counts.total() - own)
+        return updated
+
+    def mark_read(self, chat_group_id, user, seq=None):
+        """Advance the read watermark of `user` in a chat group up to the
+        message numbered `seq`, the latest one by default, and recount the
+        unread messages past it. The watermark never moves back. As with
+        `count_unread`, blocked and suspended members are not counted the
+        messages sent meanwhile, so their read only lowers the counter
+
+        Returns:
+            dict: `last_read`, `last_read_message_seq` and `unread_messages`
+                of the membership, None when `user` is not a member
+        """
+        ChatGroup = apps.get_model("chat", "ChatGroup")
+        ChatMessage = apps.get_model("chat", "ChatMessage")
+
+        with transaction.atomic():
+            membership = (
+                self.select_for_update()
+                .filter(chat_group=chat_group_id, user=user)
+                .only(
+                    "pk",
+                    "last_read_message_seq",
+                    "unread_messages",
+                    "is_blocked",
+                    "is_suspended",
+                )
+                .first()
             )
+            if membership is None:
+                return None
+            latest = (
+                ChatGroup.objects.filter(pk=chat_group_id)
+                .values_list("message_seq", flat=True)
+                .first()
+            ) or 0
+            seq = latest if seq is None else min(seq, latest)
+            state = {
+                "last_read": timezone.now(),
+                "last_read_message_seq": max(membership.last_read_message_seq, seq),
+                "unread_messages": 0,
+            }
+            if state["last_read_message_seq"] < latest:
+                state["unread_messages"] = (
+                    ChatMessage.objects.filter(
+                        chat_group=chat_group_id,
+                        seq__gt=state["last_read_message_seq"],
+                    )
+                    .exclude(user=user)
+                    .count()
+                )
+                if membership.is_blocked or membership.is_suspended:
+                    state["unread_messages"] = min(
+                        state["unread_messages"], membership.unread_messages
+                    )
+            self.filter(pk=membership.pk).update(**state)
+        return state
+
+    def read_by(self, message):
+        """Return the memberships whose read watermark reached `message`,
+        its author excluded
+
+        Returns:
+            Queryset: Queryset of chat membership objects
+        """
+        if message.seq is None:
+            return self.none()
+        return self.filter(
+            chat_group=message.chat_group_id, last_read_message_seq__gte=message.seq
+        ).exclude(user=message.user_id)
+
+    def unread_totals(self, user):
+        """Sum the unread counters of the memberships of `user`
+
+        Returns:
+            dict: `total_unread` messages and `unread_chats` with any
+        """
+        totals = self.filter(user=user).aggregate(
+            total_unread=Sum("unread_messages"),
+            unread_chats=Count("pk", filter=Q(unread_messages__gt=0)),
         )
-        # Order By, nulls last.: https://stackoverflow.com/questions/15121093/django-adding-nulls-last-to-query
-        return queryset
+        return {
+            "total_unread": totals["total_unread"] or 0,
+            "unread_chats": totals["unread_chats"],
+        }
@@ -0,0 +1,316 @@
+import re
+
+from django.db import connection
+from django.db.models import CharField, FloatField, Func, Q, Value
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+
+from chat.models import ChatMessage
+
+__all__ = [
+    "SEARCH_FIELDS",
+    "get_search_backend",
+    "index_messages",
+    "rebuild_search_index",
+    "search_messages",
+    "unindex_messages",
+]
+
+
+SEARCH_TABLE = "tb_chat_message_search"
+
+# highlighted terms of snippets, the database delimits them with private
+# use characters which are turned into tags once the text is escaped
+SNIPPET_START = "<mark>"
+SNIPPET_STOP = "</mark>"
+SNIPPET_START_DELIMITER = "\ue000"
+SNIPPET_STOP_DELIMITER = "\ue001"
+SNIPPET_WORDS = 16
+
+
+# fields of a message read by `index_messages`
+SEARCH_FIELDS = ("id", "text", "is_deleted_by_sender", "is_deleted_by_admin")
+
+
+def get_search_terms(text):
+    return re.findall(r"\w+", (text or "").lower())
+
+
+def highlight(snippet):
+    """Escape the text of a snippet, then wrap its delimited terms in
+    `SNIPPET_START` and `SNIPPET_STOP`"""
+    if snippet is None:
+        return None
+    return (
+        str(escape(snippet))
+        .replace(SNIPPET_START_DELIMITER, SNIPPET_START)
+        .replace(SNIPPET_STOP_DELIMITER, SNIPPET_STOP)
+    )
+
+
+def is_searchable(message):
+    """Deleted and empty messages are kept out of the index"""
+    return bool(
+        message["text"]
+        and not message["is_deleted_by_sender"]
+        and not message["is_deleted_by_admin"]
+    )
+
+
+class MessageSearchRank(Func):
+    """
+    Relevance of the indexed text of a message for a search query
+    """
+
+    output_field = FloatField()
+
+    def __init__(self, expression, backend, query):
+        self.backend = backend
+        super().__init__(expression, Value(query))
+
+    def as_sql(self, compiler, connection, **extra_context):
+        pk_sql, pk_params = compiler.compile(self.source_expressions[0])
+        query = self.source_expressions[1].value
+        return self.backend.rank_sql(pk_sql, pk_params, query)
+
+
+class MessageSearchSnippet(Func):
+    """
+    Fragment of the text of a message around the matched terms as HTML:
+    the text is escaped and the terms are wrapped in `SNIPPET_START` and
+    `SNIPPET_STOP`. Without a backend the whole text is returned, escaped
+    """
+
+    output_field = CharField()
+
+    def __init__(self, pk, text, backend, query):
+        self.backend = backend
+        super().__init__(pk, text, Value(query))
+
+    def as_sql(self, compiler, connection, **extra_context):
+        pk_sql, pk_params = compiler.compile(self.source_expressions[0])
+        text_sql, text_params = compiler.compile(self.source_expressions[1])
+        if self.backend is None:
+            return text_sql, text_params
+        query = self.source_expressions[2].value
+        return self.backend.snippet_sql(pk_sql, pk_params, text_sql, text_params, query)
+
+    def get_db_converters(self, connection):
+        return [*super().get_db_converters(connection), self.convert_snippet]
+
+    def convert_snippet(self, value, expression, connection):
+        return highlight(value)
+
+
+class SqliteSearchBackend:
+    """
+    FTS5 virtual table keyed by message id, used for local development and
+    tests
+    """
+
+    def create_index(self, cursor):
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+            "USING fts5(text, tokenize='porter unicode61')"
+        )
+
+    def drop_index(self, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+    def clear(self, cursor):
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+
+    def to_query(self, text):
+        return " ".join(f'"{term}"*' for term in get_search_terms(text))
+
+    def match_sql(self, query):
+        return (
+            f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s",
+            [query],
+        )
+
+    def rank_sql(self, pk_sql, pk_params, query):
+        return (
+            f"(SELECT -bm25({SEARCH_TABLE}) FROM {SEARCH_TABLE} "
+            f"WHERE {SEARCH_TABLE} MATCH %s AND rowid = {pk_sql})",
+            [query, *pk_params],
+        )
+
+    def snippet_sql(self, pk_sql, pk_params, text_sql, text_params, query):
+        return (
+            f"(SELECT snippet({SEARCH_TABLE}, 0, %s, %s, '…', {SNIPPET_WORDS}) "
+            f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s "
+            f"AND rowid = {pk_sql})",
+            [SNIPPET_START_DELIMITER, SNIPPET_STOP_DELIMITER, query, *pk_params],
+        )
+
+    def upsert(self, cursor, documents):
+        self.delete(cursor, [document["id"] for document in documents])
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, text) VALUES (%s, %s)",
+            [[document["id"], document["text"]] for document in documents],
+        )
+
+    def delete(self, cursor, message_ids):
+        if message_ids:
+            placeholders = ", ".join(["%s"] * len(message_ids))
+            cursor.execute(
+                f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})",
+                list(message_ids),
+            )
+
+
+class PostgresSearchBackend:
+    """
+    `tsvector` per message behind a GIN index
+    """
+
+    config = "english"
+
+    def create_index(self, cursor):
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+            "message_id bigint PRIMARY KEY REFERENCES tb_chat_messages (id) "
+            "ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+            "document tsvector NOT NULL)"
+        )
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_gin "
+            f"ON {SEARCH_TABLE} USING GIN (document)"
+        )
+
+    def drop_index(self, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+    def clear(self, cursor):
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+
+    def to_query(self, text):
+        return " & ".join(f"{term}:*" for term in get_search_terms(text))
+
+    def match_sql(self, query):
+        return (
+            f"SELECT message_id FROM {SEARCH_TABLE} "
+            f"WHERE document @@ to_tsquery('{self.config}', %s)",
+            [query],
+        )
+
+    def rank_sql(self, pk_sql, pk_params, query):
+        return (
+            f"(SELECT ts_rank_cd(document, to_tsquery('{self.config}', %s)) "
+            f"FROM {SEARCH_TABLE} WHERE message_id = {pk_sql})",
+            [query, *pk_params],
+        )
+
+    def snippet_sql(self, pk_sql, pk_params, text_sql, text_params, query):
+        return (
+            f"ts_headline('{self.config}', {text_sql}, "
+            f"to_tsquery('{self.config}', %s), %s)",
+            [
+                *text_params,
+                query,
+                f"StartSel={SNIPPET_START_DELIMITER}, "
+                f"StopSel={SNIPPET_STOP_DELIMITER}, "
+                f"MaxWords={SNIPPET_WORDS}, MinWords=5",
+            ],
+        )
+
+    def upsert(self, cursor, documents):
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE} (message_id, document) "
+            f"VALUES (%s, to_tsvector('{self.config}', %s)) "
+            "ON CONFLICT (message_id) DO UPDATE SET document = EXCLUDED.document",
+            [[document["id"], document["text"]] for document in documents],
+        )
+
+    def delete(self, cursor, message_ids):
+        if message_ids:
+            cursor.execute(
+                f"DELETE FROM {SEARCH_TABLE} WHERE message_id = ANY(%s)",
+                [list(message_ids)],
+            )
+
+
+SEARCH_BACKENDS = {
+    "sqlite": SqliteSearchBackend,
+    "postgresql": PostgresSearchBackend,
+}
+
+
+def get_search_backend(vendor=None):
+    """Return the search backend of a database vendor, None when unsupported"""
+    backend = SEARCH_BACKENDS.get(vendor or connection.vendor)
+    return backend() if backend else None
+
+
+def search_messages(queryset, text):
+    """Filter `queryset` to the messages matching `text`, annotated with
+    `search_rank` and `search_snippet`"""
+    backend = get_search_backend()
+    if backend is None:
+        # no index on this database, fall back to unranked substring search
+        lookup = Q()
+        for term in get_search_terms(text):
+            lookup &= Q(text__icontains=term)
+        return queryset.filter(lookup).annotate(
+            search_rank=Value(0.0),
+            search_snippet=MessageSearchSnippet("pk", "text", None, text),
+        )
+
+    query = backend.to_query(text)
+    if not query:
+        return queryset.none()
+    match_sql, match_params = backend.match_sql(query)
+    return queryset.filter(pk__in=RawSQL(match_sql, match_params)).annotate(
+        search_rank=MessageSearchRank("pk", backend, query),
+        search_snippet=MessageSearchSnippet("pk", "text", backend, query),
+    )
+
+
+def index_messages(message_ids, messages=None):
+    """(Re)index the given messages, dropping deleted ones. Their text and
+    flags are read back unless given as `messages` dicts"""
+    backend = get_search_backend()
+    if backend is None:
+        return
+    message_ids = set(message_ids)
+    if messages is None:
+        messages = ChatMessage.objects.filter(pk__in=message_ids).values(*SEARCH_FIELDS)
+    documents = [message for message in messages if is_searchable(message)]
+    with connection.cursor() as cursor:
+        backend.upsert(cursor, documents)
+        backend.delete(cursor, message_ids - {document["id"] for document in documents})
+
+
+def unindex_messages(message_ids):
+    backend = get_search_backend()
+    if backend is None:
+        return
+    with connection.cursor() as cursor:
+        backend.delete(cursor, list(message_ids))
+
+
+def rebuild_search_index(batch_size=1000):
+    """Index every message from scratch, in batches
+
+    Returns:
+        int: number of messages indexed
+    """
+    backend = get_search_backend()
+    if backend is None:
+        return 0
+    with connection.cursor() as cursor:
+        backend.clear(cursor)
+    message_ids = ChatMessage.objects.order_by("pk").values_list("pk", flat=True)
+    total = 0
+    batch = []
+    for message_id in message_ids.iterator(chunk_size=batch_size):
+        batch.append(message_id)
+        if len(batch) == batch_size:
+            index_messages(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        index_messages(batch)
+        total += len(batch)
+    return total
@@ -2,12 +2,21 @@ from rest_framework import serializers
 
 from .models import ChatGroup, ChatMembership, ChatMessage, MessageFile
 from accounts.serializers import UserMinimalSerializer
-from core.serializers import CamelCaseSerializerMixin
+from core.serializers import CamelCaseSerializerMixin, SparseFieldsetsMixin
 
 
-class MessageFileSerializer(serializers.ModelSerializer):
+class MessageFileListSerializer(serializers.ListSerializer):
+    def create(self, validated_data):
+        # one INSERT for all the attachments of a message
+        return MessageFile.objects.bulk_create(
+            [MessageFile(**attrs) for attrs in validated_data]
+        )
+
+
+class MessageFileSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     class Meta:
         model = MessageFile
+        list_serializer_class = MessageFileListSerializer
         fields = [
             "id",
             "file_name",
@@ -28,11 +37,12 @@ class MessageFileSerializer(serializers.ModelSerializer):
         return data
 
 
-class ChatMessageSerializer(serializers.ModelSerializer, CamelCaseSerializerMixin):
+class ChatMessageSerializer(
+    SparseFieldsetsMixin, serializers.ModelSerializer, CamelCaseSerializerMixin
+):
     user = UserMinimalSerializer(read_only=True, source="user.profile")
     files = MessageFileSerializer(many=True, read_only=True)
     is_read = serializers.SerializerMethodField()
-    # TODO - message reads
 
     class Meta:
         model = ChatMessage
@@ -49,9 +59,11 @@ class ChatMessageSerializer(serializers.ModelSerializer, CamelCaseSerializerMixi
             "is_deleted_by_sender",
             "is_deleted_by_admin",
             "is_read",
+            "seq",
         ]
         read_only_fields = [
             "id",
+            "seq",
             "user",
             "created_at",
             "updated_at",
@@ -62,11 +74,11 @@ class ChatMessageSerializer(serializers.ModelSerializer, CamelCaseSerializerMixi
         ]
 
     def get_is_read(self, obj):
-        last_read = self.context.get("last_read")
-        if last_read is None:
+        # read watermark of the viewer, see `ChatMembership.last_read_message_seq`
+        last_read_seq = self.context.get("last_read_seq")
+        if last_read_seq is None or obj.seq is None:
             return False
-        else:
-            return obj.created_at < last_read
+        return obj.seq <= last_read_seq
 
     def to_internal_value(self, data):
         data = super().to_internal_value(data)
@@ -81,15 +93,30 @@ class ChatMessageSerializer(serializers.ModelSerializer, CamelCaseSerializerMixi
             data=files, many=True, context={"message": message}
         )
         file_serializer.is_valid(raise_exception=True)
-        file_serializer.save()
+        # rendering the new message must not query its files back
+        message.cache_files(file_serializer.save())
         return message
 
 
-class ChatMembershipSerializer(serializers.ModelSerializer):
+class ChatMessageSearchSerializer(ChatMessageSerializer):
+    rank = serializers.FloatField(source="search_rank", read_only=True)
+    snippet = serializers.CharField(source="search_snippet", read_only=True)
+
+    class Meta(ChatMessageSerializer.Meta):
+        # read state depends on the chat of each result, it is left out
+        fields = [
+            *(name for name in ChatMessageSerializer.Meta.fields if name != "is_read"),
+            "rank",
+            "snippet",
+        ]
+        read_only_fields = fields
+
+
+class ChatMembershipSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     user = UserMinimalSerializer(read_only=True, source="user.profile")
 
     class Meta:
-        moddel = ChatMembership
+        model = ChatMembership
         fields = [
             "id",
             "user",
@@ -103,11 +130,12 @@ class ChatMembershipSerializer(serializers.ModelSerializer):
             "cleared",
             "unread_messages",
             "last_read",
+            "last_read_message_seq",
         ]
         read_only_fields = ["id", "created_at", "updated_at", "removed_at"]
 
 
-class ChatGroupSerializer(serializers.ModelSerializer):
+class ChatGroupSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     chat_type = serializers.CharField(max_length=10)
     user = serializers.SerializerMethodField()
     last_message = serializers.SerializerMethodField()
@@ -133,6 +161,8 @@ class ChatGroupSerializer(serializers.ModelSerializer):
             "unread",
             "blocked",
             "last_message",
+            "last_message_at",
+            "message_seq",
             "is_admin",
             "course",
         ]
@@ -148,6 +178,8 @@ class ChatGroupSerializer(serializers.ModelSerializer):
             "unread",
             "blocked",
             "last_message",
+            "last_message_at",
+            "message_seq",
             "is_admin",
         ]
 
@@ -158,12 +190,30 @@ class ChatGroupSerializer(serializers.ModelSerializer):
         user = self.context["request"].user
         # get members from original data
         members = self.initial_data.pop("members", [])
+        if (
+            validated_data.get("chat_type") == "individual"
+            and len(members) == 1
+            and str(members[0]) != str(user.pk)
+        ):
+            # at most one individual chat per pair of users
+            defaults = {
+                name: value
+                for name, value in validated_data.items()
+                if name not in ("course", "chat_type", "admin", "created_by")
+            }
+            chat_group, _ = ChatGroup.objects.get_or_create_individual(
+                validated_data.get("course"), user, members[0], **defaults
+            )
+            return chat_group
         chat_group = ChatGroup.objects.create(**validated_data)
         chat_group.admin = user
         chat_group.save()
         # add current user as admin
         chat_group.chat_memberships.create(user=user, is_admin=True)
         for member in members:
+            if str(member) == str(user.pk):
+                # already added as admin, memberships are unique per user
+                continue
             if validated_data["chat_type"] == "group":
                 chat_group.chat_memberships.create(user_id=member, is_admin=False)
             else:
@@ -178,18 +228,29 @@ class ChatGroupSerializer(serializers.ModelSerializer):
             return None
         user = request.user
         # get chat user whose id is not equal to current user id
-        chat_user = obj.members.exclude(id=user.id).first()
+        if hasattr(obj, "counterpart_memberships"):
+            membership = next(iter(obj.counterpart_memberships), None)
+            chat_user = membership.user if membership else None
+        else:
+            chat_user = obj.members.exclude(id=user.id).first()
         if chat_user is None:
             return None
         serializer = UserMinimalSerializer(chat_user.profile, context=self.context)
         return serializer.data
 
+    def _get_chat_membership(self, obj):
+        # use the membership prefetched by `ChatGroupQueryset.with_viewer_state`
+        if hasattr(obj, "viewer_memberships"):
+            return next(iter(obj.viewer_memberships), None)
+        user = self.context["request"].user
+        return obj.chat_memberships.filter(user=user).first()
+
     def get_last_message(self, obj):
-        last_message = obj.chat_messages.first()
+        # denormalized pointer, loaded by `ChatGroupQueryset.with_viewer_state`
+        last_message = obj.last_message
         if last_message is None:
             return None
-        user = self.context["request"].user
-        chat_membership = obj.chat_memberships.filter(user=user).first()
+        chat_membership = self._get_chat_membership(obj)
         if not chat_membership:
             return None
         if (chat_membership and chat_membership.cleared is not None) and (
@@ -197,7 +258,8 @@ class ChatGroupSerializer(serializers.ModelSerializer):
         ):
             return None
         serializer = ChatMessageSerializer(
-            last_message, context={"last_read": chat_membership.last_read}
+            last_message,
+            context={"last_read_seq": chat_membership.last_read_message_seq},
         )
         return serializer.data
 
@@ -205,18 +267,17 @@ class ChatGroupSerializer(serializers.ModelSerializer):
         if obj.chat_type == "individual":
             return True
         else:
-            return obj.admin == self.context["request"].user
+            user = self.context["request"].user
+            return user.is_authenticated and obj.admin_id == user.id
 
     def get_blocked(self, obj):
-        user = self.context["request"].user
-        chat_membership = obj.chat_memberships.filter(user=user).first()
+        chat_membership = self._get_chat_membership(obj)
         if chat_membership is None:
             return False
         return chat_membership.is_blocked
 
     def get_unread(self, obj):
-        user = self.context["request"].user
-        chat_membership = obj.chat_memberships.filter(user=user).first()
+        chat_membership = self._get_chat_membership(obj)
         if chat_membership is None:
             return 0
         return chat_membership.unread_messages
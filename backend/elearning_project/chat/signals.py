@@ -0,0 +1,58 @@
+from django.dispatch import receiver
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from chat.models import ChatGroup, ChatMembership, ChatMessage
+from chat.search import SEARCH_FIELDS, index_messages, unindex_messages
+from core.utils import is_cascade_from
+
+__all__ = [
+    "assign_message_seq",
+    "set_chat_group_last_message",
+    "count_unread_message",
+    "index_message",
+    "unindex_message",
+    "refresh_chat_group_last_message",
+]
+
+
+@receiver(pre_save, sender=ChatMessage)
+def assign_message_seq(sender, instance, *args, **kwargs):
+    # runs in the transaction of `ChatMessage.save`, see `AtomicSaveMixin`
+    if instance._state.adding and instance.seq is None and instance.chat_group_id:
+        instance.seq = ChatGroup.objects.next_message_seq(instance.chat_group_id)
+
+
+@receiver(post_save, sender=ChatMessage)
+def set_chat_group_last_message(sender, instance, created, *args, **kwargs):
+    if created and instance.seq is not None:
+        ChatGroup.objects.set_last_message(instance)
+
+
+@receiver(post_save, sender=ChatMessage)
+def count_unread_message(sender, instance, created, *args, **kwargs):
+    if created and instance.chat_group_id:
+        ChatMembership.objects.count_unread(instance)
+
+
+@receiver(post_delete, sender=ChatMessage)
+def refresh_chat_group_last_message(sender, instance, *args, **kwargs):
+    if instance.chat_group_id is None or is_cascade_from(
+        kwargs.get("origin"), ChatGroup
+    ):
+        return
+    # the pointer was set to null when the last message was deleted
+    if ChatGroup.objects.filter(
+        pk=instance.chat_group_id, last_message__isnull=True
+    ).exists():
+        ChatGroup.objects.refresh_last_message([instance.chat_group_id])
+
+
+@receiver(post_save, sender=ChatMessage)
+def index_message(sender, instance, *args, **kwargs):
+    message = {name: getattr(instance, name) for name in SEARCH_FIELDS}
+    index_messages([instance.pk], messages=[message])
+
+
+@receiver(post_delete, sender=ChatMessage)
+def unindex_message(sender, instance, *args, **kwargs):
+    unindex_messages([instance.pk])
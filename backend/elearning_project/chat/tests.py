@@ -1,9 +1,31 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from urllib.parse import parse_qs, urlparse
+from unittest import mock
+
 from model_mommy import mommy
 
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
-from core.tests import BaseAPITestCase
-from chat.models import ChatGroup, ChatMembership, ChatMessage
+from core.tests import BaseAPITestCase, MigrationTestCase
+from chat.models import (
+    ChatGroup,
+    ChatMembership,
+    ChatMessage,
+    ChatMessageSegment,
+    MessageFile,
+)
+from chat.importer import MessageImportError, import_messages
+from chat.querysets import ChatGroupQueryset
+from chat.search import get_search_backend
+from chat.views import ChatGroupViewSet, MessageViewSet
+from courses.views import CourseViewSet
 
 
 class ChatGroupAPITestCase(BaseAPITestCase):
@@ -41,7 +63,10 @@ class ChatGroupAPITestCase(BaseAPITestCase):
         url = reverse("course-chat-list", kwargs={"course_pk": self.course.pk})
         data = {
             "name": "Group Chat Group",
-            "photo": "https://www.google.com/images/branding/googlelogo/2x/googlelogo_color_272x92dp.png",
+            "photo": (
+                "https://www.google.com/images/branding/googlelogo/2x/"
+                "googlelogo_color_272x92dp.png"
+            ),
             "members": [u1.pk, u2.pk],
             "chatType": "group",
         }
@@ -93,6 +118,54 @@ class ChatGroupAPITestCase(BaseAPITestCase):
         response = self.roger_client.get(f"{url}?user_id={u3.pk}")
         self.assertEqual(response.status_code, 200)
 
+    def test_individual_chat_is_unique_per_pair(self):
+        """
+        Test if both users of a pair get the same individual chat, even when racing
+        """
+        course = mommy.make("courses.Course")
+        url = reverse("course-chat-individual", kwargs={"course_pk": course.pk})
+        response = self.roger_client.get(url, {"user_id": self.sally_user.pk})
+        chat_id = response.data.get("data").get("id")
+        response = self.sally_client.get(url, {"user_id": self.roger_user.pk})
+        self.assertEqual(response.data.get("data").get("id"), chat_id)
+        self.assertEqual(
+            response.data.get("data").get("user").get("id"),
+            self.roger_user.profile.pk,
+        )
+        self.assertEqual(ChatMembership.objects.filter(chat_group=chat_id).count(), 2)
+
+        # a request that lost the race gets the winner's chat
+        chat_group = ChatGroup.objects.get(pk=chat_id)
+        with mock.patch.object(ChatGroupQueryset, "first", return_value=None):
+            same, created = ChatGroup.objects.get_or_create_individual(
+                course, self.sally_user, self.roger_user.pk, name="race"
+            )
+        self.assertEqual((same, created), (chat_group, False))
+
+        response = self.roger_client.get(url, {"user_id": self.roger_user.pk})
+        self.assertEqual(response.status_code, 400)
+
+    def test_individual_chat_without_course_is_unique_per_pair(self):
+        """
+        Test if individual chats without a course are unique per pair too
+        """
+        chat_group, created = ChatGroup.objects.get_or_create_individual(
+            None, self.roger_user, self.sally_user.pk, name="no course"
+        )
+        self.assertTrue(created)
+        with mock.patch.object(ChatGroupQueryset, "first", return_value=None):
+            same, created = ChatGroup.objects.get_or_create_individual(
+                None, self.sally_user, self.roger_user.pk, name="race"
+            )
+        self.assertEqual((same, created), (chat_group, False))
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ChatGroup.objects.create(
+                chat_type="individual",
+                low_user=chat_group.low_user,
+                high_user=chat_group.high_user,
+            )
+
 
 class ChatGroupMessagesAPITestCase(BaseAPITestCase):
 
@@ -126,3 +199,966 @@ class ChatGroupMessagesAPITestCase(BaseAPITestCase):
         )
         response = self.roger_client.get(url)
         self.assertEqual(response.status_code, 200)
+
+
+class ChatQueryBudgetTestCase(BaseAPITestCase):
+    # view and action of each endpoint, held to the `query_budgets` of the view
+    BUDGETED_ENDPOINTS = {
+        "course-chat-list": (ChatGroupViewSet, "list"),
+        "course-chat-groups": (CourseViewSet, "chat_groups"),
+        "chat-message-list": (MessageViewSet, "list"),
+    }
+
+    def setUp(self):
+        super(ChatQueryBudgetTestCase, self).setUp()
+        self.course = mommy.make("courses.Course")
+        for user in (self.james_user, self.sally_user, self.admin_user):
+            chat_group = mommy.make(
+                "chat.ChatGroup", course=self.course, chat_type="individual"
+            )
+            ChatMembership.objects.create(chat_group=chat_group, user=self.roger_user)
+            ChatMembership.objects.create(chat_group=chat_group, user=user)
+            ChatMessage.objects.create(chat_group=chat_group, user=user, text="Hi")
+            ChatMessage.objects.create(
+                chat_group=chat_group, user=self.roger_user, text="Hello"
+            )
+        self.chat_group = chat_group
+
+    def test_chat_endpoints_stay_within_query_budget(self):
+        """
+        Test if the chat endpoints run a bounded number of queries
+        """
+        urls = {
+            "course-chat-list": reverse(
+                "course-chat-list", kwargs={"course_pk": self.course.pk}
+            ),
+            "course-chat-groups": reverse("course-chat-groups"),
+            "chat-message-list": reverse(
+                "chat-message-list",
+                kwargs={"course_pk": self.course.pk, "chat_pk": self.chat_group.pk},
+            ),
+        }
+        for name, (view, action) in self.BUDGETED_ENDPOINTS.items():
+            budget = view.query_budgets[action]
+            with self.subTest(endpoint=name), self.assertQueryBudget(budget):
+                response = self.roger_client.get(urls[name])
+                self.assertEqual(response.status_code, 200)
+
+        # the counterpart of individual chats is batch loaded with the page
+        response = self.roger_client.get(urls["course-chat-list"])
+        results = response.data.get("data").get("results")
+        self.assertEqual(len(results), 3)
+        self.assertEqual(
+            {chat["user"]["id"] for chat in results},
+            {
+                user.profile.id
+                for user in (self.james_user, self.sally_user, self.admin_user)
+            },
+        )
+        self.assertEqual(results[0]["last_message"]["text"], "Hello")
+
+    def test_chat_fields_skip_the_queries_of_the_others(self):
+        """
+        Test if `fields` restricts the rendered chat fields and skips the
+        prefetches of the others
+        """
+        for url in (
+            reverse("course-chat-list", kwargs={"course_pk": self.course.pk}),
+            reverse("course-chat-groups"),
+        ):
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connection) as full:
+                    self.roger_client.get(url)
+                with CaptureQueriesContext(connection) as sparse:
+                    response = self.roger_client.get(url, {"fields": "id,name"})
+                self.assertEqual(response.status_code, 200)
+                results = response.data.get("data").get("results")
+                self.assertEqual(set(results[0]), {"id", "name"})
+                self.assertLess(len(sparse), len(full))
+
+
+class ChatGroupLastMessageTestCase(BaseAPITestCase):
+    def setUp(self):
+        super(ChatGroupLastMessageTestCase, self).setUp()
+        self.course = mommy.make("courses.Course")
+        self.quiet_group, self.busy_group = [
+            mommy.make("chat.ChatGroup", course=self.course) for _ in range(2)
+        ]
+        for chat_group in (self.quiet_group, self.busy_group):
+            ChatMembership.objects.create(chat_group=chat_group, user=self.roger_user)
+
+    def test_messages_are_numbered_and_move_their_group_up_the_inbox(self):
+        """
+        Test if sent messages are numbered and become the last message of their group
+        """
+        url = reverse(
+            "chat-message-list",
+            kwargs={"course_pk": self.course.pk, "chat_pk": self.busy_group.pk},
+        )
+        for text in ("first", "second"):
+            response = self.roger_client.post(url, {"text": text}, format="json")
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data.get("data").get("seq"), 2)
+        self.busy_group.refresh_from_db()
+        self.assertEqual(self.busy_group.message_seq, 2)
+        self.assertEqual(self.busy_group.last_message.text, "second")
+
+        inbox = reverse("course-chat-list", kwargs={"course_pk": self.course.pk})
+        response = self.roger_client.get(inbox)
+        results = response.data.get("data").get("results")
+        self.assertEqual(results[0]["id"], self.busy_group.pk)
+        self.assertEqual(results[0]["last_message"]["text"], "second")
+
+        self.busy_group.last_message.delete()
+        self.busy_group.refresh_from_db()
+        self.assertEqual(self.busy_group.last_message.text, "first")
+
+    def test_backfill_numbers_existing_messages(self):
+        """
+        Test if the backfill command numbers unnumbered messages in order
+        """
+        ChatMessage.objects.create(chat_group=self.quiet_group, text="old")
+        ChatMessage.objects.create(chat_group=self.quiet_group, text="older")
+        ChatMessage.objects.update(seq=None)
+        ChatGroup.objects.update(message_seq=0, last_message=None)
+
+        call_command("backfill_chat_messages", stdout=StringIO())
+        self.quiet_group.refresh_from_db()
+        self.assertEqual(self.quiet_group.message_seq, 2)
+        self.assertEqual(self.quiet_group.last_message.text, "older")
+        self.assertEqual(
+            list(ChatMessage.objects.order_by("seq").values_list("text", flat=True)),
+            ["old", "older"],
+        )
+
+
+class ChatUnreadTestCase(BaseAPITestCase):
+    def setUp(self):
+        super(ChatUnreadTestCase, self).setUp()
+        self.course = mommy.make("courses.Course")
+        self.chat_group = mommy.make("chat.ChatGroup", course=self.course)
+        for user in (self.roger_user, self.sally_user, self.james_user):
+            ChatMembership.objects.create(chat_group=self.chat_group, user=user)
+        ChatMembership.objects.filter(user=self.james_user).update(is_blocked=True)
+        self.messages_url = reverse(
+            "chat-message-list",
+            kwargs={"course_pk": self.course.pk, "chat_pk": self.chat_group.pk},
+        )
+
+    def get_unread(self, user):
+        return ChatMembership.objects.get(
+            chat_group=self.chat_group, user=user
+        ).unread_messages
+
+    def test_messages_are_counted_for_the_other_members(self):
+        """
+        Test if a message counts as unread for the unblocked members but its sender
+        """
+        for text in ("one", "two"):
+            self.roger_client.post(self.messages_url, {"text": text}, format="json")
+        self.assertEqual(self.get_unread(self.sally_user), 2)
+        self.assertEqual(self.get_unread(self.roger_user), 0)
+        self.assertEqual(self.get_unread(self.james_user), 0)
+
+        response = self.sally_client.get(reverse("user-my-unread"))
+        self.assertEqual(response.data.get("data").get("total_unread"), 2)
+        self.assertEqual(response.data.get("data").get("unread_chats"), 1)
+
+    def test_mark_read(self):
+        """
+        Test if marking a chat read resets its unread count
+        """
+        self.roger_client.post(self.messages_url, {"text": "one"}, format="json")
+        url = reverse(
+            "course-chat-read",
+            kwargs={"course_pk": self.course.pk, "pk": self.chat_group.pk},
+        )
+        response = self.sally_client.post(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_unread(self.sally_user), 0)
+        membership = ChatMembership.objects.get(
+            chat_group=self.chat_group, user=self.sally_user
+        )
+        self.assertIsNotNone(membership.last_read)
+
+        response = self.sally_client.get(self.messages_url)
+        self.assertTrue(response.data.get("data").get("results")[0]["is_read"])
+        response = self.sally_client.get(reverse("user-my-unread"))
+        self.assertEqual(response.data.get("data").get("total_unread"), 0)
+
+
+class ChatIndexTestCase(BaseAPITestCase):
+    """
+    The queries behind the chat endpoints must keep reading through their
+    indexes, see `ChatGroup.Meta.indexes` and friends. The endpoints are
+    requested and the queries they run are explained
+    """
+
+    def setUp(self):
+        super(ChatIndexTestCase, self).setUp()
+        self.course = mommy.make("courses.Course")
+        self.chat_group = mommy.make("chat.ChatGroup", course=self.course)
+        for user in (self.roger_user, self.sally_user):
+            ChatMembership.objects.create(chat_group=self.chat_group, user=user)
+        self.messages = [
+            ChatMessage.objects.create(
+                chat_group=self.chat_group, user=self.sally_user, text=str(number)
+            )
+            for number in range(3)
+        ]
+        self.messages_url = reverse(
+            "chat-message-list",
+            kwargs={"course_pk": self.course.pk, "chat_pk": self.chat_group.pk},
+        )
+
+    def test_message_history(self):
+        """
+        Test if the message list reads through the recent messages index
+        """
+        with self.assertQueriesUseIndex(
+            "tb_chat_messages", "chat_message_recent", ordered=True
+        ):
+            response = self.roger_client.get(self.messages_url, {"page_size": 2})
+        self.assertEqual(response.status_code, 200)
+        with self.assertQueriesUseIndex(
+            "tb_chat_messages", "chat_message_recent", ordered=True
+        ):
+            response = self.roger_client.get(response.data.get("data").get("next"))
+        self.assertEqual(len(response.data.get("data").get("results")), 1)
+
+    def test_chats_of_user(self):
+        """
+        Test if the inbox reads through the membership index
+        """
+        url = reverse("course-chat-list", kwargs={"course_pk": self.course.pk})
+        with self.assertQueriesUseIndex("tb_chat_memberships", "chat_membership_user"):
+            response = self.roger_client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_membership_of_user(self):
+        """
+        Test if the membership lookups read through their unique constraint
+        """
+        url = reverse(
+            "course-chat-read",
+            kwargs={"course_pk": self.course.pk, "pk": self.chat_group.pk},
+        )
+        with self.assertQueriesUseIndex("tb_chat_memberships"):
+            response = self.roger_client.post(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_readers_of_message(self):
+        """
+        Test if the readers of a message are found through the read
+        watermark index
+        """
+        url = reverse(
+            "chat-message-reads",
+            kwargs={
+                "course_pk": self.course.pk,
+                "chat_pk": self.chat_group.pk,
+                "pk": self.messages[0].pk,
+            },
+        )
+        with self.assertQueriesUseIndex("tb_chat_memberships", "chat_membership_read"):
+            response = self.sally_client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+
+class ChatMessageHistoryTestCase(BaseAPITestCase):
+    def setUp(self):
+        super(ChatMessageHistoryTestCase, self).setUp()
+        self.course = mommy.make("courses.Course")
+        self.chat_group = mommy.make("chat.ChatGroup", course=self.course)
+        ChatMembership.objects.create(chat_group=self.chat_group, user=self.roger_user)
+        self.messages = [
+            ChatMessage.objects.create(
+                chat_group=self.chat_group, user=self.roger_user, text=str(number)
+            )
+            for number in range(10)
+        ]
+        self.url = reverse(
+            "chat-message-list",
+            kwargs={"course_pk": self.course.pk, "chat_pk": self.chat_group.pk},
+        )
+
+    def get_history(self, **params):
+        response = self.roger_client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        data = response.data.get("data")
+        return [message["text"] for message in data.get("results")], data
+
+    def test_latest_and_before(self):
+        """
+        Test if the latest messages and those before a message come newest first
+        """
+        texts, data = self.get_history(limit=4)
+        self.assertEqual(texts, ["9", "8", "7", "6"])
+        self.assertTrue(data.get("has_more"))
+        self.assertFalse(data.get("has_newer"))
+
+        texts, data = self.get_history(before=self.messages[2].pk, limit=4)
+        self.assertEqual(texts, ["1", "0"])
+        self.assertFalse(data.get("has_more"))
+
+    def test_after_is_not_shifted_by_new_messages(self):
+        """
+        Test if the window after a message is anchored on it
+        """
+        texts, data = self.get_history(after=self.messages[5].pk, limit=2)
+        self.assertEqual(texts, ["7", "6"])
+        self.assertTrue(data.get("has_more"))
+        ChatMessage.objects.create(chat_group=self.chat_group, text="new")
+        texts, data = self.get_history(after=self.messages[7].pk, limit=5)
+        self.assertEqual(texts, ["new", "9", "8"])
+        self.assertFalse(data.get("has_more"))
+
+    def test_around(self):
+        """
+        Test if the window around a message holds it with its neighbours
+        """
+        texts, data = self.get_history(around=self.messages[5].pk, limit=3)
+        self.assertEqual(texts, ["6", "5", "4"])
+        self.assertTrue(data.get("has_older"))
+        self.assertTrue(data.get("has_newer"))
+
+    def test_invalid_params(self):
+        """
+        Test if conflicting, malformed and foreign anchors are rejected
+        """
+        response = self.roger_client.get(
+            self.url, {"before": self.messages[1].pk, "after": self.messages[0].pk}
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.roger_client.get(self.url, {"before": "abc"})
+        self.assertEqual(response.status_code, 400)
+        other = mommy.make("chat.ChatMessage")
+        response = self.roger_client.get(self.url, {"around": other.pk})
+        self.assertEqual(response.status_code, 404)
+
+    def test_limit_is_bounded(self):
+        """
+        Test if the window size is capped by CHAT_HISTORY_MAX_LIMIT
+        """
+        with self.settings(CHAT_HISTORY_MAX_LIMIT=3):
+            texts, data = self.get_history(limit=1000)
+        self.assertEqual(len(texts), 3)
+
+    def test_window_reads_the_index(self):
+        """
+        Test if history windows read through the recent messages index
+        """
+        with self.assertQueriesUseIndex(
+            "tb_chat_messages", "chat_message_recent", ordered=True
+        ):
+            texts, data = self.get_history(before=self.messages[5].pk, limit=3)
+        self.assertEqual(texts, ["4", "3", "2"])
+
+
+class ChatMessageArchiveTestCase(BaseAPITestCase):
+    def setUp(self):
+        super(ChatMessageArchiveTestCase, self).setUp()
+        self.course = mommy.make("courses.Course")
+        self.chat_group = mommy.make("chat.ChatGroup", course=self.course)
+        ChatMembership.objects.create(chat_group=self.chat_group, user=self.roger_user)
+        self.messages = [
+            ChatMessage.objects.create(
+                chat_group=self.chat_group, user=self.roger_user, text=str(number)
+            )
+            for number in range(10)
+        ]
+        MessageFile.objects.create(
+            message=self.messages[3], url="https://example.com/a.png"
+        )
+        old = timezone.now() - timezone.timedelta(days=400)
+        for number, message in enumerate(self.messages[:8]):
+            ChatMessage.objects.filter(pk=message.pk).update(
+                created_at=old + timezone.timedelta(minutes=number)
+            )
+        out = StringIO()
+        call_command("archive_chat_messages", "--batch-size", "3", stdout=out)
+        self.assertIn("Archived 8 chat messages into 3 segments", out.getvalue())
+        self.url = reverse(
+            "chat-message-list",
+            kwargs={"course_pk": self.course.pk, "chat_pk": self.chat_group.pk},
+        )
+
+    def get_history(self, **params):
+        response = self.roger_client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        data = response.data.get("data")
+        return [message["text"] for message in data.get("results")], data
+
+    def test_messages_are_moved_to_segments(self):
+        """
+        Test if old messages are moved into segments, keeping the last message hot
+        """
+        self.assertEqual(
+            list(ChatMessage.objects.values_list("text", flat=True).order_by("seq")),
+            ["8", "9"],
+        )
+        self.assertFalse(MessageFile.objects.exists())
+        self.assertEqual(
+            list(ChatMessageSegment.objects.values_list("first_seq", "last_seq")),
+            [(1, 3), (4, 6), (7, 8)],
+        )
+        # nothing left to move on the next run
+        out = StringIO()
+        call_command("archive_chat_messages", stdout=out)
+        self.assertIn("Archived 0 chat messages", out.getvalue())
+
+    def test_history_continues_into_the_archive(self):
+        """
+        Test if the history windows continue from the hot rows into the archive
+        """
+        texts, data = self.get_history(limit=4)
+        self.assertEqual(texts, ["9", "8", "7", "6"])
+        self.assertTrue(data.get("has_more"))
+
+        texts, data = self.get_history(before=self.messages[6].pk, limit=4)
+        self.assertEqual(texts, ["5", "4", "3", "2"])
+        self.assertTrue(data.get("has_more"))
+        files = data.get("results")[2]["files"]
+        self.assertEqual(files[0]["url"], "https://example.com/a.png")
+
+        texts, data = self.get_history(before=self.messages[2].pk, limit=4)
+        self.assertEqual(texts, ["1", "0"])
+        self.assertFalse(data.get("has_more"))
+
+    def test_windows_anchored_on_archived_messages(self):
+        """
+        Test if archived messages can anchor the history windows
+        """
+        texts, data = self.get_history(around=self.messages[4].pk, limit=3)
+        self.assertEqual(texts, ["5", "4", "3"])
+        self.assertTrue(data.get("has_older"))
+        self.assertTrue(data.get("has_newer"))
+
+        texts, data = self.get_history(after=self.messages[6].pk, limit=5)
+        self.assertEqual(texts, ["9", "8", "7"])
+        self.assertFalse(data.get("has_more"))
+
+        response = self.roger_client.get(self.url, {"around": 0})
+        self.assertEqual(response.status_code, 404)
+
+    def test_pages_continue_into_the_archive(self):
+        """
+        Test if the cursor pages of the message list continue into the archive
+        """
+        texts, data = self.get_history(page_size=4, with_count=1)
+        self.assertEqual(texts, ["9", "8", "7", "6"])
+        self.assertEqual(data.get("count"), 10)
+
+        pages = []
+        while data.get("next"):
+            previous = data
+            cursor = parse_qs(urlparse(data.get("next")).query)["cursor"][0]
+            texts, data = self.get_history(page_size=4, cursor=cursor)
+            pages.append(texts)
+        self.assertEqual(pages, [["5", "4", "3", "2"], ["1", "0"]])
+        self.assertEqual(data.get("results")[0]["id"], self.messages[1].pk)
+
+        # and back again, from the archive to the hot rows
+        cursor = parse_qs(urlparse(data.get("previous")).query)["cursor"][0]
+        texts, data = self.get_history(page_size=4, cursor=cursor)
+        self.assertEqual(texts, [message["text"] for message in previous["results"]])
+        cursor = parse_qs(urlparse(data.get("previous")).query)["cursor"][0]
+        texts, data = self.get_history(page_size=4, cursor=cursor)
+        self.assertEqual(texts, ["9", "8", "7", "6"])
+
+    def test_archived_message_detail(self):
+        """
+        Test if archived messages and their reads can be fetched but not changed
+        """
+        kwargs = {
+            "course_pk": self.course.pk,
+            "chat_pk": self.chat_group.pk,
+            "pk": self.messages[3].pk,
+        }
+        url = reverse("chat-message-detail", kwargs=kwargs)
+        response = self.roger_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["text"], "3")
+        self.assertEqual(response.data["files"][0]["url"], "https://example.com/a.png")
+
+        ChatMembership.objects.create(
+            chat_group=self.chat_group,
+            user=self.sally_user,
+            last_read_message_seq=self.messages[3].seq,
+        )
+        response = self.roger_client.get(
+            reverse("chat-message-reads", kwargs=kwargs), {"with_count": 1}
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.data.get("data")
+        self.assertEqual(data.get("read_count"), 1)
+        self.assertEqual(data.get("count"), 1)
+        self.assertEqual(
+            [membership["last_read_message_seq"] for membership in data["results"]],
+            [self.messages[3].seq],
+        )
+
+        response = self.roger_client.patch(url, {"text": "edited"}, format="json")
+        self.assertEqual(response.status_code, 404)
+
+
+class ChatReadWatermarkTestCase(BaseAPITestCase):
+    def setUp(self):
+        super(ChatReadWatermarkTestCase, self).setUp()
+        self.course = mommy.make("courses.Course")
+        self.chat_group = mommy.make("chat.ChatGroup", course=self.course)
+        for user in (self.roger_user, self.sally_user, self.james_user):
+            ChatMembership.objects.create(chat_group=self.chat_group, user=user)
+        self.messages = [
+            ChatMessage.objects.create(
+                chat_group=self.chat_group, user=self.roger_user, text=str(number)
+            )
+            for number in range(3)
+        ]
+        self.read_url = reverse(
+            "course-chat-read",
+            kwargs={"course_pk": self.course.pk, "pk": self.chat_group.pk},
+        )
+
+    def test_read_up_to_a_message(self):
+        """
+        Test if the read watermark moves up to a message and never back
+        """
+        response = self.sally_client.post(self.read_url, {"seq": 2}, format="json")
+        data = response.data.get("data")
+        self.assertEqual(data.get("last_read_message_seq"), 2)
+        self.assertEqual(data.get("unread_messages"), 1)
+
+        # the watermark never moves back
+        response = self.sally_client.post(self.read_url, {"seq": 1}, format="json")
+        self.assertEqual(response.data.get("data").get("last_read_message_seq"), 2)
+
+        url = reverse(
+            "chat-message-list",
+            kwargs={"course_pk": self.course.pk, "chat_pk": self.chat_group.pk},
+        )
+        response = self.sally_client.get(url)
+        is_read = {
+            message["text"]: message["is_read"]
+            for message in response.data.get("data").get("results")
+        }
+        self.assertEqual(is_read, {"0": True, "1": True, "2": False})
+
+    def test_read_of_a_blocked_member_is_not_counted_new_messages(self):
+        """
+        Test if the messages sent while a member is blocked are not counted
+        unread to them when they read
+        """
+        self.james_client.post(self.read_url)
+        ChatMembership.objects.filter(user=self.james_user).update(is_blocked=True)
+        ChatMessage.objects.create(
+            chat_group=self.chat_group, user=self.roger_user, text="blocked"
+        )
+        response = self.james_client.post(self.read_url, {"seq": 1}, format="json")
+        self.assertEqual(response.data.get("data").get("unread_messages"), 0)
+
+    def test_readers_of_a_message(self):
+        """
+        Test if the readers of a message are the members whose watermark reached it
+        """
+        self.sally_client.post(self.read_url, {"seq": 1}, format="json")
+        self.james_client.post(self.read_url)
+
+        def get_reads(message):
+            url = reverse(
+                "chat-message-reads",
+                kwargs={
+                    "course_pk": self.course.pk,
+                    "chat_pk": self.chat_group.pk,
+                    "pk": message.pk,
+                },
+            )
+            response = self.roger_client.get(url)
+            self.assertEqual(response.status_code, 200)
+            return response.data.get("data")
+
+        data = get_reads(self.messages[0])
+        self.assertEqual(data.get("read_count"), 2)
+        data = get_reads(self.messages[2])
+        self.assertEqual(data.get("read_count"), 1)
+        self.assertEqual(
+            [reader["user"]["id"] for reader in data.get("results")],
+            [self.james_user.profile.pk],
+        )
+
+
+class ChatMessageImportTestCase(BaseAPITestCase):
+    def setUp(self):
+        super(ChatMessageImportTestCase, self).setUp()
+        self.course = mommy.make("courses.Course")
+        self.chat_group = mommy.make("chat.ChatGroup", course=self.course)
+        self.live_message = ChatMessage.objects.create(
+            chat_group=self.chat_group, text="live"
+        )
+        created_at = timezone.now().replace(year=2019)
+        ChatMessage.objects.filter(pk=self.live_message.pk).update(
+            created_at=created_at
+        )
+        ChatGroup.objects.filter(pk=self.chat_group.pk).update(
+            last_message_at=created_at
+        )
+        self.url = reverse("course-chat-import", kwargs={"course_pk": self.course.pk})
+
+    def get_lines(self, count):
+        return [
+            json.dumps(
+                {
+                    "chat_group": self.chat_group.pk,
+                    "user": self.roger_user.pk,
+                    "text": f"old {number}",
+                    "created_at": f"2020-01-01T10:00:{number:02d}Z",
+                    "files": [{"url": "https://example.com/a.png"}] * (number % 2),
+                }
+            )
+            for number in range(count)
+        ]
+
+    def test_command_imports_in_chunks(self):
+        """
+        Test if the import command inserts messages, files and memberships in chunks
+        """
+        path = os.path.join(tempfile.mkdtemp(), "messages.jsonl")
+        with open(path, "w") as stream:
+            stream.write("\n".join(self.get_lines(5)))
+        out = StringIO()
+        call_command("import_chat_messages", path, "--batch-size", "2", stdout=out)
+        self.assertIn(
+            "Imported 5 chat messages, 2 files and 1 memberships", out.getvalue()
+        )
+
+        messages = ChatMessage.objects.filter(text__startswith="old").order_by("seq")
+        self.assertEqual([message.seq for message in messages], [2, 3, 4, 5, 6])
+        self.assertEqual(messages[0].created_at.year, 2020)
+        self.chat_group.refresh_from_db()
+        self.assertEqual(self.chat_group.message_seq, 6)
+        self.assertEqual(self.chat_group.last_message.text, "old 4")
+        self.assertTrue(
+            ChatMembership.objects.filter(
+                chat_group=self.chat_group, user=self.roger_user
+            ).exists()
+        )
+
+    def test_endpoint(self):
+        """
+        Test if only admins can import and invalid lines are reported by number
+        """
+        body = "\n".join(self.get_lines(3)).encode()
+        response = self.roger_client.post(
+            self.url, body, content_type="application/x-ndjson"
+        )
+        self.assertEqual(response.status_code, 403)
+
+        response = self.admin_client.post(
+            self.url, body, content_type="application/x-ndjson"
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data.get("data").get("messages"), 3)
+
+        other = mommy.make("chat.ChatGroup")
+        lines = self.get_lines(1) + [json.dumps({"chat_group": other.pk})]
+        response = self.admin_client.post(
+            self.url, "\n".join(lines).encode(), content_type="application/x-ndjson"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Line 2", response.data["detail"])
+
+    def test_older_messages_are_rejected(self):
+        """
+        Test if messages older than the last message of the chat are not imported
+        """
+        ChatMessage.objects.create(chat_group=self.chat_group, text="newer")
+        response = self.admin_client.post(
+            self.url,
+            "\n".join(self.get_lines(2)).encode(),
+            content_type="application/x-ndjson",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Line 1", response.data["detail"])
+        self.assertFalse(ChatMessage.objects.filter(text__startswith="old").exists())
+        self.chat_group.refresh_from_db()
+        self.assertEqual(self.chat_group.last_message.text, "newer")
+
+    def test_lines_out_of_order_across_chunks_import_nothing(self):
+        """
+        Test if a line older than a line of an earlier chunk fails the import
+        before any chunk is written
+        """
+        lines = self.get_lines(3)
+        lines = [lines[1], lines[2], lines[0]]
+        with self.assertRaises(MessageImportError) as context:
+            import_messages(lines, batch_size=2)
+        self.assertEqual(context.exception.line_number, 3)
+        self.assertEqual(context.exception.stats["messages"], 0)
+        self.assertFalse(ChatMessage.objects.filter(text__startswith="old").exists())
+
+        stats = import_messages(lines[:2], batch_size=1)
+        self.assertEqual(stats["messages"], 2)
+
+    def test_files_are_inserted_at_once(self):
+        """
+        Test if the files of a message are inserted in a single query
+        """
+        url = reverse(
+            "chat-message-list",
+            kwargs={"course_pk": self.course.pk, "chat_pk": self.chat_group.pk},
+        )
+        files = [{"url": f"https://example.com/{number}.png"} for number in range(5)]
+        with self.assertQueryBudget(12) as recorder:
+            response = self.roger_client.post(
+                url, {"text": "files", "files": files}, format="json"
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data.get("data").get("files")), 5)
+        inserts = [
+            query
+            for query in recorder.queries
+            if query["sql"].startswith('INSERT INTO "tb_message_files"')
+        ]
+        self.assertEqual(len(inserts), 1)
+
+
+class ChatMessageSearchTestCase(BaseAPITestCase):
+    def setUp(self):
+        super(ChatMessageSearchTestCase, self).setUp()
+        self.course = mommy.make("courses.Course")
+        self.chat_group, self.other_group = [
+            mommy.make("chat.ChatGroup", course=self.course) for _ in range(2)
+        ]
+        for chat_group in (self.chat_group, self.other_group):
+            ChatMembership.objects.create(chat_group=chat_group, user=self.roger_user)
+        texts = [
+            "The homework deadline moved to Friday",
+            "deadline deadline, do not forget the deadline",
+            "See you in class",
+        ]
+        self.messages = [
+            ChatMessage.objects.create(
+                chat_group=self.chat_group, user=self.sally_user, text=text
+            )
+            for text in texts
+        ]
+        ChatMessage.objects.create(
+            chat_group=self.other_group, text="Other deadlines are in the syllabus"
+        )
+        self.url = reverse("chat-search")
+
+    def search(self, url=None, **params):
+        response = self.roger_client.get(url or self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data.get("data")
+
+    def test_ranked_with_snippets(self):
+        """
+        Test if search results are ranked and come with highlighted snippets
+        """
+        url = reverse(
+            "chat-message-search",
+            kwargs={"course_pk": self.course.pk, "chat_pk": self.chat_group.pk},
+        )
+        results = self.search(url, q="deadline").get("results")
+        self.assertEqual(
+            [result["id"] for result in results],
+            [self.messages[1].pk, self.messages[0].pk],
+        )
+        self.assertIn("<mark>deadline</mark>", results[1]["snippet"])
+
+    def test_snippets_are_escaped(self):
+        """
+        Test if the text of snippets is escaped around the highlighted terms
+        """
+        message = ChatMessage.objects.create(
+            chat_group=self.chat_group,
+            user=self.sally_user,
+            text='<img src=x onerror="alert(1)"> deadline',
+        )
+        url = reverse(
+            "chat-message-search",
+            kwargs={"course_pk": self.course.pk, "chat_pk": self.chat_group.pk},
+        )
+        results = self.search(url, q="deadline").get("results")
+        snippet = next(
+            result["snippet"] for result in results if result["id"] == message.pk
+        )
+        self.assertNotIn("<img", snippet)
+        self.assertIn("&lt;img", snippet)
+        self.assertIn("<mark>deadline</mark>", snippet)
+
+    def test_all_chats_with_cursor(self):
+        """
+        Test if searching every chat of the user pages with a cursor
+        """
+        data = self.search(q="deadline", page_size=2)
+        self.assertEqual(len(data.get("results")), 2)
+        cursor = parse_qs(urlparse(data.get("next")).query)["cursor"][0]
+        data = self.search(q="deadline", page_size=2, cursor=cursor)
+        self.assertEqual(len(data.get("results")), 1)
+        self.assertIsNone(data.get("next"))
+
+        data = self.search(q="deadline", sort="recent")
+        self.assertEqual(
+            data.get("results")[0]["text"], "Other deadlines are in the syllabus"
+        )
+
+    def test_cleared_deleted_and_foreign_messages_are_hidden(self):
+        """
+        Test if cleared, deleted and foreign messages are left out of search results
+        """
+        ChatMembership.objects.filter(
+            user=self.roger_user, chat_group=self.other_group
+        ).update(cleared=timezone.now())
+        message = self.messages[1]
+        message.is_deleted_by_sender = True
+        message.save()
+        results = self.search(q="deadline").get("results")
+        self.assertEqual([result["id"] for result in results], [self.messages[0].pk])
+
+        response = self.james_client.get(self.url, {"q": "deadline"})
+        self.assertEqual(response.data.get("data").get("results"), [])
+
+    def test_index_follows_edits_and_deletes(self):
+        """
+        Test if edited and deleted messages are reindexed
+        """
+        message = self.messages[2]
+        message.text = "Class moved, new deadline"
+        message.save()
+        self.assertEqual(len(self.search(q="class").get("results")), 1)
+        message.delete()
+        self.assertEqual(self.search(q="class").get("results"), [])
+
+
+class ChatMessageSeqMigrationTestCase(MigrationTestCase):
+    """
+    ChatMessageSeqMigrationTestCase
+    """
+
+    migrate_from = [("chat", "0001_initial")]
+    migrate_to = [("chat", "0002_chatgroup_last_message")]
+
+    def setUpBeforeMigration(self, apps):
+        ChatGroup = apps.get_model("chat", "ChatGroup")
+        ChatMessage = apps.get_model("chat", "ChatMessage")
+        self.chat_group_id = ChatGroup.objects.create(name="Python").pk
+        self.empty_group_id = ChatGroup.objects.create(name="Empty").pk
+        now = timezone.now()
+        # created out of order
+        for minutes, text in ((2, "third"), (0, "first"), (1, "second")):
+            message = ChatMessage.objects.create(
+                chat_group_id=self.chat_group_id, text=text
+            )
+            ChatMessage.objects.filter(pk=message.pk).update(
+                created_at=now + timezone.timedelta(minutes=minutes)
+            )
+
+    def test_messages_are_numbered_in_creation_order(self):
+        """
+        Test if the migration numbers existing messages by creation date and
+        points their group at the latest one
+        """
+        ChatGroup = self.apps.get_model("chat", "ChatGroup")
+        ChatMessage = self.apps.get_model("chat", "ChatMessage")
+        self.assertEqual(
+            list(ChatMessage.objects.order_by("seq").values_list("seq", "text")),
+            [(1, "first"), (2, "second"), (3, "third")],
+        )
+        chat_group = ChatGroup.objects.get(pk=self.chat_group_id)
+        self.assertEqual(chat_group.message_seq, 3)
+        self.assertEqual(chat_group.last_message.text, "third")
+        self.assertEqual(chat_group.last_message_at, chat_group.last_message.created_at)
+        empty_group = ChatGroup.objects.get(pk=self.empty_group_id)
+        self.assertEqual(empty_group.message_seq, 0)
+        self.assertIsNone(empty_group.last_message)
+
+
+class ChatReadWatermarkMigrationTestCase(MigrationTestCase):
+    """
+    ChatReadWatermarkMigrationTestCase
+    """
+
+    migrate_from = [("chat", "0001_initial")]
+    migrate_to = [("chat", "0004_chatmembership_last_read_message_seq")]
+
+    def setUpBeforeMigration(self, apps):
+        User = apps.get_model("accounts", "User")
+        ChatMembership = apps.get_model("chat", "ChatMembership")
+        ChatMessage = apps.get_model("chat", "ChatMessage")
+        ChatMessageRead = apps.get_model("chat", "ChatMessageRead")
+        chat_group = apps.get_model("chat", "ChatGroup").objects.create(name="Python")
+        self.users = {
+            name: User.objects.create(username=name, email=f"{name}@asdf.com")
+            for name in ("sally", "roger", "james")
+        }
+        now = timezone.now()
+        messages = []
+        for minutes in range(3):
+            message = ChatMessage.objects.create(chat_group=chat_group, text="hi")
+            ChatMessage.objects.filter(pk=message.pk).update(
+                created_at=now + timezone.timedelta(minutes=minutes)
+            )
+            messages.append(message)
+        # sally opened the chat after the first message, then read the second
+        ChatMembership.objects.create(
+            chat_group=chat_group,
+            user=self.users["sally"],
+            last_read=now + timezone.timedelta(seconds=30),
+        )
+        ChatMessageRead.objects.create(user=self.users["sally"], message=messages[1])
+        # james read the last message only
+        ChatMembership.objects.create(chat_group=chat_group, user=self.users["james"])
+        ChatMessageRead.objects.create(user=self.users["james"], message=messages[2])
+        ChatMembership.objects.create(chat_group=chat_group, user=self.users["roger"])
+
+    def test_reads_become_watermarks(self):
+        """
+        Test if the reads of unnumbered messages are collapsed into the read
+        watermarks when migrating from before message numbers
+        """
+        ChatMembership = self.apps.get_model("chat", "ChatMembership")
+        watermarks = {
+            membership.user_id: membership.last_read_message_seq
+            for membership in ChatMembership.objects.all()
+        }
+        self.assertEqual(
+            watermarks,
+            {
+                self.users["sally"].pk: 2,
+                self.users["james"].pk: 3,
+                self.users["roger"].pk: 0,
+            },
+        )
+
+
+class ChatSearchMigrationTestCase(MigrationTestCase):
+    """
+    ChatSearchMigrationTestCase
+    """
+
+    migrate_from = [("chat", "0006_set_individual_pairs")]
+    migrate_to = [("chat", "0007_chat_message_search_index")]
+
+    def setUpBeforeMigration(self, apps):
+        ChatMessage = apps.get_model("chat", "ChatMessage")
+        chat_group = apps.get_model("chat", "ChatGroup").objects.create(name="Python")
+        self.message = ChatMessage.objects.create(
+            chat_group=chat_group, text="The homework deadline moved"
+        )
+        ChatMessage.objects.create(
+            chat_group=chat_group, text="deadline", is_deleted_by_sender=True
+        )
+        ChatMessage.objects.create(chat_group=chat_group)
+
+    def test_existing_messages_are_indexed(self):
+        """
+        Test if the migration indexes the existing messages, leaving deleted
+        and empty ones out
+        """
+        backend = get_search_backend()
+        match_sql, match_params = backend.match_sql(backend.to_query("deadline"))
+        with connection.cursor() as cursor:
+            cursor.execute(match_sql, match_params)
+            self.assertEqual(cursor.fetchall(), [(self.message.pk,)])
@@ -1,6 +1,6 @@
-from django.urls import re_path, include
+from django.urls import path, re_path, include
 from rest_framework_nested.routers import NestedSimpleRouter
-from .views import ChatGroupViewSet, MessageViewSet
+from .views import ChatGroupViewSet, MessageSearchView, MessageViewSet
 from courses.urls import course_router
 
 chats_router = NestedSimpleRouter(course_router, r"course", lookup="course")
@@ -9,6 +9,7 @@ chats_router.register(r"chat", ChatGroupViewSet, basename="course-chat")
 messages_router = NestedSimpleRouter(chats_router, r"chat", lookup="chat")
 messages_router.register(r"message", MessageViewSet, basename="chat-message")
 urlpatterns = [
+    path("chat/search/", MessageSearchView.as_view(), name="chat-search"),
     re_path(r"", include(messages_router.urls)),
     re_path(r"", include(chats_router.urls)),
 ]
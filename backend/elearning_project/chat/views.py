@@ -1,22 +1,70 @@
+from django.http import Http404
 from django.shortcuts import get_object_or_404
-from rest_framework.permissions import IsAuthenticated
+from rest_framework import exceptions
+from rest_framework.permissions import SAFE_METHODS, IsAdminUser, IsAuthenticated
+from rest_framework.generics import GenericAPIView
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.decorators import action
 
+from core.pagination import CursorResultsSetPagination
 from core.utils import success_response
+from core.views import QueryBudgetViewMixin, SparseFieldsetsViewMixin
 
+from accounts.models import User
+from chat.archive import ChatArchive
+from chat.history import HISTORY_ANCHORS, get_history
+from chat.importer import MessageImportError, import_messages
 from chat.models import ChatGroup, ChatMembership, ChatMessage
+from chat.pagination import ArchiveCursorPagination
 from chat.serializers import (
     ChatGroupSerializer,
     ChatMembershipSerializer,
+    ChatMessageSearchSerializer,
     ChatMessageSerializer,
 )
 
 
-class ChatGroupViewSet(ModelViewSet):
+class MessageSearchMixin:
+    """
+    Ranked full text search over messages with highlighted snippets, most
+    relevant first or, with `?sort=recent`, newest first. Both orders are
+    paged with a cursor
+    """
+
+    search_orderings = {"relevance": "-search_rank", "recent": "-created_at"}
+
+    def get_search_response(self, queryset):
+        request = self.request
+        text = request.query_params.get("q")
+        if not text:
+            raise exceptions.ParseError(detail="Provide a search query with `q`")
+        sort = request.query_params.get("sort", "relevance")
+        if sort not in self.search_orderings:
+            raise exceptions.ParseError(detail="sort must be relevance or recent")
+        self.cursor_ordering = self.search_orderings[sort]
+
+        queryset = (
+            queryset.visible_to(request.user)
+            .search(text)
+            .select_related("user__profile")
+            .prefetch_related("files")
+        )
+        page = self.paginate_queryset(queryset)
+        serializer = ChatMessageSearchSerializer(
+            page, many=True, **self.get_sparse_fieldsets()
+        )
+        return self.paginator.get_paginated_response(
+            detail="Fetched matching messages" if page else "No messages found",
+            data=serializer.data,
+        )
+
+
+class ChatGroupViewSet(QueryBudgetViewMixin, SparseFieldsetsViewMixin, ModelViewSet):
     queryset = ChatGroup.objects.all()
     serializer_class = ChatGroupSerializer
     permission_classes = [IsAuthenticated]
+    # whatever the number of chats listed
+    query_budgets = {"list": 5}
 
     def retrieve(self, request, course_pk=None, pk=None, *args, **kwargs):
         chat_group = self.get_object()
@@ -35,41 +83,85 @@ class ChatGroupViewSet(ModelViewSet):
     @action(detail=True, methods=["get"])
     def members(self, request, course_pk=None, pk=None, *args, **kwargs):
         chat_group = self.get_object()
-        chat_members = chat_group.chat_memberships.all()
-        serializer = ChatMembershipSerializer(chat_members, many=True)
+        chat_members = chat_group.chat_memberships.select_related("user__profile")
+        serializer = ChatMembershipSerializer(
+            chat_members, many=True, **self.get_sparse_fieldsets()
+        )
         return success_response(detail="Fetched all chat members", data=serializer.data)
 
+    @action(detail=True, methods=["post"])
+    def read(self, request, course_pk=None, pk=None, *args, **kwargs):
+        chat_group = self.get_object()
+        seq = request.data.get("seq")
+        try:
+            seq = None if seq in (None, "") else int(seq)
+        except (TypeError, ValueError):
+            raise exceptions.ParseError(detail="seq must be an integer")
+        state = ChatMembership.objects.mark_read(chat_group.pk, request.user, seq)
+        if state is None:
+            raise exceptions.NotFound(detail="You are not a member of this chat")
+        return success_response(
+            detail="Chat marked as read", chat_group=chat_group.pk, **state
+        )
+
     @action(detail=False, methods=["get"])
     def individual(self, request, course_pk=None, pk=None, *args, **kwargs):
-        # get individual chat group by user id
-        user_id = request.GET.get("user_id")
+        # get individual chat group by user id, created on first contact
         current_user = request.user
-        my_groups = current_user.chat_memberships.filter(
-            chat_group__course=course_pk, chat_group__chat_type="individual"
-        ).values_list("chat_group", flat=True)
-        user_groups = ChatMembership.objects.filter(
-            chat_group__course=course_pk,
-            user_id=user_id,
-            chat_group__chat_type="individual",
-        ).values_list("chat_group", flat=True)
-        # get common chat groups
-        chat_groups = list(set(my_groups) & set(user_groups))
-        # create chat group if not found
-        if len(chat_groups) == 0:
-            data = {
-                "name": f"{current_user.first_name} - {user_id}",
-                "members": [user_id],
-                "chat_type": "individual",
-                "course": course_pk,
-            }
-            serializer = self.get_serializer(data=data)
-            serializer.is_valid(raise_exception=True)
-            chat_group = self.perform_create(serializer)
-            chat_groups.append(chat_group.id)
-        chat_group = ChatGroup.objects.filter(id__in=chat_groups).first()
+        try:
+            user_id = int(request.GET.get("user_id"))
+        except (TypeError, ValueError):
+            raise exceptions.ParseError(detail="user_id must be an integer")
+        if user_id == current_user.pk:
+            raise exceptions.ParseError(detail="You cannot chat with yourself")
+        if not User.objects.filter(pk=user_id).exists():
+            raise exceptions.NotFound(detail="User does not exist")
+        chat_group, _ = ChatGroup.objects.get_or_create_individual(
+            course_pk,
+            current_user,
+            user_id,
+            name=f"{current_user.first_name} - {user_id}",
+        )
+        chat_group = self.get_queryset().get(pk=chat_group.pk)
         serializer = self.get_serializer(chat_group)
         return success_response(detail="Fetched all chat groups", **serializer.data)
 
+    @action(
+        detail=False,
+        methods=["post"],
+        permission_classes=[IsAdminUser],
+        url_path="import",
+        url_name="import",
+    )
+    def import_messages(self, request, course_pk=None, *args, **kwargs):
+        """
+        Import messages into the chats of the course from JSONL, uploaded as
+        `file` or sent as the request body, see `chat.importer`. Only messages
+        newer than the last message of their chat can be imported
+        """
+        if request.content_type.startswith("multipart/"):
+            if "file" not in request.FILES:
+                raise exceptions.ParseError(detail="file is required")
+            lines = request.FILES["file"]
+        else:
+            # read lazily from the socket, the body is never loaded whole
+            lines = request._request
+        try:
+            batch_size = int(request.query_params.get("batch_size", 1000))
+        except ValueError:
+            raise exceptions.ParseError(detail="batch_size must be an integer")
+        try:
+            stats = import_messages(
+                lines,
+                chat_groups=ChatGroup.objects.filter(course=course_pk).values("pk"),
+                batch_size=max(batch_size, 1),
+            )
+        except MessageImportError as error:
+            raise exceptions.ParseError(
+                detail=f"{error}, {error.stats['messages']} messages imported before"
+            )
+        return success_response(detail="Messages imported", code=201, **stats)
+
     def list(self, request, course_pk=None, *args, **kwargs):
         chat_groups = self.get_queryset()
 
@@ -103,7 +195,10 @@ class ChatGroupViewSet(ModelViewSet):
         queryset = self.queryset.filter(course=self.kwargs["course_pk"])
         if self.request.user.is_authenticated:
             queryset = queryset.mine(self.request.user)
-        return queryset
+        return queryset.with_viewer_state(
+            self.request.user,
+            fields=self.get_rendered_fields(self.get_serializer_class()),
+        )
 
     def get_object(self):
         queryset = self.filter_queryset(self.get_queryset())
@@ -119,10 +214,28 @@ class ChatGroupViewSet(ModelViewSet):
         return context
 
 
-class MessageViewSet(ModelViewSet):
+class MessageSearchView(MessageSearchMixin, SparseFieldsetsViewMixin, GenericAPIView):
+    """
+    Search the messages of all the chats of the user
+    """
+
+    queryset = ChatMessage.objects.all()
+    permission_classes = [IsAuthenticated]
+    pagination_class = CursorResultsSetPagination
+
+    def get(self, request, *args, **kwargs):
+        return self.get_search_response(self.get_queryset())
+
+
+class MessageViewSet(
+    QueryBudgetViewMixin, MessageSearchMixin, SparseFieldsetsViewMixin, ModelViewSet
+):
     queryset = ChatMessage.objects.all()
     serializer_class = ChatMessageSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = ArchiveCursorPagination
+    # the last page also looks for archived messages
+    query_budgets = {"list": 4}
 
     def create(self, request, course_pk=None, chat_pk=None, *args, **kwargs):
         data = {**request.data, "chat_group": chat_pk}
@@ -137,6 +250,8 @@ class MessageViewSet(ModelViewSet):
         messages = self.get_queryset()
 
         queryset = self.filter_queryset(messages)
+        if any(name in request.query_params for name in (*HISTORY_ANCHORS, "limit")):
+            return self.get_history_response(queryset)
 
         page = self.paginate_queryset(queryset)
         if page is not None:
@@ -149,6 +264,47 @@ class MessageViewSet(ModelViewSet):
         serializer = self.get_serializer(queryset, many=True)
         return success_response(detail="Fetched all messages", results=serializer.data)
 
+    @action(detail=False, methods=["get"])
+    def search(self, request, course_pk=None, chat_pk=None, *args, **kwargs):
+        return self.get_search_response(ChatMessage.objects.filter(chat_group=chat_pk))
+
+    @action(detail=True, methods=["get"])
+    def reads(self, request, course_pk=None, chat_pk=None, pk=None, *args, **kwargs):
+        # derived from the read watermarks of the members
+        message = self.get_object()
+        readers = ChatMembership.objects.read_by(message)
+        page = self.paginate_queryset(readers.select_related("user__profile"))
+        serializer = ChatMembershipSerializer(
+            page, many=True, **self.get_sparse_fieldsets()
+        )
+        return self.paginator.get_paginated_response(
+            data=serializer.data,
+            detail="Fetched message reads",
+            read_count=readers.count(),
+        )
+
+    def get_history_response(self, queryset):
+        """
+        Return the window of messages before, after or around a message id,
+        see `chat.history`
+        """
+        try:
+            history = get_history(
+                queryset,
+                self.request.query_params,
+                archive=self.get_archive(),
+            )
+        except ValueError as error:
+            raise exceptions.ParseError(detail=str(error))
+        except ChatMessage.DoesNotExist:
+            raise exceptions.NotFound(detail="Message not found")
+        serializer = self.get_serializer(history.pop("results"), many=True)
+        return success_response(
+            detail="Fetched all messages" if serializer.data else "No messages found",
+            results=serializer.data,
+            **history,
+        )
+
     def perform_create(self, serializer):
         return serializer.save(created_by=self.request.user, user=self.request.user)
 
@@ -164,23 +320,44 @@ class MessageViewSet(ModelViewSet):
 
     def get_queryset(self):
         queryset = self.queryset.filter(chat_group=self.kwargs["chat_pk"])
+        fields = self.get_rendered_fields(self.get_serializer_class())
+        if "user" in fields:
+            queryset = queryset.select_related("user__profile")
+        if "files" in fields:
+            queryset = queryset.prefetch_related("files")
         return queryset
 
+    def get_archive(self):
+        return ChatArchive(self.kwargs["chat_pk"])
+
     def get_object(self):
         queryset = self.filter_queryset(self.get_queryset())
-        obj = get_object_or_404(queryset, pk=self.kwargs[self.lookup_field])
+        try:
+            obj = get_object_or_404(queryset, pk=self.kwargs[self.lookup_field])
+        except Http404:
+            # archived messages can be read but not changed
+            if self.request.method not in SAFE_METHODS:
+                raise
+            try:
+                obj = self.get_archive().get(int(self.kwargs[self.lookup_field]))
+            except (ChatMessage.DoesNotExist, ValueError):
+                raise exceptions.NotFound(detail="Message not found")
         # May raise a permission denied
         self.check_object_permissions(self.request, obj)
-        return super().get_object()
+        return obj
 
     def get_serializer_context(self):
         user = self.request.user
-        chat_membership = user.chat_memberships.filter(
-            chat_group=self.kwargs["chat_pk"]
-        ).first()
+        chat_membership = None
+        if "is_read" in self.get_rendered_fields(self.get_serializer_class()):
+            chat_membership = user.chat_memberships.filter(
+                chat_group=self.kwargs["chat_pk"]
+            ).first()
         context = super().get_serializer_context()
         context["request"] = self.request
-        context["last_read"] = chat_membership.last_read if chat_membership else None
+        context["last_read_seq"] = (
+            chat_membership.last_read_message_seq if chat_membership else None
+        )
         context["user"] = (
             self.request.user if self.request.user.is_authenticated else None
         )
@@ -11,3 +11,9 @@ class COURSE_STATUS(StrEnum):
     DRAFT = "draft"
     PUBLISHED = "published"
     ARCHIVED = "archived"
+
+
+class COURSE_ROLES(StrEnum):
+    OWNER = "owner"
+    INSTRUCTOR = "instructor"
+    MEMBER = "member"
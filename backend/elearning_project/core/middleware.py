@@ -0,0 +1,72 @@
+import logging
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from core.querycount import QueryRecorder
+
+logger = logging.getLogger("elearning.queries")
+
+
+def get_view_name(request):
+    """Return `ViewSet.action` for DRF viewsets, the view path otherwise"""
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return request.path
+    view_class = getattr(match.func, "cls", None)
+    if view_class is None:
+        return match.view_name or request.path
+    # viewsets map each http method of a route to an action
+    actions = getattr(match.func, "actions", None) or {}
+    action = actions.get(request.method.lower(), request.method.lower())
+    return f"{view_class.__name__}.{action}"
+
+
+class QueryCountMiddleware:
+    """
+    Opt-in with `QUERY_COUNT_ENABLED`: record the SQL run by each request,
+    report it in `X-SQL-Count`, `X-SQL-Time` (ms) and `X-SQL-Duplicates`
+    response headers, and log likely N+1s with the code location repeating
+    them. Requests running more than `QUERY_COUNT_WARNING` queries, or more
+    than the budget of their view, see `core.views.QueryBudgetViewMixin`,
+    are logged as warnings.
+    """
+
+    def __init__(self, get_response):
+        if not settings.QUERY_COUNT_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryRecorder(
+            n_plus_one_threshold=settings.QUERY_COUNT_N_PLUS_ONE_THRESHOLD
+        ) as recorder:
+            response = self.get_response(request)
+
+        duplicates = recorder.duplicates()
+        response["X-SQL-Count"] = str(recorder.count)
+        response["X-SQL-Time"] = f"{recorder.duration * 1000:.1f}"
+        response["X-SQL-Duplicates"] = str(sum(count - 1 for _, count in duplicates))
+
+        summary = recorder.summary()
+        budget = getattr(response, "query_budget", None)
+        over_budget = budget is not None and recorder.count > budget
+        if budget is not None:
+            response["X-SQL-Budget"] = str(budget)
+            if over_budget:
+                summary = f"over its budget of {budget} queries, {summary}"
+
+        suspects = recorder.n_plus_one()
+        if suspects or over_budget or recorder.count > settings.QUERY_COUNT_WARNING:
+            level = logging.WARNING
+        else:
+            level = logging.DEBUG
+        logger.log(
+            level,
+            "%s %s (%s): %s",
+            request.method,
+            request.path,
+            get_view_name(request),
+            summary,
+        )
+        return response
@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.expressions import OrderBy
 
 
 class BaseModel(models.Model):
@@ -17,3 +18,40 @@ class BaseModel(models.Model):
 
     class Meta:
         abstract = True
+
+
+class AtomicSaveMixin:
+    """
+    Run `save` together with its post_save receivers in one transaction, so
+    that denormalized rows maintained by signals never drift from the source.
+    """
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get("using")):
+            super().save(*args, **kwargs)
+
+
+class NullsOrderIndex(models.Index):
+    """
+    Index on expressions ordering nulls, eg. `F("field").desc(nulls_last=True)`,
+    for the queries ordered the same way. PostgreSQL sorts nulls as the
+    largest values and needs the null ordering in the index. SQLite rejects
+    it in indexes but sorts nulls as the smallest values, ie. last in
+    descending order, so it gets the index without the null ordering.
+    """
+
+    def create_sql(self, model, schema_editor, using="", **kwargs):
+        if schema_editor.connection.vendor != "sqlite":
+            return super().create_sql(model, schema_editor, using=using, **kwargs)
+        index = self.clone()
+        index.expressions = tuple(
+            (
+                OrderBy(expression.expression, descending=expression.descending)
+                if isinstance(expression, OrderBy)
+                else expression
+            )
+            for expression in self.expressions
+        )
+        return super(NullsOrderIndex, index).create_sql(
+            model, schema_editor, using=using, **kwargs
+        )
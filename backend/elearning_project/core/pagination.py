@@ -1,7 +1,15 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import DateTimeField, Q
+from django.utils.dateparse import parse_datetime
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 from core.utils import success_response
-from collections import OrderedDict
 
 
 class DefaultResultsSetPagination(pagination.PageNumberPagination):
@@ -9,7 +17,7 @@ class DefaultResultsSetPagination(pagination.PageNumberPagination):
     page_size_query_param = "page_size"
     max_page_size = 1000
 
-    def get_paginated_response(self, data, detail="Fetched all records"):
+    def get_paginated_response(self, data, detail="Fetched all records", **extra):
         return success_response(
             detail=detail,
             **OrderedDict(
@@ -19,5 +27,154 @@ class DefaultResultsSetPagination(pagination.PageNumberPagination):
                     ("previous", self.get_previous_link()),
                     ("results", data),
                 ]
-            )
+            ),
+            **extra,
+        )
+
+
+class CursorResultsSetPagination(pagination.BasePagination):
+    """
+    Keyset pagination on `(created_at, id)`: pages are fetched with a range
+    condition on the ordering instead of COUNT(*) and OFFSET, so they cost
+    the same anywhere in the list.
+
+    The ordering defaults to newest first, views may set `cursor_ordering`
+    to another datetime or numeric field, eg. an annotated search rank, or
+    to ascending order. `count` is only
+    computed when the `with_count` query param is given.
+    """
+
+    page_size = 10
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+    cursor_query_param = "cursor"
+    count_query_param = "with_count"
+    ordering = "-created_at"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        ordering = getattr(view, "cursor_ordering", self.ordering)
+        self.field = ordering.lstrip("-")
+        self.descending = ordering.startswith("-")
+
+        self.count = None
+        if request.query_params.get(self.count_query_param):
+            self.count = queryset.count()
+
+        cursor = self.decode_cursor(request, queryset)
+        is_reversed = cursor is not None and cursor["reverse"]
+        results = self.get_rows(queryset, cursor, self.descending != is_reversed)
+        has_more = len(results) > self.page_size
+        self.page = results[: self.page_size]
+        if is_reversed:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        return self.page
+
+    def get_rows(self, queryset, cursor, descending):
+        """Return at most `page_size + 1` rows past `cursor`, in the order
+        they are paged"""
+        if cursor is not None:
+            queryset = queryset.filter(self.get_keyset_filter(cursor, descending))
+        if descending:
+            queryset = queryset.order_by(f"-{self.field}", "-pk")
+        else:
+            queryset = queryset.order_by(self.field, "pk")
+        return list(queryset[: self.page_size + 1])
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_keyset_filter(self, cursor, descending):
+        lookup = "lt" if descending else "gt"
+        return Q(**{f"{self.field}__{lookup}": cursor["value"]}) | Q(
+            **{self.field: cursor["value"], f"pk__{lookup}": cursor["pk"]}
+        )
+
+    def decode_cursor(self, request, queryset):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode("ascii")))
+            return {
+                "value": self.parse_cursor_value(queryset, cursor["v"]),
+                "pk": int(cursor["pk"]),
+                "reverse": bool(cursor.get("r")),
+            }
+        except (TypeError, ValueError, KeyError, UnicodeEncodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def parse_cursor_value(self, queryset, value):
+        """Return the cursor `value` as a datetime for a datetime ordering
+        field and as a number otherwise, so that a tampered cursor fails
+        here instead of in the query
+
+        Raises:
+            ValueError: when `value` does not parse
+        """
+        try:
+            field = queryset.model._meta.get_field(self.field)
+        except FieldDoesNotExist:
+            # annotated, eg. a search rank
+            field = None
+        if isinstance(field, DateTimeField):
+            parsed = parse_datetime(value) if isinstance(value, str) else None
+            if parsed is None:
+                raise ValueError(value)
+            return parsed
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(value)
+        return value
+
+    @staticmethod
+    def make_cursor(value, pk, reverse=False):
+        """Return the encoded cursor of the rows after `(value, pk)`, or
+        before it when `reverse`"""
+        if hasattr(value, "isoformat"):
+            value = value.isoformat()
+        cursor = {"v": value, "pk": pk}
+        if reverse:
+            cursor["r"] = 1
+        return urlsafe_b64encode(json.dumps(cursor).encode("ascii")).decode("ascii")
+
+    def encode_cursor(self, obj, reverse=False):
+        cursor = self.make_cursor(getattr(obj, self.field), obj.pk, reverse)
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data, detail="Fetched all records", **extra):
+        return success_response(
+            detail=detail,
+            **OrderedDict(
+                [
+                    ("count", self.count),
+                    ("next", self.get_next_link()),
+                    ("previous", self.get_previous_link()),
+                    ("results", data),
+                ]
+            ),
+            **extra,
         )
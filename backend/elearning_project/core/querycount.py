@@ -0,0 +1,130 @@
+import re
+import sysconfig
+import time
+import traceback
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+
+from django.db import connections
+
+__all__ = [
+    "QueryRecorder",
+    "fingerprint",
+]
+
+
+# Frames from these directories are framework code, the location of a
+# query is the innermost frame outside of them
+LIBRARY_PATHS = tuple(
+    {sysconfig.get_paths()[name] for name in ("stdlib", "platstdlib", "purelib")}
+    | {sysconfig.get_paths()["platlib"]}
+)
+
+IN_LIST = re.compile(r"\(\s*%s(\s*,\s*%s)*\s*\)")
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r"\b\d+(\.\d+)?\b")
+SPACES = re.compile(r"\s+")
+
+
+def fingerprint(sql):
+    """Return `sql` with its literals and parameter lists folded, so that
+    the same statement run for different rows compares equal"""
+    sql = STRING.sub("?", sql)
+    sql = NUMBER.sub("?", sql)
+    sql = IN_LIST.sub("(...)", sql)
+    return SPACES.sub(" ", sql).strip()
+
+
+def get_location():
+    """Return the innermost frame of project code on the stack"""
+    for frame in reversed(traceback.extract_stack()):
+        if frame.filename == __file__ or frame.filename.startswith(LIBRARY_PATHS):
+            continue
+        return f"{frame.filename}:{frame.lineno} in {frame.name}"
+    return "unknown"
+
+
+class QueryRecorder:
+    """
+    Record the SQL statements run on every database connection, with their
+    duration and the project code that ran them.
+
+        with QueryRecorder() as recorder:
+            ...
+        recorder.count, recorder.duration, recorder.n_plus_one()
+    """
+
+    def __init__(self, n_plus_one_threshold=3):
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.queries = []
+
+    def __enter__(self):
+        self.stack = ExitStack()
+        for connection in connections.all():
+            self.stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stack.close()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append(
+                {
+                    "sql": sql,
+                    "duration": time.perf_counter() - start,
+                    "fingerprint": fingerprint(sql),
+                    "location": get_location(),
+                }
+            )
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def duration(self):
+        """Total time spent in the database, in seconds"""
+        return sum(query["duration"] for query in self.queries)
+
+    def duplicates(self):
+        """Return the fingerprints run more than once, most repeated first
+
+        Returns:
+            list: (fingerprint, count) pairs
+        """
+        counts = Counter(query["fingerprint"] for query in self.queries)
+        return [(sql, count) for sql, count in counts.most_common() if count > 1]
+
+    def n_plus_one(self):
+        """Return the statements repeated from one code location at least
+        `n_plus_one_threshold` times, the usual shape of an N+1
+
+        Returns:
+            list: dicts with location, fingerprint and count
+        """
+        counts = defaultdict(int)
+        for query in self.queries:
+            counts[(query["location"], query["fingerprint"])] += 1
+        return [
+            {"location": location, "fingerprint": sql, "count": count}
+            for (location, sql), count in sorted(
+                counts.items(), key=lambda item: -item[1]
+            )
+            if count >= self.n_plus_one_threshold
+        ]
+
+    def summary(self):
+        """Return a readable report of the recorded statements"""
+        lines = [f"{self.count} queries in {self.duration * 1000:.1f}ms"]
+        for suspect in self.n_plus_one():
+            lines.append(
+                f"  possible N+1: {suspect['count']}x at {suspect['location']}: "
+                f"{suspect['fingerprint']}"
+            )
+        for sql, count in self.duplicates()[:5]:
+            lines.append(f"  {count}x {sql}")
+        return "\n".join(lines)
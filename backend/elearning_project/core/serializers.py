@@ -31,3 +31,43 @@ class CamelCaseSerializerMixin:
         """
         data = super().to_representation(instance)
         return {inflection.camelize(key, False): value for key, value in data.items()}
+
+
+def parse_fieldset(value):
+    """
+    Split a comma separated list of field names, given in camelCase or
+    snake_case, into a set of snake_case names. Returns None when empty.
+    """
+    if not value:
+        return None
+    return {inflection.underscore(name.strip()) for name in value.split(",")} - {""}
+
+
+class SparseFieldsetsMixin:
+    """
+    Restrict the rendered fields with the `fields` and `omit` arguments.
+
+    Dropped fields are never evaluated, so method fields and nested
+    serializers that are left out run no queries.
+    """
+
+    def __init__(self, *args, fields=None, omit=None, **kwargs):
+        self.sparse_fields = fields
+        self.sparse_omit = omit
+        super().__init__(*args, **kwargs)
+
+    @classmethod
+    def select_fields(cls, names, fields=None, omit=None):
+        """Return the subset of `names` rendered for `fields` and `omit`"""
+        return [
+            name
+            for name in names
+            if (fields is None or name in fields) and not (omit and name in omit)
+        ]
+
+    def get_fields(self):
+        fields = super().get_fields()
+        return {
+            name: fields[name]
+            for name in self.select_fields(fields, self.sparse_fields, self.sparse_omit)
+        }
@@ -1,8 +1,16 @@
-from django.test import TestCase
+import re
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework.test import APITestCase, APIClient
 
 from accounts.models import User
+from core.querycount import QueryRecorder
 
 
 class BaseTestCaseMixin(object):
@@ -11,6 +19,9 @@ class BaseTestCaseMixin(object):
     """
 
     def setUp(self):
+        # Cached payloads must not leak between test cases.
+        cache.clear()
+
         # Create users for our test cases.
         self.admin_user = User.objects.create_superuser(
             "admin", "testadmin@asdf.com", "adminpassword"
@@ -26,6 +37,76 @@ class BaseTestCaseMixin(object):
         )
         self.roger_profile = self.roger_user.profile
 
+    @contextmanager
+    def assertQueryBudget(self, budget):
+        """
+        Fail when the block runs more than `budget` queries, with the repeated
+        statements and likely N+1s in the message
+        """
+        with QueryRecorder() as recorder:
+            yield recorder
+        if recorder.count > budget:
+            self.fail(f"Query budget of {budget} exceeded: {recorder.summary()}")
+
+    def assertUsesIndex(self, queryset, index=None):
+        """
+        Fail when the query plan of `queryset` scans its table instead of
+        searching an index, or does not read through `index` when given.
+        Unique constraints are not named in SQLite plans, leave `index`
+        out for them
+        """
+        if connection.vendor == "postgresql":
+            # test tables are tiny, a sequential scan would always win
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        plan = queryset.explain()
+        table = re.escape(queryset.model._meta.db_table)
+        if re.search(rf"\b(SCAN|Seq Scan on) {table}\b", plan):
+            self.fail(f"{queryset.query} scans {table}:\n{plan}")
+        if index is not None and index not in plan:
+            self.fail(f"{index} is not used by {queryset.query}:\n{plan}")
+
+    @contextmanager
+    def assertQueriesUseIndex(self, table, index=None, ordered=False):
+        """
+        Fail when a SELECT run in the block, eg. by a request to an
+        endpoint, scans `table`, or when none of them reads through `index`
+        when given, in its order without sorting when `ordered`. The
+        statements are explained as they were run, so the filters and
+        ordering of the views are checked, not a copy of them
+        """
+        with CaptureQueriesContext(connection) as captured:
+            yield
+        reads = re.compile(rf'\b(FROM|JOIN) "?{re.escape(table)}"?\s')
+        queries = [
+            query["sql"]
+            for query in captured
+            if query["sql"].lstrip().upper().startswith("SELECT")
+            and reads.search(query["sql"])
+        ]
+        if not queries:
+            self.fail(f"No query read {table}")
+        plans = [(sql, self.explain(sql)) for sql in queries]
+        for sql, plan in plans:
+            if re.search(rf"\b(SCAN|Seq Scan on) {re.escape(table)}\b", plan):
+                self.fail(f"{sql} scans {table}:\n{plan}")
+        # rows sorted after the read are not in the order of the index
+        sorts = re.compile(r"TEMP B-TREE FOR .*ORDER BY|\bSort\b")
+        if index is not None and not any(
+            index in plan and not (ordered and sorts.search(plan)) for _, plan in plans
+        ):
+            self.fail(f"{index} is not used to read {table}:\n{plans}")
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                # test tables are tiny, a sequential scan would always win
+                cursor.execute("SET LOCAL enable_seqscan = off")
+                cursor.execute(f"EXPLAIN {sql}")
+            else:
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+            return "\n".join(str(row[-1]) for row in cursor.fetchall())
+
 
 class BaseTestCase(BaseTestCaseMixin, TestCase):
     """
@@ -53,3 +134,34 @@ class BaseAPITestCase(BaseTestCaseMixin, APITestCase):
         self.sally_client.force_authenticate(self.sally_user)
         self.roger_client = APIClient()
         self.roger_client.force_authenticate(self.roger_user)
+        self.james_client = APIClient()
+        self.james_client.force_authenticate(self.james_user)
+
+
+class MigrationTestCase(TransactionTestCase):
+    """
+    Base test class for data migrations: the database is migrated back to
+    `migrate_from`, `setUpBeforeMigration` creates rows with the historical
+    models, then `migrate_to` is applied and its models are `self.apps`
+    """
+
+    migrate_from = None
+    migrate_to = None
+
+    def setUp(self):
+        super(MigrationTestCase, self).setUp()
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        self.setUpBeforeMigration(executor.loader.project_state(self.migrate_from).apps)
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_to)
+        self.apps = executor.loader.project_state(self.migrate_to).apps
+
+    def tearDown(self):
+        # leave the schema as the other test cases expect it
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+        super(MigrationTestCase, self).tearDown()
+
+    def setUpBeforeMigration(self, apps):
+        pass
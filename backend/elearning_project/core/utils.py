@@ -31,6 +31,14 @@ def success_response(detail, code=200, **kwargs):
     return Response(data, code)
 
 
+def is_cascade_from(origin, *models):
+    """
+    Whether a delete was started from one of `models`, whose own cascade
+    removes the rows a signal receiver would otherwise maintain
+    """
+    return isinstance(origin, models) or getattr(origin, "model", None) in models
+
+
 def camelize(data):
     """
     Recursively convert all keys in a dictionary or list to camelCase.
@@ -0,0 +1,61 @@
+from rest_framework.permissions import SAFE_METHODS
+
+from core.serializers import SparseFieldsetsMixin, parse_fieldset
+
+
+class SparseFieldsetsViewMixin:
+    """
+    Pass the `fields` and `omit` query params of read requests to the
+    serializers supporting them, eg. `?fields=id,title,coverUrl`
+    """
+
+    fields_query_param = "fields"
+    omit_query_param = "omit"
+
+    def get_sparse_fieldsets(self):
+        if self.request.method not in SAFE_METHODS:
+            return {}
+        return {
+            "fields": parse_fieldset(
+                self.request.query_params.get(self.fields_query_param)
+            ),
+            "omit": parse_fieldset(
+                self.request.query_params.get(self.omit_query_param)
+            ),
+        }
+
+    def get_rendered_fields(self, serializer_class):
+        """Return the names of the fields `serializer_class` renders, so that
+        querysets can skip the annotations and prefetches of the others"""
+        return serializer_class.select_fields(
+            serializer_class.Meta.fields, **self.get_sparse_fieldsets()
+        )
+
+    def get_serializer(self, *args, **kwargs):
+        if issubclass(self.get_serializer_class(), SparseFieldsetsMixin):
+            for name, value in self.get_sparse_fieldsets().items():
+                kwargs.setdefault(name, value)
+        return super().get_serializer(*args, **kwargs)
+
+
+class QueryBudgetViewMixin:
+    """
+    DRF side of `core.middleware.QueryCountMiddleware`: `query_budgets` maps
+    the actions of a view, or the lowercase http methods of a plain
+    `APIView`, to the most queries one request should run. The middleware
+    reports the budget in `X-SQL-Budget` and logs requests over it as
+    warnings
+    """
+
+    query_budgets = {}
+
+    def get_query_budget(self):
+        action = getattr(self, "action", None) or self.request.method.lower()
+        return self.query_budgets.get(action)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        budget = self.get_query_budget()
+        if budget is not None:
+            response.query_budget = budget
+        return response
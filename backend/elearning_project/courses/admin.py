@@ -5,6 +5,8 @@ from courses.models import (
     CourseMaterial,
     CourseFeedback,
     CourseInstructor,
+    CourseStats,
+    UserCourse,
 )
 
 admin.site.register(Course)
@@ -12,3 +14,5 @@ admin.site.register(CourseMembership)
 admin.site.register(CourseMaterial)
 admin.site.register(CourseFeedback)
 admin.site.register(CourseInstructor)
+admin.site.register(CourseStats)
+admin.site.register(UserCourse)
@@ -0,0 +1,76 @@
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+
+from courses.serializers import CourseDetailSerializer
+
+__all__ = [
+    "bump_course_versions",
+    "get_course_version",
+    "get_course_detail_data",
+]
+
+
+def version_key(course_id):
+    return f"course:{course_id}:version"
+
+
+def detail_key(course_id, version):
+    return f"course:{course_id}:detail:{version}"
+
+
+def get_course_version(course_id):
+    """Return the current version token of a course
+
+    Versions are random tokens rather than counters, so a version evicted
+    from the cache can never point back at an outdated payload.
+    Bumps only reach other processes through a shared cache, see
+    `COURSE_DETAIL_CACHE_TIMEOUT` for the local memory fallback.
+    """
+    key = version_key(course_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid4().hex, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_course_versions(course_ids):
+    """Invalidate the cached detail payloads of the given courses"""
+    cache.set_many(
+        {version_key(course_id): uuid4().hex for course_id in set(course_ids)},
+        timeout=None,
+    )
+
+
+def get_course_detail_data(course, context, fields=None, omit=None):
+    """Return the course detail payload, the part shared by all users from
+    the cache and `CourseDetailSerializer.REQUEST_FIELDS` computed for this
+    request.
+
+    `course` should come from `CourseQueryset.with_list_data` so the request
+    fields are read from annotations and prefetches. `fields` and `omit`
+    restrict the payload as for `SparseFieldsetsMixin`.
+    """
+    names = CourseDetailSerializer.select_fields(
+        CourseDetailSerializer.Meta.fields, fields, omit
+    )
+    request_fields = {
+        name for name in names if name in CourseDetailSerializer.REQUEST_FIELDS
+    }
+
+    shared = {}
+    if len(request_fields) < len(names):
+        key = detail_key(course.pk, get_course_version(course.pk))
+        shared = cache.get(key)
+        if shared is None:
+            serializer = CourseDetailSerializer(
+                course, context=context, omit=CourseDetailSerializer.REQUEST_FIELDS
+            )
+            shared = dict(serializer.data)
+            cache.set(key, shared, timeout=settings.COURSE_DETAIL_CACHE_TIMEOUT)
+
+    serializer = CourseDetailSerializer(course, context=context, fields=request_fields)
+    data = {**shared, **serializer.data}
+    return {name: data[name] for name in names}
@@ -0,0 +1,91 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from courses.models import Course, UserCourse
+
+__all__ = [
+    "get_instructor_dashboard",
+    "invalidate_instructor_dashboards",
+]
+
+
+def dashboard_key(user_id):
+    return f"instructor:{user_id}:dashboard"
+
+
+def build_instructor_dashboard(user):
+    """Aggregate the stats of the courses owned by `user`, grouped by course
+    status, plus the number of distinct students across them
+
+    Returns:
+        dict: dashboard payload
+    """
+    rows = (
+        Course.objects.filter(owner=user)
+        .order_by()
+        .values("status")
+        .annotate(
+            course_count=Count("pk"),
+            members_count=Sum("stats__members_count"),
+            completed_count=Sum("stats__completed_count"),
+            rating_sum=Sum("stats__rating_sum"),
+            rating_count=Sum("stats__rating_count"),
+        )
+    )
+    status_counts = {status: 0 for status, _ in Course.STATUS_CHOICES}
+    totals = {
+        "members_count": 0,
+        "completed_count": 0,
+        "rating_sum": 0,
+        "rating_count": 0,
+    }
+    for row in rows:
+        status_counts[row["status"]] = row["course_count"]
+        for name in totals:
+            totals[name] += row[name] or 0
+
+    distinct_students_count = UserCourse.objects.filter(
+        course__owner=user, is_member=True
+    ).aggregate(count=Count("user", distinct=True))["count"]
+
+    members_count = totals["members_count"]
+    return {
+        "total_course_count": sum(status_counts.values()),
+        "published_course_count": status_counts["published"],
+        "status_counts": status_counts,
+        "total_students_count": members_count,
+        "distinct_students_count": distinct_students_count,
+        "completed_count": totals["completed_count"],
+        "completion_rate": (
+            totals["completed_count"] / members_count if members_count else None
+        ),
+        "total_feedbacks": totals["rating_count"],
+        "average_rating": (
+            totals["rating_sum"] / totals["rating_count"]
+            if totals["rating_count"]
+            else None
+        ),
+    }
+
+
+def get_instructor_dashboard(user):
+    """Return the dashboard of an instructor, from the cache when fresh"""
+    key = dashboard_key(user.pk)
+    dashboard = cache.get(key)
+    if dashboard is None:
+        dashboard = build_instructor_dashboard(user)
+        cache.set(key, dashboard, timeout=settings.INSTRUCTOR_DASHBOARD_CACHE_TIMEOUT)
+    return dashboard
+
+
+def invalidate_instructor_dashboards(user_ids):
+    """Drop the cached dashboards of the given instructors"""
+    keys = [dashboard_key(user_id) for user_id in set(user_ids) if user_id]
+    if not keys:
+        return
+    cache.delete_many(keys)
+    # drop again once committed, a request that read the old rows meanwhile
+    # may have cached them after the first drop
+    transaction.on_commit(lambda: cache.delete_many(keys))
@@ -3,10 +3,20 @@ from courses.models import Course
 
 
 class CourseFilter(django_filters.FilterSet):
-    title = django_filters.CharFilter(lookup_expr="icontains")
+    q = django_filters.CharFilter(method="filter_search")
+    # kept for older clients, searches the whole course document like `q`
+    title = django_filters.CharFilter(method="filter_search")
+    category = django_filters.CharFilter()
+    status = django_filters.CharFilter()
 
     class Meta:
         model = Course
         fields = [
+            "q",
             "title",
+            "category",
+            "status",
         ]
+
+    def filter_search(self, queryset, name, value):
+        return queryset.search(value)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from courses.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full text search index of courses"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of courses indexed per batch",
+        )
+
+    def handle(self, *args, **options):
+        total = rebuild_search_index(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {total} courses"))
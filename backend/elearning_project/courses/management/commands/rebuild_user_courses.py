@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from courses.models import UserCourse
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-user course index from owners, instructors and members"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of courses refreshed per batch",
+        )
+
+    def handle(self, *args, **options):
+        total = UserCourse.objects.rebuild(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {total} user courses"))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from courses.models import CourseStats
+
+
+class Command(BaseCommand):
+    help = "Rebuild course stats from memberships, feedbacks and materials"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--course",
+            action="append",
+            type=int,
+            dest="course_ids",
+            help="Only rebuild the stats of this course, may be repeated",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of courses aggregated per query",
+        )
+
+    def handle(self, *args, **options):
+        total = CourseStats.objects.rebuild(
+            course_ids=options["course_ids"], batch_size=options["batch_size"]
+        )
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stats of {total} courses"))
@@ -0,0 +1,101 @@
+# Generated by Django 5.1.1 on 2026-10-18 19:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def rating_star_filter(star):
+    lookup = Q()
+    if star > 1:
+        lookup &= Q(rating__gte=star - 0.5)
+    if star < 5:
+        lookup &= Q(rating__lt=star + 0.5)
+    return lookup
+
+
+def fill_course_stats(apps, schema_editor, batch_size=500):
+    Course = apps.get_model("courses", "Course")
+    CourseFeedback = apps.get_model("courses", "CourseFeedback")
+    CourseMaterial = apps.get_model("courses", "CourseMaterial")
+    CourseMembership = apps.get_model("courses", "CourseMembership")
+    CourseStats = apps.get_model("courses", "CourseStats")
+
+    course_ids = list(Course.objects.order_by("pk").values_list("pk", flat=True))
+    for start in range(0, len(course_ids), batch_size):
+        batch = course_ids[start : start + batch_size]
+        rows = {course_id: {} for course_id in batch}
+        memberships = (
+            CourseMembership.objects.filter(course__in=batch, user__isnull=False)
+            .order_by()
+            .values("course")
+            .annotate(
+                members_count=Count("pk"),
+                completed_count=Count("pk", filter=Q(is_course_completed=True)),
+                blocked_count=Count("pk", filter=Q(is_user_blocked=True)),
+            )
+        )
+        feedbacks = (
+            CourseFeedback.objects.filter(course__in=batch)
+            .order_by()
+            .values("course")
+            .annotate(
+                rating_sum=Sum("rating"),
+                rating_count=Count("pk"),
+                **{
+                    f"rating_{star}_count": Count("pk", filter=rating_star_filter(star))
+                    for star in range(1, 6)
+                },
+            )
+        )
+        materials = (
+            CourseMaterial.objects.filter(course__in=batch)
+            .order_by()
+            .values("course")
+            .annotate(materials_count=Count("pk"))
+        )
+        for queryset in (memberships, feedbacks, materials):
+            for row in queryset:
+                rows[row.pop("course")].update(row)
+        CourseStats.objects.bulk_create(
+            [
+                CourseStats(course_id=course_id, **counters)
+                for course_id, counters in rows.items()
+            ]
+        )
+
+
+class Migration(migrations.Migration):
+    """
+    The stats of existing courses are computed once, as
+    `manage.py reconcile_course_stats` does.
+    """
+
+    dependencies = [
+        ('courses', '0004_coursematerial_duration'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseStats',
+            fields=[
+                ('course', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='courses.course')),
+                ('members_count', models.IntegerField(default=0)),
+                ('completed_count', models.IntegerField(default=0)),
+                ('blocked_count', models.IntegerField(default=0)),
+                ('materials_count', models.IntegerField(default=0)),
+                ('rating_sum', models.FloatField(default=0)),
+                ('rating_count', models.IntegerField(default=0)),
+                ('rating_1_count', models.IntegerField(default=0)),
+                ('rating_2_count', models.IntegerField(default=0)),
+                ('rating_3_count', models.IntegerField(default=0)),
+                ('rating_4_count', models.IntegerField(default=0)),
+                ('rating_5_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'tb_course_stats',
+            },
+        ),
+        migrations.RunPython(fill_course_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,105 @@
+from django.db import migrations
+
+# the index as of this migration, later changes to `courses.search` must not
+# change what this migration does
+SEARCH_TABLE = "tb_course_search"
+SEARCH_COLUMNS = ("title", "category", "instructor", "materials", "description")
+
+CREATE_INDEX = {
+    "sqlite": [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+        f"USING fts5({', '.join(SEARCH_COLUMNS)}, tokenize='porter unicode61')",
+    ],
+    "postgresql": [
+        f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+        "course_id bigint PRIMARY KEY REFERENCES tb_course (id) "
+        "ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+        "document tsvector NOT NULL)",
+        f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_gin "
+        f"ON {SEARCH_TABLE} USING GIN (document)",
+    ],
+}
+
+INSERT_DOCUMENT = {
+    "sqlite": f"INSERT INTO {SEARCH_TABLE} (rowid, {', '.join(SEARCH_COLUMNS)}) "
+    f"VALUES (%s, {', '.join(['%s'] * len(SEARCH_COLUMNS))})",
+    "postgresql": f"INSERT INTO {SEARCH_TABLE} (course_id, document) VALUES (%s, "
+    + " || ".join(
+        f"setweight(to_tsvector('english', %s), '{label}')" for label in "ABBCD"
+    )
+    + ")",
+}
+
+
+def build_documents(apps, course_ids):
+    Course = apps.get_model("courses", "Course")
+    CourseMaterial = apps.get_model("courses", "CourseMaterial")
+    UserProfile = apps.get_model("accounts", "UserProfile")
+
+    courses = list(
+        Course.objects.filter(pk__in=course_ids).values(
+            "id", "title", "description", "category", "owner"
+        )
+    )
+    names = {
+        profile["user"]: " ".join(
+            filter(None, [profile["first_name"], profile["last_name"]])
+        )
+        for profile in UserProfile.objects.filter(
+            user__in={course["owner"] for course in courses}
+        ).values("user", "first_name", "last_name")
+    }
+    materials = {}
+    for course_id, title in CourseMaterial.objects.filter(
+        course__in=course_ids
+    ).values_list("course", "title"):
+        materials.setdefault(course_id, []).append(title)
+
+    return [
+        [
+            course["id"],
+            course["title"],
+            course["category"] or "",
+            names.get(course["owner"], ""),
+            "\n".join(materials.get(course["id"], [])),
+            course["description"] or "",
+        ]
+        for course in courses
+    ]
+
+
+def create_search_index(apps, schema_editor, batch_size=500):
+    vendor = schema_editor.connection.vendor
+    if vendor not in CREATE_INDEX:
+        return
+    Course = apps.get_model("courses", "Course")
+    course_ids = list(Course.objects.order_by("pk").values_list("pk", flat=True))
+    with schema_editor.connection.cursor() as cursor:
+        for statement in CREATE_INDEX[vendor]:
+            cursor.execute(statement)
+        for start in range(0, len(course_ids), batch_size):
+            cursor.executemany(
+                INSERT_DOCUMENT[vendor],
+                build_documents(apps, course_ids[start : start + batch_size]),
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE_INDEX:
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+class Migration(migrations.Migration):
+    """
+    The search index is created and filled with the existing courses.
+    """
+
+    dependencies = [
+        ("accounts", "0001_initial"),
+        ("courses", "0005_coursestats"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
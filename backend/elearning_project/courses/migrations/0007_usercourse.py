@@ -0,0 +1,134 @@
+# Generated by Django 5.1.1 on 2026-10-18 20:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_user_courses(apps, schema_editor, batch_size=500):
+    Course = apps.get_model("courses", "Course")
+    CourseInstructor = apps.get_model("courses", "CourseInstructor")
+    CourseMembership = apps.get_model("courses", "CourseMembership")
+    UserCourse = apps.get_model("courses", "UserCourse")
+
+    course_ids = list(Course.objects.order_by("pk").values_list("pk", flat=True))
+    for start in range(0, len(course_ids), batch_size):
+        batch = course_ids[start : start + batch_size]
+        rows = {}
+        relations = (
+            (
+                "owner",
+                Course.objects.filter(pk__in=batch).values_list(
+                    "owner", "pk", "created_at"
+                ),
+            ),
+            (
+                "instructor",
+                CourseInstructor.objects.filter(course__in=batch).values_list(
+                    "user", "course", "created_at"
+                ),
+            ),
+        )
+        # the strongest relation gives the role, the earliest the date
+        for role, queryset in relations:
+            for user_id, course_id, joined_at in queryset:
+                row = rows.setdefault(
+                    (user_id, course_id), {"role": role, "enrolled_at": joined_at}
+                )
+                row["enrolled_at"] = min(row["enrolled_at"], joined_at)
+        memberships = CourseMembership.objects.filter(
+            course__in=batch, user__isnull=False
+        ).values_list(
+            "user", "course", "created_at", "is_course_completed", "is_user_blocked"
+        )
+        for user_id, course_id, joined_at, completed, blocked in memberships:
+            row = rows.setdefault(
+                (user_id, course_id), {"role": "member", "enrolled_at": joined_at}
+            )
+            row.update(
+                enrolled_at=min(row["enrolled_at"], joined_at),
+                is_member=True,
+                is_course_completed=completed,
+                is_user_blocked=blocked,
+            )
+        UserCourse.objects.bulk_create(
+            [
+                UserCourse(user_id=user_id, course_id=course_id, **row)
+                for (user_id, course_id), row in rows.items()
+            ]
+        )
+
+
+class Migration(migrations.Migration):
+    """
+    The courses of existing users are indexed from the owner, instructor and
+    membership tables, as `manage.py rebuild_user_courses` does.
+    """
+
+    dependencies = [
+        ("courses", "0006_course_search_index"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserCourse",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "role",
+                    models.CharField(
+                        choices=[
+                            ("owner", "Owner"),
+                            ("instructor", "Instructor"),
+                            ("member", "Member"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("is_member", models.BooleanField(default=False)),
+                ("is_course_completed", models.BooleanField(default=False)),
+                ("is_user_blocked", models.BooleanField(default=False)),
+                ("enrolled_at", models.DateTimeField()),
+                (
+                    "course",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="user_courses",
+                        to="courses.course",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="user_courses",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "tb_user_courses",
+                "ordering": ["-enrolled_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["user", "-enrolled_at"], name="user_course_recent"
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("user", "course"), name="user_course_unique"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(fill_user_courses, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.1 on 2026-10-18 20:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("courses", "0007_usercourse"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="coursemembership",
+            index=models.Index(
+                fields=["user", "is_course_completed"], name="course_membership_user"
+            ),
+        ),
+    ]
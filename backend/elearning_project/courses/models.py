@@ -1,7 +1,12 @@
 from django.db import models
-from .querysets import CourseMembershipQueryset
+from .querysets import (
+    CourseQueryset,
+    CourseMembershipQueryset,
+    CourseStatsQueryset,
+    UserCourseQueryset,
+)
 
-from core.models import BaseModel
+from core.models import AtomicSaveMixin, BaseModel
 
 
 class Course(BaseModel):
@@ -13,6 +18,8 @@ class Course(BaseModel):
         db_table = "tb_course"
         ordering = ["-created_at"]
 
+    objects = CourseQueryset.as_manager()
+
     owner = models.ForeignKey(
         "accounts.User", related_name="my_courses", on_delete=models.CASCADE
     )
@@ -48,7 +55,7 @@ class Course(BaseModel):
         return self.title
 
 
-class CourseMaterial(BaseModel):
+class CourseMaterial(AtomicSaveMixin, BaseModel):
     """
     CourseMaterial model is used to store the materials for courses.
     """
@@ -108,7 +115,7 @@ class CourseInstructor(BaseModel):
         return f"{self.user.email} at {self.course.title}"
 
 
-class CourseMembership(BaseModel):
+class CourseMembership(AtomicSaveMixin, BaseModel):
     """
     CourseMembership model is used to store the membership to courses for users.
     """
@@ -132,6 +139,11 @@ class CourseMembership(BaseModel):
         db_table = "tb_course_memberships"
         ordering = ["-created_at"]
         unique_together = ("course", "user")
+        indexes = [
+            models.Index(
+                fields=["user", "is_course_completed"], name="course_membership_user"
+            ),
+        ]
 
     def __str__(self) -> str:
         if self.user:
@@ -140,7 +152,7 @@ class CourseMembership(BaseModel):
             return f"no-USER at {self.course.title}"
 
 
-class CourseFeedback(BaseModel):
+class CourseFeedback(AtomicSaveMixin, BaseModel):
     """
     CourseFeedback model is used to store the feedback for courses.
     """
@@ -163,3 +175,107 @@ class CourseFeedback(BaseModel):
 
     def __str__(self) -> str:
         return f"{self.user.email} at {self.course.title}"
+
+
+class CourseStats(models.Model):
+    """
+    CourseStats model keeps the aggregates of a course up to date as its
+    memberships, feedbacks and materials change, see `courses.signals`.
+    """
+
+    course = models.OneToOneField(
+        Course, related_name="stats", on_delete=models.CASCADE, primary_key=True
+    )
+    members_count = models.IntegerField(default=0)
+    completed_count = models.IntegerField(default=0)
+    blocked_count = models.IntegerField(default=0)
+    materials_count = models.IntegerField(default=0)
+    rating_sum = models.FloatField(default=0)
+    rating_count = models.IntegerField(default=0)
+    # histogram of ratings rounded to the nearest star
+    rating_1_count = models.IntegerField(default=0)
+    rating_2_count = models.IntegerField(default=0)
+    rating_3_count = models.IntegerField(default=0)
+    rating_4_count = models.IntegerField(default=0)
+    rating_5_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = CourseStatsQueryset.as_manager()
+
+    COUNTERS = (
+        "members_count",
+        "completed_count",
+        "blocked_count",
+        "materials_count",
+        "rating_sum",
+        "rating_count",
+        "rating_1_count",
+        "rating_2_count",
+        "rating_3_count",
+        "rating_4_count",
+        "rating_5_count",
+    )
+
+    class Meta:
+        db_table = "tb_course_stats"
+
+    def __str__(self) -> str:
+        return f"stats of {self.course_id}"
+
+    @property
+    def average_rating(self):
+        if not self.rating_count:
+            return None
+        return self.rating_sum / self.rating_count
+
+    @property
+    def rating_histogram(self):
+        return {
+            str(star): getattr(self, f"rating_{star}_count") for star in range(1, 6)
+        }
+
+
+class UserCourse(models.Model):
+    """
+    UserCourse model is a materialized index of the courses of each user,
+    one row per user and course they own, instruct or are enrolled in. It is
+    maintained from `Course`, `CourseInstructor` and `CourseMembership`
+    writes, see `courses.signals`.
+    """
+
+    ROLE_CHOICES = (
+        ("owner", "Owner"),
+        ("instructor", "Instructor"),
+        ("member", "Member"),
+    )
+
+    user = models.ForeignKey(
+        "accounts.User", related_name="user_courses", on_delete=models.CASCADE
+    )
+    course = models.ForeignKey(
+        Course, related_name="user_courses", on_delete=models.CASCADE
+    )
+    # strongest relation of the user to the course
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES)
+    is_member = models.BooleanField(default=False)
+    is_course_completed = models.BooleanField(default=False)
+    is_user_blocked = models.BooleanField(default=False)
+    # earliest of course creation, instructor assignment and enrollment
+    enrolled_at = models.DateTimeField()
+
+    objects = UserCourseQueryset.as_manager()
+
+    class Meta:
+        db_table = "tb_user_courses"
+        ordering = ["-enrolled_at"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "course"], name="user_course_unique"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["user", "-enrolled_at"], name="user_course_recent"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.user_id} {self.role} of {self.course_id}"
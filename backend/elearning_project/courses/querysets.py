@@ -1,6 +1,114 @@
+from django.apps import apps
 from django.db import models
+from django.db.models import Count, Exists, F, OuterRef, Prefetch, Q, Sum, Value
 from django.contrib.auth import get_user_model
 
+from core.enums import COURSE_ROLES
+
+
+def rating_star(rating):
+    """Return the histogram bucket (1 to 5 stars) a rating is counted in"""
+    return min(5, max(1, int(float(rating) + 0.5)))
+
+
+def rating_star_filter(star):
+    """Return the lookup matching the ratings counted in a histogram bucket"""
+    lookup = Q()
+    if star > 1:
+        lookup &= Q(rating__gte=star - 0.5)
+    if star < 5:
+        lookup &= Q(rating__lt=star + 0.5)
+    return lookup
+
+
+class CourseQueryset(models.QuerySet):
+    def with_list_data(self, user=None, fields=None):
+        """Annotate everything `CourseSerializer` renders, so that serializing
+        a page of courses costs a fixed number of queries.
+
+        Args:
+            user: requesting user, used for `is_enrolled` and chat group state
+            fields: names of the rendered fields, the joins, annotations and
+                prefetches only read by other fields are skipped. All when None
+
+        Returns:
+            Queryset: Queryset of annotated course objects
+        """
+        CourseMembership = apps.get_model("courses", "CourseMembership")
+        ChatGroup = apps.get_model("chat", "ChatGroup")
+
+        def renders(*names):
+            return fields is None or any(name in fields for name in names)
+
+        queryset = self
+        if renders("instructor"):
+            queryset = queryset.select_related("owner__profile")
+        if renders("members_count", "average_rating", "total_feedbacks"):
+            queryset = queryset.select_related("stats")
+        if renders("is_enrolled"):
+            if user is not None and user.is_authenticated:
+                is_enrolled = Exists(
+                    CourseMembership.objects.filter(course=OuterRef("pk"), user=user)
+                )
+            else:
+                is_enrolled = Value(False)
+            queryset = queryset.annotate(is_enrolled=is_enrolled)
+        if renders("chat_group"):
+            queryset = queryset.prefetch_related(
+                Prefetch(
+                    "chat_groups",
+                    queryset=ChatGroup.objects.course_group().with_viewer_state(
+                        user, counterparts=False
+                    ),
+                    to_attr="primary_chat_groups",
+                )
+            )
+        return queryset
+
+    def of_user(self, user, *conditions, **lookups):
+        """Return the courses related to `user` through the `UserCourse`
+        index, most recently joined first
+
+        Args:
+            user: user whose courses are listed
+            conditions: `Q` objects on the same `UserCourse` rows, with the
+                `user_courses__` prefix, eg. to combine lookups with `|`
+            lookups: filters on the `UserCourse` rows, eg. `role="owner"`
+
+        Returns:
+            Queryset: Queryset of course objects
+        """
+        return self.filter(
+            *conditions,
+            user_courses__user=user,
+            **{f"user_courses__{name}": value for name, value in lookups.items()},
+        ).order_by("-user_courses__enrolled_at", "-pk")
+
+    def search(self, text):
+        """Return the courses whose indexed document matches `text`, most
+        relevant first, see `courses.search`
+
+        Returns:
+            Queryset: Queryset of course objects annotated with `search_rank`
+        """
+        from courses.search import search_courses
+
+        return search_courses(self, text)
+
+    def facets(self):
+        """Count the courses of the queryset per category and status
+
+        Returns:
+            dict: counts keyed by facet then value
+        """
+        return {
+            facet: {
+                row[facet]: row["count"]
+                for row in self.order_by().values(facet).annotate(count=Count("pk"))
+            }
+            for facet in ("category", "status")
+        }
+
 
 class CourseMembershipQueryset(models.QuerySet):
     def course_users(self):
@@ -18,3 +126,208 @@ class CourseMembershipQueryset(models.QuerySet):
         return self.filter(
             user=user,
         )
+
+
+class CourseStatsQueryset(models.QuerySet):
+    def for_course(self, course):
+        """Return the stats row of a course, rebuilding it when missing
+
+        Returns:
+            CourseStats: stats of the course
+        """
+        try:
+            return course.stats
+        except self.model.DoesNotExist:
+            self.rebuild(course_ids=[course.pk])
+            course.stats = self.get(pk=course.pk)
+            return course.stats
+
+    def apply(self, course_id, **deltas):
+        """Add `deltas` to the counters of a course in a single UPDATE
+
+        Returns:
+            int: number of stats rows updated
+        """
+        changes = {name: F(name) + delta for name, delta in deltas.items() if delta}
+        if course_id is None or not changes:
+            return 0
+        return self.filter(course_id=course_id).update(**changes)
+
+    def rebuild(self, course_ids=None, batch_size=500):
+        """Recompute the stats of the given courses (all when None) from the
+        membership, feedback and material tables, in batches
+
+        Returns:
+            int: number of stats rows written
+        """
+        Course = apps.get_model("courses", "Course")
+
+        courses = Course.objects.order_by("pk").values_list("pk", flat=True)
+        if course_ids is not None:
+            courses = courses.filter(pk__in=course_ids)
+
+        total = 0
+        batch = []
+        for course_id in courses.iterator(chunk_size=batch_size):
+            batch.append(course_id)
+            if len(batch) == batch_size:
+                total += self._rebuild_batch(batch)
+                batch = []
+        if batch:
+            total += self._rebuild_batch(batch)
+        return total
+
+    def _rebuild_batch(self, course_ids):
+        CourseMembership = apps.get_model("courses", "CourseMembership")
+        CourseFeedback = apps.get_model("courses", "CourseFeedback")
+        CourseMaterial = apps.get_model("courses", "CourseMaterial")
+
+        rows = {course_id: {} for course_id in course_ids}
+        memberships = (
+            CourseMembership.objects.filter(course__in=course_ids, user__isnull=False)
+            .order_by()
+            .values("course")
+            .annotate(
+                members_count=Count("pk"),
+                completed_count=Count("pk", filter=Q(is_course_completed=True)),
+                blocked_count=Count("pk", filter=Q(is_user_blocked=True)),
+            )
+        )
+        feedbacks = (
+            CourseFeedback.objects.filter(course__in=course_ids)
+            .order_by()
+            .values("course")
+            .annotate(
+                rating_sum=Sum("rating"),
+                rating_count=Count("pk"),
+                **{
+                    f"rating_{star}_count": Count("pk", filter=rating_star_filter(star))
+                    for star in range(1, 6)
+                },
+            )
+        )
+        materials = (
+            CourseMaterial.objects.filter(course__in=course_ids)
+            .order_by()
+            .values("course")
+            .annotate(materials_count=Count("pk"))
+        )
+        for queryset in (memberships, feedbacks, materials):
+            for row in queryset:
+                rows[row.pop("course")].update(row)
+
+        return len(
+            self.bulk_create(
+                [
+                    self.model(course_id=course_id, **counters)
+                    for course_id, counters in rows.items()
+                ],
+                update_conflicts=True,
+                unique_fields=["course"],
+                update_fields=[*self.model.COUNTERS, "updated_at"],
+            )
+        )
+
+
+class UserCourseQueryset(models.QuerySet):
+    def refresh(self, course_ids, user_ids=None):
+        """Recompute the rows of the given courses, restricted to `user_ids`
+        when given, from the course owner, instructor and membership tables
+
+        Returns:
+            int: number of rows written
+        """
+        Course = apps.get_model("courses", "Course")
+        CourseInstructor = apps.get_model("courses", "CourseInstructor")
+        CourseMembership = apps.get_model("courses", "CourseMembership")
+
+        owners = Course.objects.filter(pk__in=course_ids)
+        instructors = CourseInstructor.objects.filter(course__in=course_ids)
+        memberships = CourseMembership.objects.filter(
+            course__in=course_ids, user__isnull=False
+        )
+        existing = self.filter(course__in=course_ids)
+        if user_ids is not None:
+            owners = owners.filter(owner__in=user_ids)
+            instructors = instructors.filter(user__in=user_ids)
+            memberships = memberships.filter(user__in=user_ids)
+            existing = existing.filter(user__in=user_ids)
+
+        rows = {}
+        relations = (
+            (COURSE_ROLES.OWNER, owners.values_list("owner", "pk", "created_at")),
+            (
+                COURSE_ROLES.INSTRUCTOR,
+                instructors.values_list("user", "course", "created_at"),
+            ),
+        )
+        for role, queryset in relations:
+            for user_id, course_id, joined_at in queryset:
+                row = rows.setdefault(
+                    (user_id, course_id), {"role": role, "enrolled_at": joined_at}
+                )
+                row["enrolled_at"] = min(row["enrolled_at"], joined_at)
+        for (
+            user_id,
+            course_id,
+            joined_at,
+            completed,
+            blocked,
+        ) in memberships.values_list(
+            "user", "course", "created_at", "is_course_completed", "is_user_blocked"
+        ):
+            row = rows.setdefault(
+                (user_id, course_id),
+                {"role": COURSE_ROLES.MEMBER, "enrolled_at": joined_at},
+            )
+            row.update(
+                enrolled_at=min(row["enrolled_at"], joined_at),
+                is_member=True,
+                is_course_completed=completed,
+                is_user_blocked=blocked,
+            )
+
+        stale = [
+            pk
+            for pk, user_id, course_id in existing.values_list("pk", "user", "course")
+            if (user_id, course_id) not in rows
+        ]
+        if stale:
+            self.filter(pk__in=stale).delete()
+        return len(
+            self.bulk_create(
+                [
+                    self.model(user_id=user_id, course_id=course_id, **row)
+                    for (user_id, course_id), row in rows.items()
+                ],
+                update_conflicts=True,
+                unique_fields=["user", "course"],
+                update_fields=[
+                    "role",
+                    "is_member",
+                    "is_course_completed",
+                    "is_user_blocked",
+                    "enrolled_at",
+                ],
+            )
+        )
+
+    def rebuild(self, batch_size=500):
+        """Recompute the rows of every course, in batches
+
+        Returns:
+            int: number of rows written
+        """
+        Course = apps.get_model("courses", "Course")
+
+        courses = Course.objects.order_by("pk").values_list("pk", flat=True)
+        total = 0
+        batch = []
+        for course_id in courses.iterator(chunk_size=batch_size):
+            batch.append(course_id)
+            if len(batch) == batch_size:
+                total += self.refresh(batch)
+                batch = []
+        if batch:
+            total += self.refresh(batch)
+        return total
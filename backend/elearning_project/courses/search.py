@@ -0,0 +1,291 @@
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Func, Q, Value
+from django.db.models.expressions import RawSQL
+
+from courses.models import Course, CourseMaterial
+
+__all__ = [
+    "get_search_backend",
+    "index_courses",
+    "rebuild_search_index",
+    "search_courses",
+    "unindex_courses",
+]
+
+
+SEARCH_TABLE = "tb_course_search"
+
+# Order of the indexed columns, and the relevance of a match in each of them
+SEARCH_COLUMNS = (
+    ("title", 10.0),
+    ("category", 4.0),
+    ("instructor", 4.0),
+    ("materials", 2.0),
+    ("description", 1.0),
+)
+
+
+def get_search_terms(text):
+    return re.findall(r"\w+", (text or "").lower())
+
+
+class CourseSearchRank(Func):
+    """
+    Relevance of the indexed document of a course for a search query,
+    rendered by the search backend of the database
+    """
+
+    output_field = FloatField()
+
+    def __init__(self, expression, backend, query):
+        self.backend = backend
+        super().__init__(expression, Value(query))
+
+    def as_sql(self, compiler, connection, **extra_context):
+        pk_sql, pk_params = compiler.compile(self.source_expressions[0])
+        query = self.source_expressions[1].value
+        return self.backend.rank_sql(pk_sql, pk_params, query)
+
+
+class SqliteSearchBackend:
+    """
+    FTS5 virtual table keyed by course id, used for local development and tests
+    """
+
+    def create_index(self, cursor):
+        columns = ", ".join(name for name, _ in SEARCH_COLUMNS)
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+            f"USING fts5({columns}, tokenize='porter unicode61')"
+        )
+
+    def drop_index(self, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+    def clear(self, cursor):
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+
+    def to_query(self, text):
+        return " ".join(f'"{term}"*' for term in get_search_terms(text))
+
+    def match_sql(self, query):
+        return (
+            f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s",
+            [query],
+        )
+
+    def rank_sql(self, pk_sql, pk_params, query):
+        weights = ", ".join(str(weight) for _, weight in SEARCH_COLUMNS)
+        return (
+            f"(SELECT -bm25({SEARCH_TABLE}, {weights}) FROM {SEARCH_TABLE} "
+            f"WHERE {SEARCH_TABLE} MATCH %s AND rowid = {pk_sql})",
+            [query, *pk_params],
+        )
+
+    def upsert(self, cursor, documents):
+        self.delete(cursor, [document["id"] for document in documents])
+        names = [name for name, _ in SEARCH_COLUMNS]
+        placeholders = ", ".join(["%s"] * (len(names) + 1))
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, {', '.join(names)}) "
+            f"VALUES ({placeholders})",
+            [
+                [document["id"], *(document[name] for name in names)]
+                for document in documents
+            ],
+        )
+
+    def delete(self, cursor, course_ids):
+        if course_ids:
+            placeholders = ", ".join(["%s"] * len(course_ids))
+            cursor.execute(
+                f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})",
+                list(course_ids),
+            )
+
+
+class PostgresSearchBackend:
+    """
+    Weighted `tsvector` per course behind a GIN index
+    """
+
+    config = "english"
+    labels = "ABBCD"
+
+    def create_index(self, cursor):
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+            "course_id bigint PRIMARY KEY REFERENCES tb_course (id) "
+            "ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+            "document tsvector NOT NULL)"
+        )
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_gin "
+            f"ON {SEARCH_TABLE} USING GIN (document)"
+        )
+
+    def drop_index(self, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+    def clear(self, cursor):
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+
+    def to_query(self, text):
+        return " & ".join(f"{term}:*" for term in get_search_terms(text))
+
+    def match_sql(self, query):
+        return (
+            f"SELECT course_id FROM {SEARCH_TABLE} "
+            f"WHERE document @@ to_tsquery('{self.config}', %s)",
+            [query],
+        )
+
+    def rank_sql(self, pk_sql, pk_params, query):
+        return (
+            f"(SELECT ts_rank_cd(document, to_tsquery('{self.config}', %s)) "
+            f"FROM {SEARCH_TABLE} WHERE course_id = {pk_sql})",
+            [query, *pk_params],
+        )
+
+    def upsert(self, cursor, documents):
+        vector = " || ".join(
+            f"setweight(to_tsvector('{self.config}', %s), '{label}')"
+            for label in self.labels
+        )
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE} (course_id, document) "
+            f"VALUES (%s, {vector}) "
+            "ON CONFLICT (course_id) DO UPDATE SET document = EXCLUDED.document",
+            [
+                [document["id"], *(document[name] for name, _ in SEARCH_COLUMNS)]
+                for document in documents
+            ],
+        )
+
+    def delete(self, cursor, course_ids):
+        if course_ids:
+            cursor.execute(
+                f"DELETE FROM {SEARCH_TABLE} WHERE course_id = ANY(%s)",
+                [list(course_ids)],
+            )
+
+
+SEARCH_BACKENDS = {
+    "sqlite": SqliteSearchBackend,
+    "postgresql": PostgresSearchBackend,
+}
+
+
+def get_search_backend(vendor=None):
+    """Return the search backend of a database vendor, None when unsupported"""
+    backend = SEARCH_BACKENDS.get(vendor or connection.vendor)
+    return backend() if backend else None
+
+
+def search_courses(queryset, text):
+    """Filter `queryset` to the courses matching `text`, most relevant first"""
+    backend = get_search_backend()
+    if backend is None:
+        # no index on this database, fall back to unranked substring search
+        lookup = Q()
+        for term in get_search_terms(text):
+            lookup &= (
+                Q(title__icontains=term)
+                | Q(description__icontains=term)
+                | Q(category__icontains=term)
+            )
+        return queryset.filter(lookup).annotate(search_rank=Value(0.0))
+
+    query = backend.to_query(text)
+    if not query:
+        return queryset.none()
+    match_sql, match_params = backend.match_sql(query)
+    return (
+        queryset.filter(pk__in=RawSQL(match_sql, match_params))
+        .annotate(search_rank=CourseSearchRank("pk", backend, query))
+        .order_by("-search_rank", "-created_at")
+    )
+
+
+def build_documents(course_ids):
+    courses = Course.objects.filter(pk__in=course_ids).values(
+        "id",
+        "title",
+        "description",
+        "category",
+        "owner__profile__first_name",
+        "owner__profile__last_name",
+    )
+    materials = {}
+    for course_id, title in CourseMaterial.objects.filter(
+        course__in=course_ids
+    ).values_list("course", "title"):
+        materials.setdefault(course_id, []).append(title)
+
+    return [
+        {
+            "id": course["id"],
+            "title": course["title"],
+            "category": course["category"] or "",
+            "instructor": " ".join(
+                filter(
+                    None,
+                    [
+                        course["owner__profile__first_name"],
+                        course["owner__profile__last_name"],
+                    ],
+                )
+            ),
+            "materials": "\n".join(materials.get(course["id"], [])),
+            "description": course["description"] or "",
+        }
+        for course in courses
+    ]
+
+
+def index_courses(course_ids):
+    """(Re)index the documents of the given courses, dropping deleted ones"""
+    backend = get_search_backend()
+    if backend is None:
+        return
+    course_ids = set(course_ids)
+    documents = build_documents(course_ids)
+    with connection.cursor() as cursor:
+        backend.upsert(cursor, documents)
+        backend.delete(cursor, course_ids - {document["id"] for document in documents})
+
+
+def unindex_courses(course_ids):
+    backend = get_search_backend()
+    if backend is None:
+        return
+    with connection.cursor() as cursor:
+        backend.delete(cursor, list(course_ids))
+
+
+def rebuild_search_index(batch_size=500):
+    """Index every course from scratch, in batches
+
+    Returns:
+        int: number of courses indexed
+    """
+    backend = get_search_backend()
+    if backend is None:
+        return 0
+    with connection.cursor() as cursor:
+        backend.clear(cursor)
+    course_ids = Course.objects.order_by("pk").values_list("pk", flat=True)
+    total = 0
+    batch = []
+    for course_id in course_ids.iterator(chunk_size=batch_size):
+        batch.append(course_id)
+        if len(batch) == batch_size:
+            index_courses(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        index_courses(batch)
+        total += len(batch)
+    return total
@@ -1,16 +1,32 @@
+from django.conf import settings
+from django.urls import reverse
 from rest_framework import serializers
-
-from django.db.models import Avg
-from courses.models import Course, CourseMembership, CourseMaterial, CourseFeedback
+from rest_framework.utils.urls import replace_query_param
+
+from courses.models import (
+    Course,
+    CourseMembership,
+    CourseMaterial,
+    CourseFeedback,
+    CourseStats,
+)
 from accounts.serializers import UserProfileSerializer
 from chat.serializers import ChatGroupSerializer
+from core.pagination import CursorResultsSetPagination
+from core.serializers import SparseFieldsetsMixin
 
 
 class CourseMemberProfileSerializer(UserProfileSerializer):
     pass
 
 
-class CourseSerializer(serializers.ModelSerializer):
+class CourseSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
+    """
+    Aggregates are read from the course's `CourseStats` row, the remaining
+    per-course state from the annotations added by
+    `CourseQueryset.with_list_data` when they are present.
+    """
+
     chat_group = serializers.SerializerMethodField()
     instructor = UserProfileSerializer(source="owner.profile", read_only=True)
     is_enrolled = serializers.SerializerMethodField()
@@ -19,18 +35,23 @@ class CourseSerializer(serializers.ModelSerializer):
     total_feedbacks = serializers.SerializerMethodField()
 
     def get_chat_group(self, obj):
-        chat_group = obj.chat_groups.first()
+        if hasattr(obj, "primary_chat_groups"):
+            chat_group = next(iter(obj.primary_chat_groups), None)
+        else:
+            chat_group = obj.chat_groups.course_group().first()
         if chat_group is not None:
             return ChatGroupSerializer(chat_group, context=self.context).data
         return None
 
     def get_average_rating(self, obj):
-        return obj.feedbacks.aggregate(Avg("rating"))["rating__avg"]
+        return CourseStats.objects.for_course(obj).average_rating
 
     def get_total_feedbacks(self, obj):
-        return obj.feedbacks.count()
+        return CourseStats.objects.for_course(obj).rating_count
 
     def get_is_enrolled(self, obj):
+        if hasattr(obj, "is_enrolled"):
+            return obj.is_enrolled
         user = self.context.get("user")
         if user is not None and user.is_authenticated:
             membership = obj.course_memberships.filter(user=user).first()
@@ -38,7 +59,7 @@ class CourseSerializer(serializers.ModelSerializer):
         return False
 
     def get_members_count(self, obj):
-        return obj.members.count()
+        return CourseStats.objects.for_course(obj).members_count
 
     class Meta:
         model = Course
@@ -62,45 +83,63 @@ class CourseSerializer(serializers.ModelSerializer):
         )
 
 
-class CourseDetailSerializer(serializers.ModelSerializer):
-    chat_group = serializers.SerializerMethodField()
-    instructor = UserProfileSerializer(source="owner.profile", read_only=True)
-    is_enrolled = serializers.SerializerMethodField()
-    members_count = serializers.SerializerMethodField()
-    average_rating = serializers.SerializerMethodField()
-    total_feedbacks = serializers.SerializerMethodField()
+class CourseDetailSerializer(CourseSerializer):
+    # fields that depend on the requesting user or change with every
+    # enrollment, computed per request instead of being cached
+    REQUEST_FIELDS = (
+        "chat_group",
+        "is_enrolled",
+        "members_count",
+        "average_rating",
+        "total_feedbacks",
+    )
+
     materials = serializers.SerializerMethodField()
+    materials_next = serializers.SerializerMethodField()
     feedbacks = serializers.SerializerMethodField()
-
-    def get_chat_group(self, obj):
-        chat_group = obj.chat_groups.first()
-        if chat_group is not None:
-            return ChatGroupSerializer(chat_group, context=self.context).data
-        return None
-
-    def get_average_rating(self, obj):
-        return obj.feedbacks.aggregate(Avg("rating"))["rating__avg"]
-
-    def get_total_feedbacks(self, obj):
-        return obj.feedbacks.count()
-
-    def get_is_enrolled(self, obj):
-        user = self.context.get("user")
-        if user is not None and user.is_authenticated:
-            membership = obj.course_memberships.filter(user=user).first()
-            return membership is not None
-        return False
-
-    def get_members_count(self, obj):
-        return obj.members.count()
+    feedbacks_next = serializers.SerializerMethodField()
+
+    def _get_embedded(self, obj, name):
+        """Return the newest `COURSE_DETAIL_EMBED_LIMIT` + 1 rows of a nested
+        list, the extra row only tells whether there is a next page"""
+        attr = f"embedded_{name}"
+        if not hasattr(obj, attr):
+            queryset = getattr(obj, name).order_by("-created_at", "-pk")
+            if name == "feedbacks":
+                queryset = queryset.select_related("user__profile")
+            setattr(obj, attr, list(queryset[: settings.COURSE_DETAIL_EMBED_LIMIT + 1]))
+        return getattr(obj, attr)
+
+    def _get_next_link(self, obj, name, basename):
+        """Return the nested endpoint page following the embedded rows, as a
+        path since the payload is cached and shared across hosts"""
+        rows = self._get_embedded(obj, name)
+        if len(rows) <= settings.COURSE_DETAIL_EMBED_LIMIT:
+            return None
+        last = rows[settings.COURSE_DETAIL_EMBED_LIMIT - 1]
+        cursor = CursorResultsSetPagination.make_cursor(last.created_at, last.pk)
+        url = reverse(f"{basename}-list", kwargs={"course_pk": obj.pk})
+        return replace_query_param(
+            url, CursorResultsSetPagination.cursor_query_param, cursor
+        )
 
     def get_materials(self, obj):
-        materials = obj.materials.all()
-        return CourseMaterialSerializer(materials, many=True).data
+        materials = self._get_embedded(obj, "materials")
+        return CourseMaterialSerializer(
+            materials[: settings.COURSE_DETAIL_EMBED_LIMIT], many=True
+        ).data
+
+    def get_materials_next(self, obj):
+        return self._get_next_link(obj, "materials", "course-materials")
 
     def get_feedbacks(self, obj):
-        feedbacks = obj.feedbacks.all()
-        return CourseFeedbackSerializer(feedbacks, many=True).data
+        feedbacks = self._get_embedded(obj, "feedbacks")
+        return CourseFeedbackSerializer(
+            feedbacks[: settings.COURSE_DETAIL_EMBED_LIMIT], many=True
+        ).data
+
+    def get_feedbacks_next(self, obj):
+        return self._get_next_link(obj, "feedbacks", "course-feedbacks")
 
     class Meta:
         model = Course
@@ -114,7 +153,9 @@ class CourseDetailSerializer(serializers.ModelSerializer):
             "average_rating",
             "total_feedbacks",
             "materials",
+            "materials_next",
             "feedbacks",
+            "feedbacks_next",
             "instructor",
             "duration",
             "category",
@@ -141,7 +182,7 @@ class CourseCreateSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class CourseMembershipSerializer(serializers.ModelSerializer):
+class CourseMembershipSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     user = UserProfileSerializer(source="user.profile", read_only=True)
 
     class Meta:
@@ -149,7 +190,9 @@ class CourseMembershipSerializer(serializers.ModelSerializer):
         fields = ("course", "user", "is_user_blocked", "is_course_completed")
 
 
-class CourseMembershipDetailSerializer(serializers.ModelSerializer):
+class CourseMembershipDetailSerializer(
+    SparseFieldsetsMixin, serializers.ModelSerializer
+):
     course = CourseSerializer(read_only=True)
 
     class Meta:
@@ -157,7 +200,7 @@ class CourseMembershipDetailSerializer(serializers.ModelSerializer):
         fields = ("course", "user", "is_user_blocked", "is_course_completed")
 
 
-class CourseMaterialSerializer(serializers.ModelSerializer):
+class CourseMaterialSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     class Meta:
         model = CourseMaterial
         fields = (
@@ -173,7 +216,7 @@ class CourseMaterialSerializer(serializers.ModelSerializer):
         )
 
 
-class CourseMaterialDetailSerializer(serializers.ModelSerializer):
+class CourseMaterialDetailSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     course = CourseSerializer(read_only=True)
 
     class Meta:
@@ -216,7 +259,7 @@ class CourseMaterialCreateSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class CourseFeedbackSerializer(serializers.ModelSerializer):
+class CourseFeedbackSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     user = UserProfileSerializer(source="user.profile", read_only=True)
 
     class Meta:
@@ -224,7 +267,7 @@ class CourseFeedbackSerializer(serializers.ModelSerializer):
         fields = ("course", "user", "rating", "feedback", "created_at")
 
 
-class CourseFeedbackDetailSerializer(serializers.ModelSerializer):
+class CourseFeedbackDetailSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     course = CourseSerializer(read_only=True)
     user = UserProfileSerializer(source="user.profile", read_only=True)
 
@@ -1,17 +1,47 @@
 from django.conf import settings
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
 
-from courses.models import Course, CourseInstructor, CourseMembership
+from courses.models import (
+    Course,
+    CourseFeedback,
+    CourseInstructor,
+    CourseMaterial,
+    CourseMembership,
+    CourseStats,
+    UserCourse,
+)
+from courses.cache import bump_course_versions
+from courses.dashboard import invalidate_instructor_dashboards
+from courses.querysets import rating_star
+from core.enums import COURSE_ROLES
+from core.utils import is_cascade_from
+from courses.search import index_courses, unindex_courses
+from accounts.models import User, UserProfile
 from chat.models import ChatGroup, ChatMembership
 
-
 DEBUG = getattr(settings, "DEBUG", True)
 
 
 __all__ = [
     "create_chat_group_and_instructor",
     "add_user_chat_group_on_enroll",
+    "create_course_stats",
+    "snapshot_course_stats",
+    "update_course_stats_on_save",
+    "update_course_stats_on_delete",
+    "invalidate_course_detail",
+    "invalidate_course_detail_on_profile_change",
+    "invalidate_course_detail_on_user_change",
+    "index_course",
+    "unindex_course",
+    "index_course_on_material_change",
+    "index_courses_on_profile_change",
+    "refresh_user_courses_on_course_save",
+    "refresh_user_courses",
+    "snapshot_course_owner",
+    "invalidate_instructor_dashboard",
 ]
 
 
@@ -34,6 +64,221 @@ def create_chat_group_and_instructor(sender, instance, created, *args, **kwargs)
 @receiver(post_save, sender=CourseMembership)
 def add_user_chat_group_on_enroll(sender, instance, created, *args, **kwargs):
     if instance and created:
-        chat_group = ChatGroup.objects.filter(course=instance.course).first()
+        chat_group = (
+            ChatGroup.objects.filter(course=instance.course).course_group().first()
+        )
         if chat_group:
             ChatMembership.objects.create(chat_group=chat_group, user=instance.user)
+
+
+# Fields of each tracked model that its stats contribution depends on
+STATS_FIELDS = {
+    CourseMembership: (
+        "course_id",
+        "user_id",
+        "is_course_completed",
+        "is_user_blocked",
+    ),
+    CourseFeedback: ("course_id", "rating"),
+    CourseMaterial: ("course_id",),
+}
+
+
+def get_stats_contribution(instance):
+    """Return the course id and the counters a row adds to that course's stats"""
+    if isinstance(instance, CourseMembership):
+        if instance.user_id is None:
+            return instance.course_id, {}
+        return instance.course_id, {
+            "members_count": 1,
+            "completed_count": int(instance.is_course_completed),
+            "blocked_count": int(instance.is_user_blocked),
+        }
+    if isinstance(instance, CourseFeedback):
+        if instance.rating is None:
+            return instance.course_id, {}
+        return instance.course_id, {
+            "rating_sum": float(instance.rating),
+            "rating_count": 1,
+            f"rating_{rating_star(instance.rating)}_count": 1,
+        }
+    return instance.course_id, {"materials_count": 1}
+
+
+def apply_stats_contribution(contribution, sign=1):
+    course_id, counters = contribution
+    CourseStats.objects.apply(
+        course_id, **{name: sign * value for name, value in counters.items()}
+    )
+
+
+@receiver(post_save, sender=Course)
+def create_course_stats(sender, instance, created, *args, **kwargs):
+    if instance and created:
+        CourseStats.objects.create(course=instance)
+
+
+@receiver(post_init, sender=CourseMembership)
+@receiver(post_init, sender=CourseFeedback)
+@receiver(post_init, sender=CourseMaterial)
+def snapshot_course_stats(sender, instance, *args, **kwargs):
+    # remember what the stored row contributes, skipping deferred loads
+    if all(name in instance.__dict__ for name in STATS_FIELDS[sender]):
+        instance._stats_contribution = get_stats_contribution(instance)
+    else:
+        instance._stats_contribution = None
+
+
+@receiver(post_save, sender=CourseMembership)
+@receiver(post_save, sender=CourseFeedback)
+@receiver(post_save, sender=CourseMaterial)
+def update_course_stats_on_save(sender, instance, created, *args, **kwargs):
+    previous = getattr(instance, "_stats_contribution", None)
+    current = get_stats_contribution(instance)
+    if created:
+        apply_stats_contribution(current)
+    elif previous is None:
+        CourseStats.objects.rebuild(course_ids=[instance.course_id])
+    elif previous != current:
+        apply_stats_contribution(previous, sign=-1)
+        apply_stats_contribution(current)
+    instance._stats_contribution = current
+
+
+@receiver(post_delete, sender=CourseMembership)
+@receiver(post_delete, sender=CourseFeedback)
+@receiver(post_delete, sender=CourseMaterial)
+def update_course_stats_on_delete(sender, instance, *args, **kwargs):
+    previous = getattr(instance, "_stats_contribution", None)
+    apply_stats_contribution(previous or get_stats_contribution(instance), sign=-1)
+
+
+def invalidate_course_details(course_ids):
+    bump_course_versions(course_ids)
+    # bump again once committed, a request that read the old rows meanwhile
+    # may have cached them under the first bump
+    transaction.on_commit(lambda: bump_course_versions(course_ids))
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+@receiver(post_save, sender=CourseMaterial)
+@receiver(post_delete, sender=CourseMaterial)
+@receiver(post_save, sender=CourseFeedback)
+@receiver(post_delete, sender=CourseFeedback)
+@receiver(post_save, sender=CourseInstructor)
+@receiver(post_delete, sender=CourseInstructor)
+def invalidate_course_detail(sender, instance, *args, **kwargs):
+    course_id = instance.pk if sender is Course else instance.course_id
+    invalidate_course_details([course_id])
+
+
+def invalidate_course_details_of_user(user_id):
+    # the profile is rendered as instructor of owned courses and as author
+    # of feedbacks
+    course_ids = [
+        *Course.objects.filter(owner=user_id).values_list("pk", flat=True),
+        *CourseFeedback.objects.filter(user=user_id).values_list("course", flat=True),
+    ]
+    if course_ids:
+        invalidate_course_details(course_ids)
+
+
+@receiver(post_save, sender=UserProfile)
+def invalidate_course_detail_on_profile_change(
+    sender, instance, created, *args, **kwargs
+):
+    if created or instance.user_id is None:
+        return
+    invalidate_course_details_of_user(instance.user_id)
+
+
+# user fields rendered along with the profile, see `UserProfileSerializer`
+RENDERED_USER_FIELDS = {"is_active", "is_email_verified"}
+
+
+@receiver(post_save, sender=User)
+def invalidate_course_detail_on_user_change(
+    sender, instance, created, update_fields=None, *args, **kwargs
+):
+    # eg. saving `last_login` on every login changes nothing rendered
+    if created or (update_fields and not RENDERED_USER_FIELDS & set(update_fields)):
+        return
+    invalidate_course_details_of_user(instance.pk)
+
+
+@receiver(post_save, sender=Course)
+def index_course(sender, instance, *args, **kwargs):
+    index_courses([instance.pk])
+
+
+@receiver(post_delete, sender=Course)
+def unindex_course(sender, instance, *args, **kwargs):
+    unindex_courses([instance.pk])
+
+
+@receiver(post_save, sender=CourseMaterial)
+@receiver(post_delete, sender=CourseMaterial)
+def index_course_on_material_change(sender, instance, *args, **kwargs):
+    index_courses([instance.course_id])
+
+
+@receiver(post_save, sender=UserProfile)
+def index_courses_on_profile_change(sender, instance, created, *args, **kwargs):
+    # the instructor name of owned courses is part of their document
+    if created or instance.user_id is None:
+        return
+    course_ids = list(
+        Course.objects.filter(owner=instance.user_id).values_list("pk", flat=True)
+    )
+    if course_ids:
+        index_courses(course_ids)
+
+
+@receiver(post_save, sender=Course)
+def refresh_user_courses_on_course_save(sender, instance, *args, **kwargs):
+    # the owner may have changed, refresh the previous owner too
+    owner_ids = {
+        instance.owner_id,
+        *UserCourse.objects.filter(
+            course=instance, role=COURSE_ROLES.OWNER
+        ).values_list("user", flat=True),
+    }
+    UserCourse.objects.refresh([instance.pk], user_ids=owner_ids)
+
+
+@receiver(post_save, sender=CourseInstructor)
+@receiver(post_delete, sender=CourseInstructor)
+@receiver(post_save, sender=CourseMembership)
+@receiver(post_delete, sender=CourseMembership)
+def refresh_user_courses(sender, instance, *args, **kwargs):
+    if instance.user_id is None or is_cascade_from(kwargs.get("origin"), Course, User):
+        return
+    UserCourse.objects.refresh([instance.course_id], user_ids=[instance.user_id])
+
+
+@receiver(post_init, sender=Course)
+def snapshot_course_owner(sender, instance, *args, **kwargs):
+    # remember the stored owner, None for deferred loads
+    instance._owner_id = instance.__dict__.get("owner_id")
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+@receiver(post_save, sender=CourseMembership)
+@receiver(post_delete, sender=CourseMembership)
+@receiver(post_save, sender=CourseFeedback)
+@receiver(post_delete, sender=CourseFeedback)
+def invalidate_instructor_dashboard(sender, instance, *args, **kwargs):
+    if sender is Course:
+        # the previous owner loses the course from their dashboard
+        owner_ids = [instance.owner_id, getattr(instance, "_owner_id", None)]
+        instance._owner_id = instance.owner_id
+    elif is_cascade_from(kwargs.get("origin"), Course):
+        # the course's own post_delete invalidates its owner
+        return
+    else:
+        owner_ids = Course.objects.filter(pk=instance.course_id).values_list(
+            "owner", flat=True
+        )
+    invalidate_instructor_dashboards(owner_ids)
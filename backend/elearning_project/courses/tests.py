@@ -1,9 +1,32 @@
+from io import StringIO
+from unittest import mock
+
 from model_mommy import mommy
 
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from core.tests import BaseAPITestCase
-from courses.models import Course, CourseMembership, CourseMaterial, CourseFeedback
+from core.pagination import CursorResultsSetPagination
+from core.tests import BaseAPITestCase, MigrationTestCase
+from courses.models import (
+    Course,
+    CourseMembership,
+    CourseMaterial,
+    CourseFeedback,
+    CourseInstructor,
+    CourseStats,
+    UserCourse,
+)
+from courses.search import search_courses
+from courses.views import (
+    CourseFeedbackViewSet,
+    CourseMaterialViewSet,
+    CourseViewSet,
+    MemberViewSet,
+)
 
 
 class CourseAPITestCase(BaseAPITestCase):
@@ -71,6 +94,186 @@ class CourseAPITestCase(BaseAPITestCase):
             ).exists()
         )
 
+    def test_course_list_query_count_does_not_grow_with_page(self):
+        """
+        Test if listing courses costs the same number of queries for any page size
+        """
+        Course.objects.update(status="published")
+        url = reverse("course-list")
+        with CaptureQueriesContext(connection) as small_page:
+            response = self.roger_client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        for course in mommy.make(Course, status="published", _quantity=5):
+            mommy.make(CourseMembership, course=course, user=self.roger_user)
+            mommy.make(CourseFeedback, course=course, user=self.james_user, rating=4)
+        with CaptureQueriesContext(connection) as large_page:
+            response = self.roger_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        results = response.data.get("data").get("results")
+        self.assertEqual(len(results), 6)
+        self.assertEqual(len(large_page), len(small_page))
+        enrolled = [course for course in results if course["is_enrolled"]]
+        self.assertEqual(len(enrolled), 5)
+        self.assertEqual(enrolled[0]["average_rating"], 4)
+        self.assertEqual(enrolled[0]["total_feedbacks"], 1)
+        self.assertEqual(enrolled[0]["members_count"], 1)
+        self.assertIsNotNone(enrolled[0]["chat_group"])
+
+    def test_course_detail_is_cached_until_course_changes(self):
+        """
+        Test if course detail is served from cache and invalidated on changes
+        """
+        CourseMembership.objects.create(user=self.roger_user, course=self.course)
+        material = mommy.make(CourseMaterial, course=self.course, title="Intro")
+        url = reverse("course-detail", kwargs={"pk": self.course.id})
+        with CaptureQueriesContext(connection) as cold:
+            response = self.roger_client.get(url)
+        with CaptureQueriesContext(connection) as warm:
+            response = self.roger_client.get(url)
+        self.assertLess(len(warm), len(cold))
+        self.assertEqual(
+            response.data.get("data").get("materials")[0]["title"], "Intro"
+        )
+        self.assertTrue(response.data.get("data").get("is_enrolled"))
+        self.assertEqual(response.data.get("data").get("members_count"), 1)
+
+        # per user fields are not shared through the cache
+        response = self.james_client.get(url)
+        self.assertFalse(response.data.get("data").get("is_enrolled"))
+
+        material.title = "Introduction"
+        material.save()
+        profile = self.sally_user.profile
+        profile.first_name = "Sal"
+        profile.save()
+        response = self.roger_client.get(url)
+        data = response.data.get("data")
+        self.assertEqual(data.get("materials")[0]["title"], "Introduction")
+        self.assertEqual(data.get("instructor")["first_name"], "Sal")
+
+        self.sally_user.is_email_verified = True
+        self.sally_user.save()
+        response = self.roger_client.get(url)
+        instructor = response.data.get("data").get("instructor")
+        self.assertTrue(instructor["is_email_verified"])
+
+    def test_course_fields_and_omit_restrict_payload_and_queries(self):
+        """
+        Test if `fields` and `omit` restrict the rendered course fields and skip
+        the queries of the others
+        """
+        Course.objects.update(status="published")
+        url = reverse("course-list")
+        with CaptureQueriesContext(connection) as full:
+            response = self.roger_client.get(url)
+        with CaptureQueriesContext(connection) as sparse:
+            response = self.roger_client.get(url, {"fields": "id,title,coverUrl"})
+        self.assertEqual(response.status_code, 200)
+        results = response.data.get("data").get("results")
+        self.assertEqual(set(results[0]), {"id", "title", "cover_url"})
+        self.assertLess(len(sparse), len(full))
+
+        response = self.roger_client.get(url, {"omit": "chatGroup,instructor"})
+        results = response.data.get("data").get("results")
+        self.assertNotIn("chat_group", results[0])
+        self.assertNotIn("instructor", results[0])
+        self.assertIn("members_count", results[0])
+
+        url = reverse("course-detail", kwargs={"pk": self.course.id})
+        response = self.roger_client.get(url, {"fields": "title,is_enrolled"})
+        self.assertEqual(
+            response.data.get("data"),
+            {"title": self.course.title, "is_enrolled": False},
+        )
+
+    @override_settings(COURSE_DETAIL_EMBED_LIMIT=2)
+    def test_course_detail_embeds_first_materials_and_feedbacks(self):
+        """
+        Test if course detail embeds the newest materials and feedbacks only,
+        with a cursor continuing through the nested endpoints
+        """
+        materials = mommy.make(CourseMaterial, course=self.course, _quantity=3)
+        for user in (self.roger_user, self.james_user):
+            mommy.make(CourseFeedback, course=self.course, user=user, rating=5)
+        url = reverse("course-detail", kwargs={"pk": self.course.id})
+        response = self.roger_client.get(url)
+        data = response.data.get("data")
+        self.assertEqual(
+            [material["id"] for material in data.get("materials")],
+            [materials[2].id, materials[1].id],
+        )
+        self.assertEqual(len(data.get("feedbacks")), 2)
+        self.assertIsNotNone(data.get("feedbacks")[0]["user"]["first_name"])
+        self.assertIsNone(data.get("feedbacks_next"))
+
+        response = self.roger_client.get(data.get("materials_next"))
+        results = response.data.get("data").get("results")
+        self.assertEqual([material["id"] for material in results], [materials[0].id])
+
+    # view and action of each endpoint, held to the `query_budgets` of the view
+    BUDGETED_ENDPOINTS = {
+        "course-list": (CourseViewSet, "list"),
+        "course-mine": (CourseViewSet, "mine"),
+        "course-detail": (CourseViewSet, "retrieve"),
+        "course-search": (CourseViewSet, "search"),
+        "course-members-list": (MemberViewSet, "list"),
+        "course-materials-list": (CourseMaterialViewSet, "list"),
+        "course-feedbacks-list": (CourseFeedbackViewSet, "list"),
+    }
+
+    def test_course_endpoints_stay_within_query_budget(self):
+        """
+        Test if the course endpoints run a bounded number of queries
+        """
+        Course.objects.update(status="published", title="Python")
+        for course in mommy.make(Course, status="published", _quantity=3):
+            mommy.make(CourseMembership, course=course, user=self.roger_user)
+            mommy.make(CourseMembership, course=self.course, user=course.owner)
+            mommy.make(CourseFeedback, course=self.course, user=course.owner, rating=3)
+            mommy.make(CourseMaterial, course=self.course)
+        CourseMembership.objects.create(course=self.course, user=self.roger_user)
+
+        for name, (view, action) in self.BUDGETED_ENDPOINTS.items():
+            budget = view.query_budgets[action]
+            if name in ("course-list", "course-mine", "course-search"):
+                url = reverse(name)
+            elif name == "course-detail":
+                url = reverse(name, kwargs={"pk": self.course.id})
+            else:
+                url = reverse(name, kwargs={"course_pk": self.course.id})
+            if name == "course-search":
+                url = f"{url}?q=python"
+            with self.subTest(endpoint=name), self.assertQueryBudget(budget):
+                response = self.roger_client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+    @override_settings(QUERY_COUNT_ENABLED=True)
+    def test_query_count_middleware_reports_queries(self):
+        """
+        Test if the opt-in middleware reports the SQL of each request
+        """
+        url = reverse("course-list")
+        with self.assertLogs("elearning.queries", level="DEBUG") as logs:
+            response = self.roger_client.get(url)
+        self.assertGreater(int(response["X-SQL-Count"]), 0)
+        self.assertIn("X-SQL-Time", response)
+        self.assertIn("CourseViewSet.list", logs.output[0])
+        self.assertEqual(response["X-SQL-Budget"], "5")
+
+    @override_settings(QUERY_COUNT_ENABLED=True)
+    def test_query_count_middleware_warns_over_view_budget(self):
+        """
+        Test if requests running more queries than the budget of their view
+        are logged as warnings
+        """
+        url = reverse("course-list")
+        with mock.patch.dict(CourseViewSet.query_budgets, {"list": 0}):
+            with self.assertLogs("elearning.queries", level="WARNING") as logs:
+                response = self.roger_client.get(url)
+        self.assertEqual(response["X-SQL-Budget"], "0")
+        self.assertIn("over its budget of 0 queries", logs.output[0])
+
 
 class CourseMembershipAPITestCase(BaseAPITestCase):
     """
@@ -166,6 +369,66 @@ class CourseMembershipAPITestCase(BaseAPITestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.data.get("data").get("results")), 0)
 
+    def test_user_list_course_leaves_out_instructed_courses(self):
+        """
+        Test if the courses a user only instructs are not listed as theirs
+        """
+        Course.objects.all().delete()
+        instructed = mommy.make(Course)
+        mommy.make(CourseInstructor, course=instructed, user=self.roger_user)
+        owned = mommy.make(Course, owner=self.roger_user)
+        response = self.roger_client.get(reverse("course-mine"))
+        results = response.data.get("data").get("results")
+        self.assertEqual([course["id"] for course in results], [owned.id])
+
+    def test_user_course_index_follows_ownership_and_membership(self):
+        """
+        Test if the per-user course index follows owner, enrollment and
+        completion changes and lists the most recent course first
+        """
+        owned = mommy.make(Course, owner=self.roger_user)
+        membership = mommy.make(
+            CourseMembership, course=self.course, user=self.roger_user
+        )
+        row = UserCourse.objects.get(user=self.roger_user, course=self.course)
+        self.assertEqual(row.role, "member")
+        self.assertEqual(
+            UserCourse.objects.get(user=self.roger_user, course=owned).role, "owner"
+        )
+
+        response = self.roger_client.get(reverse("course-mine"))
+        results = response.data.get("data").get("results")
+        self.assertEqual(
+            [course["id"] for course in results], [self.course.id, owned.id]
+        )
+
+        membership.is_course_completed = True
+        membership.save()
+        self.assertTrue(
+            UserCourse.objects.get(pk=row.pk, user=self.roger_user).is_course_completed
+        )
+        membership.delete()
+        self.assertFalse(
+            UserCourse.objects.filter(user=self.roger_user, course=self.course).exists()
+        )
+
+        owned.owner = self.james_user
+        owned.save()
+        self.assertEqual(
+            UserCourse.objects.get(user=self.james_user, course=owned).role, "owner"
+        )
+        # the former owner stays an instructor of the course
+        self.assertEqual(
+            UserCourse.objects.get(user=self.roger_user, course=owned).role,
+            "instructor",
+        )
+
+        UserCourse.objects.all().delete()
+        call_command("rebuild_user_courses", stdout=StringIO())
+        self.assertEqual(
+            UserCourse.objects.get(user=self.james_user, course=owned).role, "owner"
+        )
+
 
 class CourseMaterialAPITestCase(BaseAPITestCase):
     """
@@ -225,6 +488,43 @@ class CourseMaterialAPITestCase(BaseAPITestCase):
         response = self.roger_client.get(url)
         self.assertEqual(response.status_code, 200)
 
+    def test_course_material_list_pages_by_cursor(self):
+        """
+        Test if walking the material cursors returns every material exactly once
+        """
+        CourseMaterial.objects.all().delete()
+        mommy.make(CourseMaterial, course=self.course, _quantity=5)
+        # ties on created_at are broken by id
+        CourseMaterial.objects.update(created_at=self.course.created_at)
+
+        url = reverse("course-materials-list", kwargs={"course_pk": self.course.id})
+        response = self.roger_client.get(f"{url}?page_size=2&with_count=1")
+        self.assertEqual(response.data.get("data").get("count"), 5)
+        self.assertIsNone(response.data.get("data").get("previous"))
+        seen = []
+        while True:
+            data = response.data.get("data")
+            seen.extend(material["id"] for material in data.get("results"))
+            if data.get("next") is None:
+                break
+            response = self.roger_client.get(data.get("next"))
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+        response = self.roger_client.get(data.get("previous"))
+        previous = [m["id"] for m in response.data.get("data").get("results")]
+        self.assertEqual(previous, seen[2:4])
+
+    def test_course_material_list_rejects_tampered_cursor(self):
+        """
+        Test if a cursor whose value is not a date is rejected as not found
+        """
+        url = reverse("course-materials-list", kwargs={"course_pk": self.course.id})
+        for value in ("yesterday", 5, None):
+            cursor = CursorResultsSetPagination.make_cursor(value, 1)
+            response = self.roger_client.get(url, {"cursor": cursor})
+            self.assertEqual(response.status_code, 404)
+
 
 class CourseFeedbackAPITestCase(BaseAPITestCase):
     """
@@ -354,3 +654,299 @@ class CourseFeedbackAPITestCase(BaseAPITestCase):
                 course=self.course, user=self.roger_user
             ).exists()
         )
+
+
+class CourseStatsTestCase(BaseAPITestCase):
+    """
+    CourseStatsTestCase
+    """
+
+    def setUp(self):
+        super(CourseStatsTestCase, self).setUp()
+        self.course = mommy.make(Course, owner=self.sally_user)
+
+    def assertStatsMatchRebuild(self):
+        stats = CourseStats.objects.get(pk=self.course.pk)
+        CourseStats.objects.rebuild(course_ids=[self.course.pk])
+        rebuilt = CourseStats.objects.get(pk=self.course.pk)
+        for name in CourseStats.COUNTERS:
+            self.assertEqual(getattr(stats, name), getattr(rebuilt, name), name)
+        return stats
+
+    def test_stats_follow_membership_feedback_and_material_changes(self):
+        """
+        Test if course stats are kept up to date on create, update and delete
+        """
+        roger = CourseMembership.objects.create(
+            user=self.roger_user, course=self.course
+        )
+        CourseMembership.objects.create(user=self.james_user, course=self.course)
+        mommy.make(CourseMaterial, course=self.course, _quantity=2)
+        feedback = CourseFeedback.objects.create(
+            course=self.course, user=self.roger_user, rating=4.6, feedback="Good"
+        )
+        CourseFeedback.objects.create(
+            course=self.course, user=self.james_user, rating=2, feedback="Meh"
+        )
+        stats = self.assertStatsMatchRebuild()
+        self.assertEqual(stats.members_count, 2)
+        self.assertEqual(stats.materials_count, 2)
+        self.assertEqual(stats.rating_count, 2)
+        self.assertEqual(stats.rating_histogram["5"], 1)
+        self.assertAlmostEqual(stats.average_rating, 3.3)
+
+        roger.is_course_completed = True
+        roger.save()
+        feedback.rating = 3
+        feedback.save()
+        stats = self.assertStatsMatchRebuild()
+        self.assertEqual(stats.completed_count, 1)
+        self.assertEqual(stats.rating_histogram["3"], 1)
+        self.assertEqual(stats.rating_histogram["5"], 0)
+
+        CourseMembership.objects.get(pk=roger.pk).delete()
+        CourseFeedback.objects.filter(course=self.course).delete()
+        CourseMaterial.objects.filter(course=self.course).first().delete()
+        stats = self.assertStatsMatchRebuild()
+        self.assertEqual(stats.members_count, 1)
+        self.assertEqual(stats.completed_count, 0)
+        self.assertEqual(stats.rating_count, 0)
+        self.assertEqual(stats.materials_count, 1)
+
+    def test_reconcile_command_rebuilds_missing_stats(self):
+        """
+        Test if the reconcile command recreates stats rows
+        """
+        CourseMembership.objects.create(user=self.roger_user, course=self.course)
+        CourseStats.objects.all().delete()
+        call_command("reconcile_course_stats", stdout=StringIO())
+        self.assertEqual(CourseStats.objects.get(pk=self.course.pk).members_count, 1)
+
+    def test_course_admin_can_fetch_stats(self):
+        """
+        Test if the course owner can read the stats of a course
+        """
+        CourseMembership.objects.create(user=self.roger_user, course=self.course)
+        url = reverse("course-stats", kwargs={"pk": self.course.id})
+        response = self.sally_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data.get("data").get("members"), 1)
+
+
+class CourseSearchAPITestCase(BaseAPITestCase):
+    """
+    CourseSearchAPITestCase
+    """
+
+    def setUp(self):
+        super(CourseSearchAPITestCase, self).setUp()
+        self.python = mommy.make(
+            Course,
+            title="Python programming",
+            description="Variables and loops",
+            category="programming",
+            status="published",
+        )
+        self.django = mommy.make(
+            Course,
+            title="Web apps",
+            description="Building web apps with python and Django",
+            category="web",
+            status="published",
+        )
+        self.draft = mommy.make(
+            Course,
+            title="Python internals",
+            description="CPython",
+            category="programming",
+            status="draft",
+            owner=self.sally_user,
+        )
+
+    def test_search_ranks_title_matches_first(self):
+        """
+        Test if search matches prefixes and ranks title matches first
+        """
+        url = reverse("course-search")
+        response = self.roger_client.get(f"{url}?q=pyth")
+        self.assertEqual(response.status_code, 200)
+        data = response.data.get("data")
+        ids = [course["id"] for course in data.get("results")]
+        # drafts are hidden from regular users
+        self.assertEqual(ids, [self.python.id, self.django.id])
+        self.assertEqual(
+            data.get("facets"),
+            {
+                "category": {"programming": 1, "web": 1},
+                "status": {"published": 2},
+            },
+        )
+
+    def test_search_matches_materials_and_instructor(self):
+        """
+        Test if search matches material titles and the instructor name
+        """
+        mommy.make(CourseMaterial, course=self.django, title="Deploying on Heroku")
+        profile = self.django.owner.profile
+        profile.first_name = "Guido"
+        profile.save()
+        url = reverse("course-list")
+        response = self.roger_client.get(f"{url}?q=heroku")
+        results = response.data.get("data").get("results")
+        self.assertEqual([course["id"] for course in results], [self.django.id])
+        response = self.roger_client.get(f"{url}?q=guido")
+        results = response.data.get("data").get("results")
+        self.assertEqual([course["id"] for course in results], [self.django.id])
+
+    def test_search_index_follows_course_changes(self):
+        """
+        Test if renamed and deleted courses are reindexed
+        """
+        self.python.title = "Rust programming"
+        self.python.save()
+        self.django.delete()
+        url = reverse("course-search")
+        response = self.roger_client.get(f"{url}?q=python")
+        self.assertEqual(len(response.data.get("data").get("results")), 0)
+        response = self.roger_client.get(f"{url}?q=rust&category=programming")
+        results = response.data.get("data").get("results")
+        self.assertEqual([course["id"] for course in results], [self.python.id])
+
+
+class CourseIndexTestCase(BaseAPITestCase):
+    """
+    The queries behind the course endpoints must keep reading through their
+    indexes. The endpoints are requested and the queries they run are
+    explained
+    """
+
+    def setUp(self):
+        super(CourseIndexTestCase, self).setUp()
+        for course in mommy.make(Course, status="published", _quantity=2):
+            CourseMembership.objects.create(course=course, user=self.roger_user)
+
+    def test_courses_of_user(self):
+        """
+        Test if the courses of a user are read through the UserCourse index
+        """
+        with self.assertQueriesUseIndex("tb_user_courses", "user_course_recent"):
+            response = self.roger_client.get(reverse("user-my-courses"))
+        self.assertEqual(len(response.data.get("data").get("results")), 2)
+
+    def test_memberships_of_user(self):
+        """
+        Test if the enrollment of the user in listed courses is looked up
+        through an index
+        """
+        with self.assertQueriesUseIndex("tb_course_memberships"):
+            response = self.roger_client.get(reverse("course-list"))
+        self.assertEqual(response.status_code, 200)
+
+
+class CourseStatsMigrationTestCase(MigrationTestCase):
+    """
+    CourseStatsMigrationTestCase
+    """
+
+    migrate_from = [("courses", "0004_coursematerial_duration")]
+    migrate_to = [("courses", "0005_coursestats")]
+
+    def setUpBeforeMigration(self, apps):
+        User = apps.get_model("accounts", "User")
+        Course = apps.get_model("courses", "Course")
+        owner = User.objects.create(username="sally", email="sally@asdf.com")
+        member = User.objects.create(username="roger", email="roger@asdf.com")
+        self.course_id = Course.objects.create(
+            owner=owner, title="Python", description="Learn Python"
+        ).pk
+        apps.get_model("courses", "CourseMembership").objects.create(
+            course_id=self.course_id, user=member, is_course_completed=True
+        )
+        apps.get_model("courses", "CourseFeedback").objects.create(
+            course_id=self.course_id, user=member, rating=4.6, feedback="Good"
+        )
+
+    def test_stats_of_existing_courses_are_filled(self):
+        """
+        Test if the migration computes the stats of courses created before it
+        """
+        CourseStats = self.apps.get_model("courses", "CourseStats")
+        stats = CourseStats.objects.get(pk=self.course_id)
+        self.assertEqual(stats.members_count, 1)
+        self.assertEqual(stats.completed_count, 1)
+        self.assertEqual(stats.rating_count, 1)
+        self.assertEqual(stats.rating_5_count, 1)
+        self.assertEqual(stats.materials_count, 0)
+
+
+class CourseSearchMigrationTestCase(MigrationTestCase):
+    """
+    CourseSearchMigrationTestCase
+    """
+
+    migrate_from = [("courses", "0005_coursestats")]
+    migrate_to = [("courses", "0006_course_search_index")]
+
+    def setUpBeforeMigration(self, apps):
+        User = apps.get_model("accounts", "User")
+        owner = User.objects.create(username="sally", email="sally@asdf.com")
+        apps.get_model("accounts", "UserProfile").objects.create(
+            pk=owner.pk, user=owner, first_name="Guido"
+        )
+        self.course_id = (
+            apps.get_model("courses", "Course")
+            .objects.create(owner=owner, title="Python", description="Learn it")
+            .pk
+        )
+        apps.get_model("courses", "CourseMaterial").objects.create(
+            course_id=self.course_id, title="Deploying on Heroku", description=""
+        )
+
+    def test_existing_courses_are_indexed(self):
+        """
+        Test if the migration indexes the courses created before it
+        """
+        for text in ("python", "guido", "heroku"):
+            results = search_courses(Course.objects.all(), text)
+            self.assertEqual([course.pk for course in results], [self.course_id])
+
+
+class UserCourseMigrationTestCase(MigrationTestCase):
+    """
+    UserCourseMigrationTestCase
+    """
+
+    migrate_from = [("courses", "0006_course_search_index")]
+    migrate_to = [("courses", "0007_usercourse")]
+
+    def setUpBeforeMigration(self, apps):
+        User = apps.get_model("accounts", "User")
+        self.users = {
+            name: User.objects.create(username=name, email=f"{name}@asdf.com").pk
+            for name in ("sally", "roger", "james")
+        }
+        course = apps.get_model("courses", "Course").objects.create(
+            owner_id=self.users["sally"], title="Python", description="Learn it"
+        )
+        self.course_id = course.pk
+        apps.get_model("courses", "CourseInstructor").objects.create(
+            course=course, user_id=self.users["james"]
+        )
+        apps.get_model("courses", "CourseMembership").objects.create(
+            course=course, user_id=self.users["roger"], is_course_completed=True
+        )
+
+    def test_courses_of_existing_users_are_indexed(self):
+        """
+        Test if the migration indexes the owners, instructors and members of
+        courses created before it
+        """
+        UserCourse = self.apps.get_model("courses", "UserCourse")
+        rows = {
+            row.user_id: row for row in UserCourse.objects.filter(course=self.course_id)
+        }
+        self.assertEqual(rows[self.users["sally"]].role, "owner")
+        self.assertEqual(rows[self.users["james"]].role, "instructor")
+        self.assertEqual(rows[self.users["roger"]].role, "member")
+        self.assertTrue(rows[self.users["roger"]].is_member)
+        self.assertTrue(rows[self.users["roger"]].is_course_completed)
@@ -8,13 +8,21 @@ from rest_framework.permissions import (
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.decorators import action
 from rest_framework import exceptions
-from core.pagination import DefaultResultsSetPagination
+from core.pagination import DefaultResultsSetPagination, CursorResultsSetPagination
 from core.utils import success_response
-from core.enums import USER_TYPES, COURSE_STATUS
+from core.enums import USER_TYPES, COURSE_ROLES, COURSE_STATUS
+from core.views import QueryBudgetViewMixin, SparseFieldsetsViewMixin
 
 from chat.models import ChatGroup
-from .models import Course, CourseMembership, CourseFeedback, CourseMaterial
+from .models import (
+    Course,
+    CourseMembership,
+    CourseFeedback,
+    CourseMaterial,
+    CourseStats,
+)
 from . import serializers
+from .cache import get_course_detail_data
 from .filters import CourseFilter
 from .permissions import (
     IsCourseMember,
@@ -24,7 +32,7 @@ from .permissions import (
 )
 
 
-class CourseViewSet(ModelViewSet):
+class CourseViewSet(QueryBudgetViewMixin, SparseFieldsetsViewMixin, ModelViewSet):
     """
     CourseViewSet - feature includes
     - course join
@@ -33,6 +41,14 @@ class CourseViewSet(ModelViewSet):
     """
 
     queryset = Course.objects.all()
+    # whatever the number of courses listed
+    query_budgets = {
+        "list": 5,
+        "mine": 5,
+        "retrieve": 6,
+        "search": 7,
+        "chat_groups": 5,
+    }
     serializer_class = serializers.CourseSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
     pagination_class = DefaultResultsSetPagination
@@ -57,12 +73,23 @@ class CourseViewSet(ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == "retrieve":
+            queryset = queryset.with_list_data(
+                self.request.user,
+                fields=self.get_rendered_fields(serializers.CourseDetailSerializer),
+            )
+        return queryset
+
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
-        serializer = serializers.CourseDetailSerializer(
-            instance, context={"user": request.user, "request": request}
+        data = get_course_detail_data(
+            instance,
+            context={"user": request.user, "request": request},
+            **self.get_sparse_fieldsets(),
         )
-        return success_response(detail="Fetched course details", **serializer.data)
+        return success_response(detail="Fetched course details", **data)
 
     def create(self, request, *args, **kwargs):
         serializer = serializers.CourseCreateSerializer(
@@ -74,13 +101,23 @@ class CourseViewSet(ModelViewSet):
             code=201, detail="Successfully created course", **serializer.data
         )
 
-    def list(self, request, *args, **kwargs):
-        queryset = self.filter_queryset(self.get_queryset())
-        if (
-            request.user.user_type == USER_TYPES.REGULAR_USER
-            or request.user.is_anonymous
-        ):
+    def with_list_data(self, queryset):
+        """Annotate `queryset` for the fields rendered by this request"""
+        return queryset.with_list_data(
+            self.request.user,
+            fields=self.get_rendered_fields(self.get_serializer_class()),
+        )
+
+    def filter_visible(self, queryset):
+        """Restrict regular users and visitors to published courses"""
+        user = self.request.user
+        if user.is_anonymous or user.user_type == USER_TYPES.REGULAR_USER:
             queryset = queryset.filter(status=COURSE_STATUS.PUBLISHED)
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.with_list_data(self.filter_queryset(self.get_queryset()))
+        queryset = self.filter_visible(queryset)
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -91,13 +128,45 @@ class CourseViewSet(ModelViewSet):
         serializer = self.get_serializer(queryset, many=True)
         return success_response(detail="Fetched all courses", results=serializer.data)
 
+    @action(detail=False, methods=["get"])
+    def search(self, request, *args, **kwargs):
+        """
+        Ranked full text search over title, description, category, instructor
+        and material titles, with category and status facets of the matches
+        """
+        text = request.query_params.get("q")
+        if not text:
+            raise exceptions.ParseError(detail="Provide a search query with `q`")
+        facets = self.filter_visible(self.get_queryset().search(text)).facets()
+        queryset = self.with_list_data(
+            self.filter_visible(self.filter_queryset(self.get_queryset()))
+        )
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.paginator.get_paginated_response(
+                detail="Fetched matching courses" if page != [] else "No course found",
+                data=serializer.data,
+                facets=facets,
+            )
+
+        serializer = self.get_serializer(queryset, many=True)
+        return success_response(
+            detail="Fetched matching courses", results=serializer.data, facets=facets
+        )
+
     @action(detail=False, permission_classes=[IsAuthenticated], methods=["get"])
     def mine(self, request, *args, **kwargs):
         """List all user courses"""
-        # all courses where user is a member or admin
-        member_courses = request.user.courses.all()
-        admin_courses = request.user.my_courses.all()
-        queryset = (member_courses | admin_courses).distinct()
+        # all courses where user is a member or owner, most recent first,
+        # not the ones they only instruct
+        queryset = self.with_list_data(
+            Course.objects.of_user(
+                request.user,
+                Q(user_courses__is_member=True)
+                | Q(user_courses__role=COURSE_ROLES.OWNER),
+            )
+        )
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -139,11 +208,15 @@ class CourseViewSet(ModelViewSet):
     @action(detail=True, permission_classes=[IsCourseAdmin], methods=["get"])
     def stats(self, request, *args, **kwargs):
         course = self.get_object()
+        stats = CourseStats.objects.for_course(course)
         course_stats = {
-            "members": CourseMembership.objects.filter(
-                course=course,
-            ).count(),
-            "materials": course.materials.count(),
+            "members": stats.members_count,
+            "materials": stats.materials_count,
+            "completed": stats.completed_count,
+            "blocked": stats.blocked_count,
+            "average_rating": stats.average_rating,
+            "total_feedbacks": stats.rating_count,
+            "rating_histogram": stats.rating_histogram,
         }
         return success_response(
             detail="Successfully fetched course stats", **course_stats
@@ -161,10 +234,17 @@ class CourseViewSet(ModelViewSet):
             ).distinct()
         else:
             queryset = ChatGroup.objects.none()
+        queryset = queryset.with_viewer_state(
+            request.user,
+            fields=self.get_rendered_fields(serializers.ChatGroupSerializer),
+        )
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = serializers.ChatGroupSerializer(
-                page, many=True, context={"request": request}
+                page,
+                many=True,
+                context={"request": request},
+                **self.get_sparse_fieldsets(),
             )
             return self.paginator.get_paginated_response(
                 detail=(
@@ -173,13 +253,15 @@ class CourseViewSet(ModelViewSet):
                 data=serializer.data,
             )
 
-        serializer = serializers.ChatGroupSerializer(queryset, many=True)
+        serializer = serializers.ChatGroupSerializer(
+            queryset, many=True, **self.get_sparse_fieldsets()
+        )
         return success_response(
             detail="Fetched all chat groups", results=serializer.data
         )
 
 
-class MemberViewSet(ModelViewSet):
+class MemberViewSet(QueryBudgetViewMixin, SparseFieldsetsViewMixin, ModelViewSet):
     """
     MemberViewSet - Features include:
     - members list
@@ -188,8 +270,11 @@ class MemberViewSet(ModelViewSet):
 
     queryset = CourseMembership.objects.all()
     serializer_class = serializers.CourseMemberProfileSerializer
+    query_budgets = {"list": 1}
     permission_classes = [IsAuthenticated]
-    pagination_class = DefaultResultsSetPagination
+    pagination_class = CursorResultsSetPagination
+    # members are listed in the order they signed up
+    cursor_ordering = "created_at"
 
     def get_paginated_response(self, data, detail=None):
         """
@@ -222,13 +307,17 @@ class MemberViewSet(ModelViewSet):
         queryset = self.get_queryset().course_users().user_profiles()
         page = self.paginate_queryset(queryset)
         if page is not None:
-            serializer = serializers.CourseMemberProfileSerializer(page, many=True)
+            serializer = serializers.CourseMemberProfileSerializer(
+                page, many=True, **self.get_sparse_fieldsets()
+            )
             return self.paginator.get_paginated_response(
                 detail="Fetched all members" if page != [] else "No members found",
                 data=serializer.data,
             )
 
-        serializer = serializers.CourseMemberProfileSerializer(queryset, many=True)
+        serializer = serializers.CourseMemberProfileSerializer(
+            queryset, many=True, **self.get_sparse_fieldsets()
+        )
         return success_response(detail="Fetched all members", results=serializer.data)
 
     @action(detail=False, permission_classes=[IsAuthenticated], methods=["get"])
@@ -238,7 +327,9 @@ class MemberViewSet(ModelViewSet):
         )
         page = self.paginate_queryset(queryset)
         if page is not None:
-            serializer = serializers.UserProfileSerializer(page, many=True)
+            serializer = serializers.UserProfileSerializer(
+                page, many=True, **self.get_sparse_fieldsets()
+            )
             return self.paginator.get_paginated_response(
                 detail=(
                     "Fetched all blocked users"
@@ -248,7 +339,9 @@ class MemberViewSet(ModelViewSet):
                 data=serializer.data,
             )
 
-        serializer = serializers.UserProfileSerializer(queryset, many=True)
+        serializer = serializers.UserProfileSerializer(
+            queryset, many=True, **self.get_sparse_fieldsets()
+        )
         return success_response(
             detail="Fetched all member requests", results=serializer.data
         )
@@ -260,7 +353,9 @@ class MemberViewSet(ModelViewSet):
         )
         page = self.paginate_queryset(queryset)
         if page is not None:
-            serializer = serializers.UserProfileSerializer(page, many=True)
+            serializer = serializers.UserProfileSerializer(
+                page, many=True, **self.get_sparse_fieldsets()
+            )
             return self.paginator.get_paginated_response(
                 detail=(
                     "Fetched all completed course users"
@@ -270,7 +365,9 @@ class MemberViewSet(ModelViewSet):
                 data=serializer.data,
             )
 
-        serializer = serializers.UserProfileSerializer(queryset, many=True)
+        serializer = serializers.UserProfileSerializer(
+            queryset, many=True, **self.get_sparse_fieldsets()
+        )
         return success_response(detail="Fetched all users", results=serializer.data)
 
     def retrieve(self, request, *args, **kwargs):
@@ -312,7 +409,9 @@ class MemberViewSet(ModelViewSet):
         )
 
 
-class CourseMaterialViewSet(ModelViewSet):
+class CourseMaterialViewSet(
+    QueryBudgetViewMixin, SparseFieldsetsViewMixin, ModelViewSet
+):
     """
     CourseMaterialViewSet - Features include:
     - course material list
@@ -321,8 +420,9 @@ class CourseMaterialViewSet(ModelViewSet):
 
     queryset = CourseMaterial.objects.all()
     serializer_class = serializers.CourseMaterialSerializer
+    query_budgets = {"list": 1}
     permission_classes = [IsCourseAdminOrReadOnly]
-    pagination_class = DefaultResultsSetPagination
+    pagination_class = CursorResultsSetPagination
 
     def get_queryset(self):
         queryset = self.queryset.filter(course=self.kwargs["course_pk"])
@@ -391,7 +491,9 @@ class CourseMaterialViewSet(ModelViewSet):
         return success_response(detail="Successfully deleted course material")
 
 
-class CourseFeedbackViewSet(ModelViewSet):
+class CourseFeedbackViewSet(
+    QueryBudgetViewMixin, SparseFieldsetsViewMixin, ModelViewSet
+):
     """
     CourseFeedbackViewSet - Features include:
     - course feedback list
@@ -399,12 +501,15 @@ class CourseFeedbackViewSet(ModelViewSet):
     """
 
     queryset = CourseFeedback.objects.all()
+    query_budgets = {"list": 1}
     serializer_class = serializers.CourseFeedbackSerializer
     permission_classes = [IsCourseAdmin, IsCourseMemberOrReadOnly]
-    pagination_class = DefaultResultsSetPagination
+    pagination_class = CursorResultsSetPagination
 
     def get_queryset(self):
         queryset = self.queryset.filter(course=self.kwargs["course_pk"])
+        if "user" in self.get_rendered_fields(self.get_serializer_class()):
+            queryset = queryset.select_related("user__profile")
         return queryset
 
     def get_object(self):
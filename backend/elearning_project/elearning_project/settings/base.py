@@ -84,6 +84,7 @@ DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
 AUTH_USER_MODEL = "accounts.User"
 
 MIDDLEWARE = [
+    "core.middleware.QueryCountMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -127,7 +128,40 @@ DATABASES = {
 }
 
 # Channels
-CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+# In memory layer for a single process by default. Set CHANNEL_LAYER_URL to
+# a redis:// server, or to the unix:// socket of `manage.py run_channel_hub`
+# on a single host, to share groups between worker processes.
+
+CHANNEL_LAYER_URL = env("CHANNEL_LAYER_URL", default=None)
+
+if CHANNEL_LAYER_URL:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "websocket.layers.PubSubChannelLayer",
+            "CONFIG": {"url": CHANNEL_LAYER_URL},
+        }
+    }
+else:
+    CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Per process local memory by default, set REDIS_URL to share the cache
+# between processes.
+
+REDIS_URL = env("REDIS_URL", default=None)
+
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+    }
 
 
 # Password validation
@@ -135,7 +169,10 @@ CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}
 
 AUTH_PASSWORD_VALIDATORS = [
     {
-        "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
+        "NAME": (
+            "django.contrib.auth.password_validation."
+            "UserAttributeSimilarityValidator"
+        ),
     },
     {
         "NAME": "django.contrib.auth.password_validation.MinimumLengthValidator",
@@ -208,6 +245,62 @@ ACCESS_TOKEN_LIFETIME_MINUTES = env(
 
 REFRESH_TOKEN_LIFETIME_DAYS = env("REFRESH_TOKEN_LIFETIME_DAYS", default=300, cast=int)
 
+# `courses.cache` invalidates course detail by bumping a version key, which
+# only reaches the other processes through a shared cache. Without REDIS_URL
+# each process keeps its own version, so cached detail must expire quickly.
+COURSE_DETAIL_CACHE_TIMEOUT = env(
+    "COURSE_DETAIL_CACHE_TIMEOUT", default=60 * 60 if REDIS_URL else 5, cast=int
+)
+
+# number of materials and feedbacks embedded in course detail, the rest is
+# paged through the nested endpoints
+COURSE_DETAIL_EMBED_LIMIT = env("COURSE_DETAIL_EMBED_LIMIT", default=10, cast=int)
+
+# messages per window of the chat history, see `chat.history`
+CHAT_HISTORY_LIMIT = env("CHAT_HISTORY_LIMIT", default=50, cast=int)
+CHAT_HISTORY_MAX_LIMIT = env("CHAT_HISTORY_MAX_LIMIT", default=200, cast=int)
+
+# age in days past which `manage.py archive_chat_messages` moves messages
+# to compressed segments, see `chat.archive`
+CHAT_ARCHIVE_AFTER_DAYS = env("CHAT_ARCHIVE_AFTER_DAYS", default=365, cast=int)
+
+# write-behind of the messages sent over websockets, see `websocket.writer`:
+# seconds between flushes, messages per flush and retries of a failed flush.
+# Messages are broadcast before they are written and only confirmed by a
+# `chat_message_status` event. Pending messages are written on a normal
+# exit, but a worker killed by SIGKILL or the OOM killer loses the messages
+# of its last CHAT_WRITE_INTERVAL seconds, or more while the database is
+# slow, without a trace: clients should treat messages without a "saved"
+# status as unsent
+CHAT_WRITE_INTERVAL = env("CHAT_WRITE_INTERVAL", default=0.05, cast=float)
+CHAT_WRITE_BATCH_SIZE = env("CHAT_WRITE_BATCH_SIZE", default=500, cast=int)
+CHAT_WRITE_RETRIES = env("CHAT_WRITE_RETRIES", default=3, cast=int)
+
+# seconds during which the typing events of a chat are coalesced, see
+# `websocket.indicators`
+CHAT_TYPING_INTERVAL = env("CHAT_TYPING_INTERVAL", default=1.0, cast=float)
+
+# seconds the users of websocket connections are cached, see `websocket.users`
+WEBSOCKET_USER_CACHE_TTL = env("WEBSOCKET_USER_CACHE_TTL", default=30, cast=int)
+
+INSTRUCTOR_DASHBOARD_CACHE_TIMEOUT = env(
+    "INSTRUCTOR_DASHBOARD_CACHE_TIMEOUT", default=5 * 60, cast=int
+)
+
+# per request SQL instrumentation, see `core.middleware.QueryCountMiddleware`
+QUERY_COUNT_ENABLED = env("QUERY_COUNT_ENABLED", default=False, cast=bool)
+QUERY_COUNT_WARNING = env("QUERY_COUNT_WARNING", default=50, cast=int)
+QUERY_COUNT_N_PLUS_ONE_THRESHOLD = env(
+    "QUERY_COUNT_N_PLUS_ONE_THRESHOLD", default=3, cast=int
+)
+if QUERY_COUNT_ENABLED:
+    CORS_EXPOSE_HEADERS = [
+        "X-SQL-Count",
+        "X-SQL-Time",
+        "X-SQL-Duplicates",
+        "X-SQL-Budget",
+    ]
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": datetime.timedelta(minutes=ACCESS_TOKEN_LIFETIME_MINUTES),
     "REFRESH_TOKEN_LIFETIME": datetime.timedelta(days=REFRESH_TOKEN_LIFETIME_DAYS),
@@ -68,6 +68,16 @@ class NotificationTarget(BaseModel):
 
     class Meta:
         db_table = "tb_notification_targets"
+        indexes = [
+            # unread notifications of a user, newest first. Partial because
+            # `is_read=False` is compiled to `NOT is_read`, which SQLite
+            # cannot match against an indexed column
+            models.Index(
+                fields=["user", "-created_at"],
+                condition=models.Q(is_read=False),
+                name="notification_target_unread",
+            ),
+        ]
 
     notification = models.ForeignKey(
         "Notification",
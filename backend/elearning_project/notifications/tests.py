@@ -0,0 +1,12 @@
+from core.tests import BaseTestCase
+from notifications.models import NotificationTarget
+
+
+class NotificationIndexTestCase(BaseTestCase):
+    def test_unread_notifications_of_user(self):
+        self.assertUsesIndex(
+            NotificationTarget.objects.filter(
+                user=self.roger_user, is_read=False
+            ).order_by("-created_at"),
+            "notification_target_unread",
+        )
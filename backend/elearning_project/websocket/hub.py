@@ -0,0 +1,222 @@
+"""
+Minimal Redis-protocol pub/sub server for `websocket.layers.PubSubChannelLayer`
+when every worker process runs on one host:
+
+    python manage.py run_channel_hub --socket /run/elearning/channels.sock
+
+and `CHANNEL_LAYER_URL=unix:///run/elearning/channels.sock`. Only PING,
+SUBSCRIBE, UNSUBSCRIBE, PUBLISH and QUIT are understood. Use a Redis server
+instead when the workers run on several hosts.
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+__all__ = [
+    "ChannelHub",
+    "running_hub",
+    "serve",
+]
+
+
+# subscribers lagging behind by more than this many bytes are disconnected,
+# as the pubsub client output buffer limit of Redis does
+OUTPUT_BUFFER_LIMIT = 32 * 1024 * 1024
+
+
+def encode(value):
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, str):
+        value = value.encode()
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    return b"*%d\r\n%s" % (len(value), b"".join(encode(item) for item in value))
+
+
+async def read_command(reader):
+    """Read a command sent as an array of bulk strings, or inline
+
+    Returns:
+        list: command name and arguments as bytes, None once disconnected
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        return line.split()
+    command = []
+    for _ in range(int(line[1:])):
+        header = await reader.readline()
+        if not header.startswith(b"$"):
+            raise ValueError("Protocol error: expected a bulk string")
+        command.append((await reader.readexactly(int(header[1:]) + 2))[:-2])
+    return command
+
+
+class ChannelHub:
+    """
+    Routes every published message to the connections subscribed to its
+    topic, each message is written once per subscribed connection
+    """
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+
+    def subscribe(self, writer, topics, subscribed):
+        replies = []
+        for topic in topics:
+            subscribed.add(topic)
+            self.subscribers[topic].add(writer)
+            replies.append(encode([b"subscribe", topic, len(subscribed)]))
+        return b"".join(replies)
+
+    def unsubscribe(self, writer, topics, subscribed):
+        replies = []
+        for topic in topics or sorted(subscribed):
+            subscribed.discard(topic)
+            self.discard(writer, topic)
+            replies.append(encode([b"unsubscribe", topic, len(subscribed)]))
+        if not replies:
+            replies.append(encode([b"unsubscribe", None, 0]))
+        return b"".join(replies)
+
+    def discard(self, writer, topic):
+        writers = self.subscribers.get(topic)
+        if writers is not None:
+            writers.discard(writer)
+            if not writers:
+                del self.subscribers[topic]
+
+    def publish(self, topic, data):
+        writers = self.subscribers.get(topic, ())
+        frame = encode([b"message", topic, data])
+        for writer in list(writers):
+            if writer.transport.get_write_buffer_size() > OUTPUT_BUFFER_LIMIT:
+                writer.close()
+                self.discard(writer, topic)
+                continue
+            writer.write(frame)
+        return len(writers)
+
+    def execute(self, writer, command, subscribed):
+        """Run one command of the connection of `writer`
+
+        Returns:
+            bytes: encoded reply
+        """
+        name, args = command[0].upper(), command[1:]
+        if name == b"PUBLISH" and len(args) == 2:
+            return encode(self.publish(*args))
+        if name == b"SUBSCRIBE" and args:
+            return self.subscribe(writer, args, subscribed)
+        if name == b"UNSUBSCRIBE":
+            return self.unsubscribe(writer, args, subscribed)
+        if name == b"PING":
+            if subscribed:
+                return encode([b"pong", args[0] if args else b""])
+            return b"+PONG\r\n"
+        if name == b"QUIT":
+            return b"+OK\r\n"
+        return b"-ERR unknown command '%s'\r\n" % command[0]
+
+    async def handle(self, reader, writer):
+        subscribed = set()
+        try:
+            while True:
+                try:
+                    command = await read_command(reader)
+                except (ValueError, asyncio.IncompleteReadError):
+                    break
+                if command is None:
+                    break
+                if not command:
+                    continue
+                writer.write(self.execute(writer, command, subscribed))
+                await writer.drain()
+                if command[0].upper() == b"QUIT":
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            for topic in subscribed:
+                self.discard(writer, topic)
+            writer.close()
+
+
+async def serve(path=None, host="127.0.0.1", port=None):
+    """Serve a hub on the unix socket `path`, or on `host:port`, forever"""
+    hub = ChannelHub()
+    if path:
+        if os.path.exists(path):
+            os.unlink(path)
+        server = await asyncio.start_unix_server(hub.handle, path=path)
+    else:
+        server = await asyncio.start_server(hub.handle, host=host, port=port)
+    async with server:
+        await server.serve_forever()
+
+
+def wait_for_socket(path, process, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Channel hub exited with code {process.returncode}")
+        try:
+            with socket.socket(socket.AF_UNIX) as client:
+                client.connect(path)
+            return
+        except (FileNotFoundError, ConnectionRefusedError):
+            time.sleep(0.05)
+    raise TimeoutError(f"Channel hub did not listen on {path}")
+
+
+@contextmanager
+def running_hub():
+    """Spawn a hub process on a temporary unix socket, for tests and
+    benchmarks
+
+    Yields:
+        str: `unix://` url of the hub
+    """
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "channels.sock")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "websocket.hub", "--socket", path],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    try:
+        wait_for_socket(path, process)
+        yield f"unix://{path}"
+    finally:
+        process.terminate()
+        process.wait()
+        if os.path.exists(path):
+            os.unlink(path)
+        os.rmdir(directory)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--socket", help="unix socket to listen on")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6380)
+    options = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(path=options.socket, host=options.host, port=options.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
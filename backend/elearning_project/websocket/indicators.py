@@ -0,0 +1,57 @@
+import asyncio
+import logging
+
+from django.conf import settings
+
+__all__ = [
+    "TypingIndicators",
+]
+
+logger = logging.getLogger(__name__)
+
+
+class TypingIndicators:
+    """
+    Throttle and coalesce the typing events of the connections of a process.
+
+    The first event of a chat is sent right away and opens a window of
+    `interval` seconds, the users typing during the window are sent at once
+    when it closes, each user at most once, and so on until a window passes
+    without any. `send` is awaited with the chat group name and the cards
+    of the typing users. Clients show each user for a few seconds, so the
+    updates of several processes add up.
+    """
+
+    def __init__(self, send, interval=None):
+        self.send = send
+        self.interval = settings.CHAT_TYPING_INTERVAL if interval is None else interval
+        # chat group name -> cards of the users typing in the current window
+        self.windows = {}
+        self.tasks = {}
+
+    async def add(self, group_name, user_card):
+        window = self.windows.get(group_name)
+        if window is not None:
+            window[user_card["id"]] = user_card
+            return
+        self.windows[group_name] = {}
+        self.tasks[group_name] = asyncio.create_task(self.run(group_name))
+        await self.send(group_name, [user_card])
+
+    async def run(self, group_name):
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                users = self.windows[group_name]
+                if not users:
+                    break
+                self.windows[group_name] = {}
+                try:
+                    await self.send(group_name, list(users.values()))
+                except Exception:
+                    logger.exception(
+                        "Sending the typing users of %s failed", group_name
+                    )
+        finally:
+            del self.windows[group_name]
+            del self.tasks[group_name]
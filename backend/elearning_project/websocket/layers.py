@@ -0,0 +1,273 @@
+import asyncio
+import json
+import logging
+import uuid
+from collections import defaultdict
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+
+__all__ = [
+    "PubSubChannelLayer",
+]
+
+logger = logging.getLogger(__name__)
+
+
+# seconds before subscribing again after losing the connection, doubled on
+# each failed attempt up to the maximum
+RECONNECT_DELAY = 0.1
+RECONNECT_MAX_DELAY = 5
+
+
+class PubSubChannelLayer(BaseChannelLayer):
+    """
+    Channel layer over Redis-protocol pub/sub, shared by every worker
+    process. `url` is a `redis://` server when the workers run on several
+    hosts, or the `unix://` socket of `manage.py run_channel_hub` on one host.
+
+    Groups are kept per process: a process subscribes to the topic of a
+    group while one of its channels is in it, so `group_send` publishes once
+    and each process fans the message out to its own channels. Messages for
+    the channels of a process go to the topic of that process. As with
+    Redis pub/sub, messages for channels nobody listens to are dropped, and
+    so are the messages published while the connection is lost: the layer
+    reconnects and subscribes again to its topics.
+    """
+
+    extensions = ["groups", "flush"]
+
+    def __init__(
+        self,
+        url="redis://localhost:6379/0",
+        prefix="asgi",
+        expiry=60,
+        capacity=100,
+        channel_capacity=None,
+    ):
+        super().__init__(
+            expiry=expiry, capacity=capacity, channel_capacity=channel_capacity
+        )
+        self.url = url
+        self.prefix = prefix
+        self.process_id = uuid.uuid4().hex
+        # channel name -> queue of the messages received for it
+        self.channels = {}
+        # group name -> names of the channels of this process in the group
+        self.groups = defaultdict(set)
+        self.loop = None
+
+    def topic(self, kind, name):
+        return f"{self.prefix}:{kind}:{name}"
+
+    def channel_topic(self, channel):
+        if "!" in channel:
+            return self.topic("process", channel[: channel.index("!")])
+        return self.topic("channel", channel)
+
+    def is_local(self, channel):
+        return channel.startswith(f"specific.{self.process_id}!")
+
+    async def connect(self):
+        """Open the connections on the running event loop, again whenever
+        the loop changes, eg. under `async_to_sync`"""
+        loop = asyncio.get_running_loop()
+        if self.loop is loop:
+            return
+        self.loop = loop
+        self.client = aioredis.from_url(self.url)
+        self.pubsub = None
+        self.reader = None
+        self.subscribed = set()
+
+    async def subscribe(self, topic):
+        await self.connect()
+        if topic in self.subscribed:
+            return
+        self.subscribed.add(topic)
+        if self.pubsub is None:
+            # without a reader nothing reconnects, so a failed first
+            # subscribe is rolled back for the next one to start over, with
+            # the topics subscribed meanwhile on the failed connection
+            self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await self.pubsub.subscribe(*self.subscribed)
+            except BaseException:
+                pubsub, self.pubsub = self.pubsub, None
+                self.subscribed.discard(topic)
+                try:
+                    await pubsub.aclose()
+                except (RedisError, OSError):
+                    pass
+                raise
+            self.reader = asyncio.create_task(self.read())
+            return
+        try:
+            await self.pubsub.subscribe(topic)
+        except (RedisError, OSError) as exc:
+            # the reader subscribes again to every topic once reconnected
+            logger.warning("Subscribing to %s failed: %s", topic, exc)
+
+    async def unsubscribe(self, topic):
+        if self.loop is not asyncio.get_running_loop():
+            return
+        if topic in self.subscribed:
+            self.subscribed.discard(topic)
+            if self.pubsub is None:
+                return
+            try:
+                await self.pubsub.unsubscribe(topic)
+            except (RedisError, OSError) as exc:
+                logger.warning("Unsubscribing from %s failed: %s", topic, exc)
+
+    async def read(self):
+        """Deliver the published messages to the channels of this process
+        until cancelled, reconnecting whenever reading fails"""
+        while True:
+            try:
+                message = await self.pubsub.get_message(timeout=None)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Reading from the channel layer failed")
+                await self.reconnect()
+                continue
+            if message is None or message["type"] != "message":
+                continue
+            try:
+                payload = json.loads(message["data"])
+                if "group" in payload:
+                    targets = self.groups.get(payload["group"], ())
+                else:
+                    targets = [payload["channel"]]
+                for channel in list(targets):
+                    self.deliver(channel, payload["message"])
+            except (ValueError, TypeError, KeyError):
+                logger.exception(
+                    "Dropping a malformed message of %s", message.get("channel")
+                )
+
+    async def reconnect(self):
+        """Replace the pubsub connection by a new one subscribed to every
+        topic of `subscribed`, retrying with a growing delay"""
+        delay = RECONNECT_DELAY
+        while True:
+            try:
+                await self.pubsub.aclose()
+            except (RedisError, OSError):
+                pass
+            await asyncio.sleep(delay)
+            self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await self.pubsub.connect()
+                # topics subscribed meanwhile are in `subscribed` too
+                if self.subscribed:
+                    await self.pubsub.subscribe(*self.subscribed)
+                return
+            except (RedisError, OSError) as exc:
+                logger.warning("Reconnecting to the channel layer failed: %s", exc)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    def deliver(self, channel, message):
+        queue = self.channels.get(channel)
+        if queue is None:
+            return
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # the sender is in another process, drop as Redis would
+            pass
+
+    def make_queue(self, channel):
+        if channel not in self.channels:
+            self.channels[channel] = asyncio.Queue(maxsize=self.get_capacity(channel))
+        return self.channels[channel]
+
+    async def publish(self, topic, payload):
+        await self.connect()
+        await self.client.publish(topic, json.dumps(payload))
+
+    # Channel layer API
+
+    async def new_channel(self, prefix="specific"):
+        channel = f"{prefix}.{self.process_id}!{uuid.uuid4().hex}"
+        self.make_queue(channel)
+        await self.subscribe(self.channel_topic(channel))
+        return channel
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        assert "__asgi_channel__" not in message
+        if self.is_local(channel):
+            queue = self.channels.get(channel)
+            if queue is not None:
+                try:
+                    queue.put_nowait(message)
+                except asyncio.QueueFull:
+                    raise ChannelFull(channel)
+            return
+        await self.publish(
+            self.channel_topic(channel), {"channel": channel, "message": message}
+        )
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel)
+        queue = self.make_queue(channel)
+        try:
+            await self.subscribe(self.channel_topic(channel))
+            return await queue.get()
+        except asyncio.CancelledError:
+            # the consumer is gone, leave its groups
+            self.channels.pop(channel, None)
+            for group in [
+                name for name, members in self.groups.items() if channel in members
+            ]:
+                await self.group_discard(group, channel)
+            raise
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        self.groups[group].add(channel)
+        await self.subscribe(self.topic("group", group))
+
+    async def group_discard(self, group, channel):
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        members = self.groups.get(group)
+        if members is None:
+            return
+        members.discard(channel)
+        if not members:
+            del self.groups[group]
+            await self.unsubscribe(self.topic("group", group))
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        assert self.valid_group_name(group), "Group name not valid"
+        await self.publish(
+            self.topic("group", group), {"group": group, "message": message}
+        )
+
+    async def flush(self):
+        self.channels = {}
+        self.groups = defaultdict(set)
+        await self.close()
+
+    async def close(self):
+        if self.loop is not asyncio.get_running_loop():
+            self.loop = None
+            return
+        if self.reader is not None:
+            self.reader.cancel()
+            try:
+                await self.reader
+            except asyncio.CancelledError:
+                pass
+        if self.pubsub is not None:
+            await self.pubsub.aclose()
+        await self.client.aclose()
+        self.loop = None
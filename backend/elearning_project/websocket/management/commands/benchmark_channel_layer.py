@@ -0,0 +1,77 @@
+import asyncio
+import statistics
+import time
+from contextlib import nullcontext
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from websocket.hub import running_hub
+from websocket.layers import PubSubChannelLayer
+
+
+async def measure(sender, receiver, members, rounds):
+    """Time `rounds` group sends to `members` channels, until the last
+    channel received the message
+
+    Returns:
+        list: latencies in seconds
+    """
+    channels = [await receiver.new_channel() for _ in range(members)]
+    for channel in channels:
+        await receiver.group_add("benchmark", channel)
+    message = {"type": "chat.message", "data": {"action": "chat_message"}}
+    latencies = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        await sender.group_send("benchmark", message)
+        await asyncio.gather(*(receiver.receive(channel) for channel in channels))
+        latencies.append(time.perf_counter() - start)
+    for channel in channels:
+        await receiver.group_discard("benchmark", channel)
+    return latencies
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the group fan-out latency of the in memory channel layer "
+        "with the pub/sub layer, against a spawned hub by default"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--members",
+            type=int,
+            nargs="+",
+            default=[10, 100, 1000],
+            help="Group sizes to measure",
+        )
+        parser.add_argument("--rounds", type=int, default=50)
+        parser.add_argument(
+            "--url", help="redis:// or unix:// url of a running server to use"
+        )
+
+    def handle(self, *args, **options):
+        with nullcontext(options["url"]) if options["url"] else running_hub() as url:
+            asyncio.run(self.run(url, options["members"], options["rounds"]))
+
+    async def run(self, url, group_sizes, rounds):
+        memory = InMemoryChannelLayer(capacity=rounds + 1)
+        # one layer per side, as the sending and receiving worker processes
+        sender = PubSubChannelLayer(url, capacity=rounds + 1)
+        receiver = PubSubChannelLayer(url, capacity=rounds + 1)
+        self.stdout.write(f"{'layer':<8}{'members':>8}{'median ms':>12}{'p95 ms':>10}")
+        for members in group_sizes:
+            for name, layers in (
+                ("memory", (memory, memory)),
+                ("pubsub", (sender, receiver)),
+            ):
+                latencies = await measure(*layers, members, rounds)
+                self.stdout.write(
+                    f"{name:<8}{members:>8}"
+                    f"{statistics.median(latencies) * 1000:>12.3f}"
+                    f"{statistics.quantiles(latencies, n=20)[-1] * 1000:>10.3f}"
+                )
+        await sender.close()
+        await receiver.close()
+        self.stdout.write(self.style.SUCCESS("Done"))
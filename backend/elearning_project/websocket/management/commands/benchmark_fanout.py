@@ -0,0 +1,127 @@
+import asyncio
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from websocket.views import ChatConsumer, frame_event
+
+
+def make_message(number):
+    """Return a chat message as rendered for a broadcast"""
+    now = timezone.now().isoformat()
+    return {
+        "id": None,
+        "text": f"Message {number} " + "lorem ipsum dolor sit amet " * 8,
+        "messageType": "text",
+        "createdAt": now,
+        "updatedAt": now,
+        "chatGroup": 1,
+        "removedAt": None,
+        "isDeletedBySender": False,
+        "isDeletedByAdmin": False,
+        "isRead": False,
+        "seq": number,
+        "user": {
+            "id": 1,
+            "email": "sally@example.com",
+            "firstName": "Sally",
+            "lastName": "Doe",
+            "avatar": "https://example.com/avatars/sally.png",
+            "bio": "Instructor",
+            "title": "Dr",
+        },
+        "files": [
+            {
+                "id": None,
+                "fileName": "slides.pdf",
+                "url": "https://example.com/files/slides.pdf",
+                "fileType": "document",
+                "thumbnailUrl": "",
+                "createdAt": now,
+            }
+        ],
+    }
+
+
+async def send_per_socket(consumer, event):
+    # the handler before frames: each socket encodes the event data again
+    await consumer.send(text_data=json.dumps({**event["data"]}))
+
+
+async def send_frame(consumer, event):
+    await consumer.send_frame(event)
+
+
+async def discard(message):
+    pass
+
+
+async def measure(members, rounds, make_event, handler):
+    """Run `rounds` broadcasts to `members` consumers whose sockets discard
+    the frames. Each event is handed to every consumer as is, as
+    `PubSubChannelLayer` does with the local members of a group, so that
+    only the sender and the handlers are measured
+
+    Returns:
+        float: CPU seconds per broadcast
+    """
+    consumers = []
+    for _ in range(members):
+        consumer = ChatConsumer()
+        consumer.base_send = discard
+        consumers.append(consumer)
+
+    start = time.process_time()
+    for number in range(rounds):
+        event = make_event(make_message(number))
+        for consumer in consumers:
+            await handler(consumer, event)
+    return (time.process_time() - start) / rounds
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the CPU time of a chat message broadcast per member count, "
+        "frames encoded once versus encoded per socket"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--members",
+            type=int,
+            nargs="+",
+            default=[10, 100, 1000, 3000],
+            help="Group sizes to measure",
+        )
+        parser.add_argument("--rounds", type=int, default=20)
+
+    def handle(self, *args, **options):
+        asyncio.run(self.run(options["members"], options["rounds"]))
+
+    async def run(self, group_sizes, rounds):
+        self.stdout.write(
+            f"{'members':>8}{'per socket ms':>16}{'encode once ms':>16}{'speedup':>10}"
+        )
+        for members in group_sizes:
+            per_socket = await measure(
+                members,
+                rounds,
+                lambda data: {
+                    "type": "chat.message",
+                    "data": {"action": "chat_message", "data": data},
+                },
+                send_per_socket,
+            )
+            once = await measure(
+                members,
+                rounds,
+                lambda data: frame_event("chat.message", "chat_message", data),
+                send_frame,
+            )
+            self.stdout.write(
+                f"{members:>8}{per_socket * 1000:>16.3f}{once * 1000:>16.3f}"
+                f"{per_socket / once if once else 0:>9.1f}x"
+            )
+        self.stdout.write(self.style.SUCCESS("Done"))
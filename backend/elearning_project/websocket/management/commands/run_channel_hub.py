@@ -0,0 +1,29 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from websocket.hub import serve
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve the pub/sub hub shared by the websocket worker processes of "
+        "one host, see websocket.hub"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--socket", help="Unix socket to listen on")
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=6380)
+
+    def handle(self, *args, **options):
+        where = options["socket"] or f"{options['host']}:{options['port']}"
+        self.stdout.write(self.style.SUCCESS(f"Channel hub listening on {where}"))
+        try:
+            asyncio.run(
+                serve(
+                    path=options["socket"], host=options["host"], port=options["port"]
+                )
+            )
+        except KeyboardInterrupt:
+            pass
@@ -1,16 +1,35 @@
-from django.db import close_old_connections
-from rest_framework_simplejwt.tokens import UntypedToken
-from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
-from jwt import decode as jwt_decode
-from django.conf import settings
 from urllib.parse import parse_qs
 
-from .utils import get_user
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import UntypedToken
+
+from .users import user_snapshots
+
+
+def get_token_user_id(scope):
+    """Verify the `token` query param of a connection, decoding it once
+
+    Returns:
+        int: id of the user of a valid token, None otherwise
+    """
+    try:
+        token = parse_qs(scope["query_string"].decode("utf8"))["token"][0]
+        return int(UntypedToken(token)[api_settings.USER_ID_CLAIM])
+    except (KeyError, IndexError, TypeError, ValueError, TokenError):
+        return None
 
 
 class WebsocketAuthMiddleware:
     """
-    Custom token auth middleware
+    Custom token auth middleware: connections without a valid token are
+    closed before any database work, users are read through the
+    `user_snapshots` cache, with their rendered card as `scope["user_card"]`.
+
+    The user is loaded when connecting rather than lazily on first use, so
+    that unknown and inactive users are turned away before the consumer
+    accepts them, and every consumer needs the user at connect time anyway.
+    Through the cache this costs no query for a user connected recently.
     """
 
     def __init__(self, app):
@@ -18,39 +37,15 @@ class WebsocketAuthMiddleware:
         self.app = app
 
     async def __call__(self, scope, receive, send):
-
-        # Close old database connections to prevent usage of timed out connections
-        close_old_connections()
-
-        # Get the token
-        try:
-            token = parse_qs(scope["query_string"].decode("utf8"))["token"][0]
-        except Exception:
-            # user did not give us token
-            token = "fake-token"
-        # Try to authenticate the user
-        try:
-            # This will automatically validate the token and raise an error if token is invalid
-            UntypedToken(token)
-        except (InvalidToken, TokenError):
-            # Token is invalid
-            # close the connection
+        user_id = get_token_user_id(scope)
+        snapshot = None
+        if user_id is not None:
+            snapshot = await user_snapshots.get(user_id)
+        if snapshot is None:
+            # no token, invalid token or unknown user, close the connection
             await send({"type": "websocket.close", "code": 1000})
-            scope["user"] = await get_user(id=None)
-        else:
-            #  Then token is valid, decode it
-            decoded_data = jwt_decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-            # Will return a dictionary like -
-            # {
-            #     "token_type": "access",
-            #     "exp": 1568770772,
-            #     "jti": "5c15e80d65b04c20ad34d77b6703251b",
-            #     "user_id": 6
-            #     "name": "Naman Mathur"
-            # }
-
-            # Get the user using ID
-            scope["user"] = await get_user(id=int(decoded_data["user_id"]))
+            return
+        scope["user"], scope["user_card"] = snapshot
 
         # Return the inner application directly and let it run everything else
         return await self.app(scope, receive, send)
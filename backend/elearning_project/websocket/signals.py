@@ -0,0 +1,22 @@
+from django.dispatch import receiver
+from django.db.models.signals import post_delete, post_save
+
+from accounts.models import User, UserProfile
+from websocket.users import user_snapshots
+
+__all__ = [
+    "forget_user_snapshot",
+    "forget_profile_snapshot",
+]
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_user_snapshot(sender, instance, *args, **kwargs):
+    user_snapshots.forget(instance.pk)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def forget_profile_snapshot(sender, instance, *args, **kwargs):
+    user_snapshots.forget(instance.user_id)
@@ -0,0 +1,440 @@
+import asyncio
+import json
+from unittest import mock
+
+from channels.db import database_sync_to_async
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TransactionTestCase
+from django.utils.dateparse import parse_datetime
+from model_mommy import mommy
+from redis.exceptions import ConnectionError as RedisConnectionError
+from rest_framework.exceptions import ValidationError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chat.models import ChatGroup, ChatMembership, ChatMessage, MessageFile
+from core.tests import BaseTestCaseMixin
+from websocket.hub import running_hub
+from websocket.indicators import TypingIndicators
+from websocket.layers import PubSubChannelLayer
+from websocket.middleware import WebsocketAuthMiddleware
+from websocket.users import load_snapshot, user_snapshots
+from websocket.utils import load_history
+from websocket.views import ChatConsumer, frame_event
+from websocket.writer import MessageWriter
+
+
+class PubSubChannelLayerTestCase(SimpleTestCase):
+    """Two layers stand for two worker processes sharing a spawned hub"""
+
+    @classmethod
+    def setUpClass(cls):
+        super(PubSubChannelLayerTestCase, cls).setUpClass()
+        cls.hub = running_hub()
+        cls.url = cls.hub.__enter__()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.hub.__exit__(None, None, None)
+        super(PubSubChannelLayerTestCase, cls).tearDownClass()
+
+    async def receive(self, layer, channel, timeout=2):
+        return await asyncio.wait_for(layer.receive(channel), timeout)
+
+    async def test_group_send_reaches_every_process(self):
+        first, second = PubSubChannelLayer(self.url), PubSubChannelLayer(self.url)
+        channels = [await first.new_channel(), await second.new_channel()]
+        await first.group_add("chat_1", channels[0])
+        await second.group_add("chat_1", channels[1])
+
+        await first.group_send("chat_1", {"type": "chat.message", "text": "hi"})
+        self.assertEqual(
+            await self.receive(first, channels[0]),
+            {"type": "chat.message", "text": "hi"},
+        )
+        self.assertEqual((await self.receive(second, channels[1]))["text"], "hi")
+
+        await second.group_discard("chat_1", channels[1])
+        self.assertNotIn("chat_1", second.groups)
+        await first.group_send("chat_1", {"type": "chat.message", "text": "bye"})
+        self.assertEqual((await self.receive(first, channels[0]))["text"], "bye")
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.receive(second, channels[1], timeout=0.2)
+        await first.close()
+        await second.close()
+
+    async def test_send_to_a_channel_of_another_process(self):
+        first, second = PubSubChannelLayer(self.url), PubSubChannelLayer(self.url)
+        channel = await second.new_channel()
+        await first.send(channel, {"type": "chat.read"})
+        self.assertEqual(await self.receive(second, channel), {"type": "chat.read"})
+        await first.close()
+        await second.close()
+
+    async def test_closed_consumer_leaves_its_groups(self):
+        layer = PubSubChannelLayer(self.url)
+        channel = await layer.new_channel()
+        await layer.group_add("chat_1", channel)
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.receive(layer, channel, timeout=0.1)
+        self.assertEqual(layer.groups, {})
+        self.assertNotIn(channel, layer.channels)
+        await layer.close()
+
+    async def test_malformed_messages_are_dropped(self):
+        first, second = PubSubChannelLayer(self.url), PubSubChannelLayer(self.url)
+        channel = await second.new_channel()
+        topic = second.channel_topic(channel)
+        with self.assertLogs("websocket.layers", "ERROR") as logs:
+            await first.publish(topic, "not a payload")
+            await first.client.publish(topic, b"{not json")
+            # published after the malformed ones, read once they are dropped
+            await first.send(channel, {"type": "chat.read"})
+            self.assertEqual(await self.receive(second, channel), {"type": "chat.read"})
+        self.assertEqual(len(logs.records), 2)
+        await first.close()
+        await second.close()
+
+    async def test_failed_first_subscribe_is_rolled_back(self):
+        first, second = PubSubChannelLayer(self.url), PubSubChannelLayer(self.url)
+        with mock.patch(
+            "redis.asyncio.client.PubSub.subscribe", side_effect=RedisConnectionError
+        ):
+            with self.assertRaises(RedisConnectionError):
+                await first.new_channel()
+        self.assertIsNone(first.pubsub)
+        self.assertEqual(first.subscribed, set())
+
+        channel = await first.new_channel()
+        self.assertIsNotNone(first.reader)
+        await second.send(channel, {"type": "chat.read"})
+        self.assertEqual(await self.receive(first, channel), {"type": "chat.read"})
+        await first.close()
+        await second.close()
+
+    async def test_reader_reconnects_and_subscribes_again(self):
+        first, second = PubSubChannelLayer(self.url), PubSubChannelLayer(self.url)
+        channel = await first.new_channel()
+        await first.group_add("chat_1", channel)
+        pubsub = first.pubsub
+        with self.assertLogs("websocket.layers", "ERROR"):
+            await pubsub.connection.disconnect()
+            for _ in range(50):
+                if first.pubsub is not pubsub and first.pubsub.subscribed:
+                    break
+                await asyncio.sleep(0.05)
+        self.assertEqual(
+            set(first.pubsub.channels), {topic.encode() for topic in first.subscribed}
+        )
+        await second.group_send("chat_1", {"type": "chat.message", "text": "back"})
+        self.assertEqual((await self.receive(first, channel))["text"], "back")
+        await first.close()
+        await second.close()
+
+
+class MessageWriterTestCase(BaseTestCaseMixin, TransactionTestCase):
+    """Database work runs on the thread of `database_sync_to_async`, outside
+    of the transaction of a `TestCase`"""
+
+    def setUp(self):
+        super(MessageWriterTestCase, self).setUp()
+        self.chat_group = mommy.make(
+            "chat.ChatGroup", course=mommy.make("courses.Course")
+        )
+        for user in (self.roger_user, self.sally_user):
+            ChatMembership.objects.create(chat_group=self.chat_group, user=user)
+        self.statuses = []
+
+    async def notify(self, chat_group_id, status, messages):
+        self.statuses.append((chat_group_id, status, messages))
+
+    async def test_messages_are_broadcast_first_and_written_in_batches(self):
+        writer = MessageWriter(notify=self.notify, interval=60)
+        sent = [
+            await writer.submit(
+                self.chat_group.pk,
+                user,
+                {
+                    "text": f"hello {number}",
+                    "files": [{"url": "https://example.com/a.png"}] * (number == 0),
+                    "client_id": f"client-{number}",
+                },
+                user_card={"id": user.pk},
+            )
+            for number, user in enumerate(
+                [self.roger_user, self.sally_user, self.roger_user]
+            )
+        ]
+        self.assertEqual([message["seq"] for message in sent], [None] * 3)
+        self.assertEqual([message["id"] for message in sent], [None] * 3)
+        self.assertEqual(
+            [message["clientId"] for message in sent],
+            ["client-0", "client-1", "client-2"],
+        )
+        self.assertEqual(sent[0]["user"], {"id": self.roger_user.pk})
+        self.assertEqual(sent[0]["files"][0]["url"], "https://example.com/a.png")
+        self.assertEqual(await ChatMessage.objects.acount(), 0)
+
+        await writer.close()
+        messages = [message async for message in ChatMessage.objects.order_by("seq")]
+        self.assertEqual(
+            [message.text for message in messages], [m["text"] for m in sent]
+        )
+        self.assertEqual([message.seq for message in messages], [1, 2, 3])
+        self.assertEqual(await messages[0].files.acount(), 1)
+        self.assertEqual(len(self.statuses), 1)
+        chat_group_id, status, saved = self.statuses[0]
+        self.assertEqual((chat_group_id, status), (self.chat_group.pk, "saved"))
+        self.assertEqual(
+            [(item["client_id"], item["seq"], item["id"]) for item in saved],
+            [
+                (f"client-{number}", message.seq, message.pk)
+                for number, message in enumerate(messages)
+            ],
+        )
+        self.assertEqual(parse_datetime(saved[0]["created_at"]), messages[0].created_at)
+        chat_group = await ChatGroup.objects.aget(pk=self.chat_group.pk)
+        self.assertEqual(chat_group.last_message_id, messages[-1].pk)
+        self.assertEqual(chat_group.message_seq, 3)
+        unread = {
+            membership.user_id: membership.unread_messages
+            async for membership in ChatMembership.objects.filter(
+                chat_group=self.chat_group
+            )
+        }
+        self.assertEqual(unread, {self.roger_user.pk: 1, self.sally_user.pk: 2})
+
+    async def test_invalid_messages_are_rejected_before_queueing(self):
+        writer = MessageWriter(notify=self.notify, interval=60)
+        with self.assertRaises(ValidationError):
+            await writer.submit(
+                self.chat_group.pk, self.roger_user, {"message_type": "unknown"}
+            )
+        with self.assertRaises(ValidationError):
+            await writer.submit(
+                self.chat_group.pk, self.roger_user, {"text": "hi", "client_id": 1}
+            )
+        with self.assertRaises(ChatGroup.DoesNotExist):
+            await writer.submit(0, self.roger_user, {"text": "hello"})
+        self.assertEqual(writer.pending, [])
+
+    async def test_failed_writes_are_retried_then_reported(self):
+        writer = MessageWriter(
+            notify=self.notify, interval=60, retries=1, retry_delay=0
+        )
+        await writer.submit(self.chat_group.pk, self.roger_user, {"text": "hello"})
+        with mock.patch.object(
+            ChatMessage.objects, "bulk_insert", side_effect=DatabaseError
+        ):
+            await writer.close()
+        chat_group_id, status, failed = self.statuses[0]
+        self.assertEqual((chat_group_id, status), (self.chat_group.pk, "failed"))
+        self.assertEqual([(item["seq"], item["id"]) for item in failed], [(None, None)])
+
+        bulk_insert = ChatMessage.objects.bulk_insert
+        attempts = []
+
+        def fail_once(*args, **kwargs):
+            attempts.append(args)
+            if len(attempts) == 1:
+                raise DatabaseError
+            return bulk_insert(*args, **kwargs)
+
+        await writer.submit(self.chat_group.pk, self.roger_user, {"text": "again"})
+        with mock.patch.object(ChatMessage.objects, "bulk_insert", fail_once):
+            await writer.close()
+        self.assertEqual(len(attempts), 2)
+        message = await ChatMessage.objects.aget()
+        chat_group_id, status, saved = self.statuses[-1]
+        self.assertEqual(status, "saved")
+        self.assertEqual(
+            [(item["seq"], item["id"]) for item in saved], [(1, message.pk)]
+        )
+
+        # fail after the files are inserted, and let another message take
+        # the id freed by the rollback before the retry
+        count_unread_many = ChatMembership.objects.count_unread_many
+        attempts = []
+
+        def fail_after_files(*args, **kwargs):
+            attempts.append(args)
+            if len(attempts) == 1:
+                raise DatabaseError
+            return count_unread_many(*args, **kwargs)
+
+        def take_freed_id(*args, **kwargs):
+            if attempts:
+                ChatMessage.objects.create(
+                    chat_group=self.chat_group, user=self.sally_user, text="other"
+                )
+            return bulk_insert(*args, **kwargs)
+
+        await writer.submit(
+            self.chat_group.pk,
+            self.roger_user,
+            {"text": "attached", "files": [{"url": "https://example.com/a.png"}]},
+        )
+        with mock.patch.object(
+            ChatMembership.objects, "count_unread_many", fail_after_files
+        ), mock.patch.object(ChatMessage.objects, "bulk_insert", take_freed_id):
+            await writer.close()
+        self.assertEqual(self.statuses[-1][1], "saved")
+        message = await ChatMessage.objects.aget(text="attached")
+        files = [file async for file in MessageFile.objects.all()]
+        self.assertEqual([file.message_id for file in files], [message.pk])
+
+    async def test_messages_are_numbered_in_write_order(self):
+        """
+        Test if messages sent over the endpoint while others wait to be
+        written are numbered and dated before them, as they are written
+        """
+        writer = MessageWriter(notify=self.notify, interval=60)
+        await writer.submit(self.chat_group.pk, self.roger_user, {"text": "queued"})
+        await ChatMessage.objects.acreate(
+            chat_group=self.chat_group, user=self.sally_user, text="endpoint"
+        )
+        await writer.close()
+        for ordering in (["created_at", "pk"], ["seq"]):
+            texts = [
+                text
+                async for text in ChatMessage.objects.order_by(*ordering).values_list(
+                    "text", flat=True
+                )
+            ]
+            self.assertEqual(texts, ["endpoint", "queued"])
+        chat_group = await ChatGroup.objects.select_related("last_message").aget(
+            pk=self.chat_group.pk
+        )
+        self.assertEqual(chat_group.last_message.text, "queued")
+        self.assertEqual(chat_group.message_seq, 2)
+
+
+class ChatConsumerFrameTestCase(SimpleTestCase):
+    async def test_group_events_are_encoded_once(self):
+        sent = []
+
+        async def base_send(message):
+            sent.append(message)
+
+        consumers = [ChatConsumer() for _ in range(3)]
+        for consumer in consumers:
+            consumer.base_send = base_send
+        with mock.patch("websocket.views.json.dumps", wraps=json.dumps) as dumps:
+            event = frame_event("chat.message", "chat_message", {"text": "hi"})
+            for consumer in consumers:
+                await consumer.chat_message(event)
+        self.assertEqual(dumps.call_count, 1)
+        self.assertEqual([message["text"] for message in sent], [event["frame"]] * 3)
+        self.assertEqual(
+            json.loads(event["frame"]),
+            {"action": "chat_message", "data": {"text": "hi"}},
+        )
+
+    async def test_invalid_read_seq_is_answered_with_an_error(self):
+        """
+        Test if a non numeric read watermark is rejected without closing the
+        connection
+        """
+        sent = []
+
+        async def base_send(message):
+            sent.append(message)
+
+        consumer = ChatConsumer()
+        consumer.base_send = base_send
+        consumer.chat_id, consumer.user = "1", mock.Mock()
+        with mock.patch("websocket.views.mark_read") as mark_read:
+            await consumer.receive(
+                json.dumps({"action": "chat_read", "data": {"seq": "abc"}})
+            )
+        mark_read.assert_not_called()
+        self.assertEqual(
+            json.loads(sent[0]["text"]),
+            {"action": "chat_read", "data": None, "error": "seq must be an integer"},
+        )
+
+
+class TypingIndicatorsTestCase(SimpleTestCase):
+    async def test_typing_events_are_coalesced_per_window(self):
+        sent = []
+
+        async def send(group_name, users):
+            sent.append((group_name, [user["id"] for user in users]))
+
+        indicators = TypingIndicators(send=send, interval=0.05)
+        roger, sally = {"id": 1}, {"id": 2}
+        for user in (roger, roger, sally, roger):
+            await indicators.add("chat_1", user)
+        await indicators.add("chat_2", sally)
+        self.assertEqual(sent, [("chat_1", [1]), ("chat_2", [2])])
+
+        await asyncio.gather(*indicators.tasks.values())
+        self.assertEqual(sent[2:], [("chat_1", [1, 2])])
+        self.assertEqual(indicators.windows, {})
+
+
+class WebsocketAuthMiddlewareTestCase(BaseTestCaseMixin, TransactionTestCase):
+    def setUp(self):
+        super(WebsocketAuthMiddlewareTestCase, self).setUp()
+        user_snapshots.clear()
+        self.app = mock.AsyncMock()
+        self.middleware = WebsocketAuthMiddleware(self.app)
+
+    async def connect(self, token):
+        scope = {"type": "websocket", "query_string": f"token={token}".encode()}
+        send = mock.AsyncMock()
+        await self.middleware(scope, mock.AsyncMock(), send)
+        return scope, send
+
+    def get_token(self, user):
+        return str(AccessToken.for_user(user))
+
+    async def test_invalid_token_is_closed_before_any_query(self):
+        with mock.patch("websocket.users.load_snapshot") as load_snapshot:
+            scope, send = await self.connect("fake-token")
+        load_snapshot.assert_not_called()
+        self.app.assert_not_called()
+        send.assert_awaited_once_with({"type": "websocket.close", "code": 1000})
+
+    async def test_user_is_cached_until_saved(self):
+        token = self.get_token(self.roger_user)
+        with mock.patch("websocket.users.load_snapshot", wraps=load_snapshot) as mocked:
+            scope, send = await self.connect(token)
+            await asyncio.gather(self.connect(token), self.connect(token))
+            self.assertEqual(mocked.call_count, 1)
+
+            self.assertEqual(scope["user"], self.roger_user)
+            self.assertEqual(scope["user_card"]["id"], self.roger_user.pk)
+            self.assertEqual(self.app.await_count, 3)
+            send.assert_not_called()
+
+            self.roger_user.first_name = "Rog"
+            await database_sync_to_async(self.roger_user.save)()
+            scope, send = await self.connect(token)
+            self.assertEqual(mocked.call_count, 2)
+            self.assertEqual(scope["user"].first_name, "Rog")
+
+    async def test_inactive_user_is_rejected(self):
+        self.roger_user.is_active = False
+        await database_sync_to_async(self.roger_user.save)()
+        scope, send = await self.connect(self.get_token(self.roger_user))
+        self.app.assert_not_called()
+        send.assert_awaited_once_with({"type": "websocket.close", "code": 1000})
+
+
+class LoadHistoryTestCase(BaseTestCaseMixin, TransactionTestCase):
+    def setUp(self):
+        super(LoadHistoryTestCase, self).setUp()
+        self.chat_group = mommy.make(
+            "chat.ChatGroup", course=mommy.make("courses.Course")
+        )
+        ChatMembership.objects.create(chat_group=self.chat_group, user=self.roger_user)
+        ChatMessage.objects.create(chat_group=self.chat_group, text="hello")
+
+    async def test_history_is_only_loaded_by_members(self):
+        """
+        Test if the history of a chat is sent to its members only
+        """
+        history = await load_history(self.chat_group.pk, self.roger_user, {})
+        self.assertEqual([message["text"] for message in history["results"]], ["hello"])
+        with self.assertRaises(ChatMembership.DoesNotExist):
+            await load_history(self.chat_group.pk, self.sally_user, {})
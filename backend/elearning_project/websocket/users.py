@@ -0,0 +1,83 @@
+import asyncio
+import time
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+from accounts.models import User
+from accounts.serializers import UserMinimalSerializer
+from core.utils import camelize
+
+__all__ = [
+    "UserSnapshotCache",
+    "user_snapshots",
+]
+
+
+def load_snapshot(user_id):
+    """Return an active user with its profile and rendered card, None when
+    there is no such user"""
+    user = (
+        User.objects.select_related("profile")
+        .filter(pk=user_id, is_active=True)
+        .first()
+    )
+    if user is None:
+        return None
+    return user, camelize(UserMinimalSerializer(user.profile).data)
+
+
+class UserSnapshotCache:
+    """
+    Short lived, per process cache of the users of websocket connections,
+    so that a storm of reconnections does not become a storm of queries.
+    Entries live `ttl` seconds and are dropped when the user or its profile
+    is saved in this process, see `websocket.signals`; other processes see
+    the change once their entry expires. Concurrent loads of one user run
+    a single query.
+    """
+
+    def __init__(self, ttl=None, max_size=10000):
+        self.ttl = settings.WEBSOCKET_USER_CACHE_TTL if ttl is None else ttl
+        self.max_size = max_size
+        # user id -> (expiry, snapshot)
+        self.entries = {}
+        self.loading = {}
+        # bumped on every invalidation, loads started before are not kept
+        self.generation = 0
+
+    async def get(self, user_id):
+        """
+        Returns:
+            tuple: user and rendered card, None for unknown or inactive users
+        """
+        entry = self.entries.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        task = self.loading.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self.load(user_id))
+            self.loading[user_id] = task
+            task.add_done_callback(lambda _: self.loading.pop(user_id, None))
+        return await asyncio.shield(task)
+
+    async def load(self, user_id):
+        generation = self.generation
+        snapshot = await database_sync_to_async(load_snapshot)(user_id)
+        if snapshot is not None and generation == self.generation:
+            if len(self.entries) >= self.max_size:
+                # oldest first
+                self.entries.pop(next(iter(self.entries)))
+            self.entries[user_id] = (time.monotonic() + self.ttl, snapshot)
+        return snapshot
+
+    def forget(self, user_id):
+        self.generation += 1
+        self.entries.pop(user_id, None)
+
+    def clear(self):
+        self.generation += 1
+        self.entries.clear()
+
+
+user_snapshots = UserSnapshotCache()
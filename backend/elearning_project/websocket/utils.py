@@ -1,33 +1,52 @@
 from channels.db import database_sync_to_async
-from accounts.models import User
+from chat.archive import ChatArchive
+from chat.history import get_history
+from chat.models import ChatMembership, ChatMessage
 from chat.serializers import ChatMessageSerializer
 from accounts.serializers import UserMinimalSerializer
 from core.utils import camelize
 
 
 @database_sync_to_async
-def get_user(**kwargs):
-    user = User.objects.filter(**kwargs).first()
-    return user or None
+def mark_read(chat_group, user, seq=None):
+    state = ChatMembership.objects.mark_read(chat_group, user, seq)
+    if state is None:
+        return None
+    return camelize(
+        {
+            **state,
+            "chat_group": int(chat_group),
+            "last_read": state["last_read"].isoformat(),
+        }
+    )
 
 
 @database_sync_to_async
-def save_message(data):
-    user = data["user"]
-    chat_membership = user.chat_memberships.filter(
-        chat_group=data["chat_group"]
-    ).first()
+def load_history(chat_group, user, params):
+    """
+    Same windows as the `?before=`, `?after=` and `?around=` params of the
+    message list, see `chat.history`
+
+    Raises:
+        ChatMembership.DoesNotExist: when `user` is not a member of the chat
+    """
+    chat_membership = user.chat_memberships.filter(chat_group=chat_group).first()
+    if chat_membership is None:
+        raise ChatMembership.DoesNotExist("You are not a member of this chat")
+    queryset = (
+        ChatMessage.objects.filter(chat_group=chat_group)
+        .select_related("user__profile")
+        .prefetch_related("files")
+    )
+    history = get_history(queryset, params, archive=ChatArchive(chat_group))
     context = {
-        "last_read": chat_membership.last_read if chat_membership else None,
+        "last_read_seq": chat_membership.last_read_message_seq,
         "user": user,
     }
-    data["user"] = user.pk if user else None
-    serializer = ChatMessageSerializer(data=data, context=context)
-    serializer.is_valid(raise_exception=True)
-    # this will create the post
-    x = serializer.create(serializer.validated_data)
-    # this will return the serialized post data
-    return camelize(ChatMessageSerializer(x).data)
+    history["results"] = ChatMessageSerializer(
+        history["results"], many=True, context=context
+    ).data
+    return camelize(history)
 
 
 @database_sync_to_async
@@ -1,15 +1,66 @@
+import atexit
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.layers import get_channel_layer
+from rest_framework.exceptions import ValidationError
 
-from .utils import save_message, serialize_user
+from chat.models import ChatGroup, ChatMembership, ChatMessage
+from core.utils import camelize
+
+from .indicators import TypingIndicators
+from .utils import load_history, mark_read, serialize_user
+from .writer import MessageWriter
+
+
+def get_group_name(chat_id):
+    return "chat_%s" % chat_id
+
+
+def frame_event(event_type, action, data):
+    """Return a group event carrying the websocket frame of `action`, encoded
+    once by the sender and sent unchanged to every member. Frames are the
+    same for all members: per connection state, eg. read watermarks, is sent
+    to one connection at a time"""
+    return {"type": event_type, "frame": json.dumps({"action": action, "data": data})}
+
+
+async def notify_message_status(chat_group_id, status, messages):
+    # messages are broadcast with a temporary client id before they are
+    # written, tell the chat once they are saved with their ids, numbers and
+    # dates, or could not be
+    await get_channel_layer().group_send(
+        get_group_name(chat_group_id),
+        frame_event(
+            "chat.status",
+            "chat_message_status",
+            camelize(
+                {"chat_group": chat_group_id, "status": status, "messages": messages}
+            ),
+        ),
+    )
+
+
+async def send_typing_users(group_name, users):
+    await get_channel_layer().group_send(
+        group_name, frame_event("chat.typing", "chat_typing", {"users": users})
+    )
+
+
+message_writer = MessageWriter(notify=notify_message_status)
+atexit.register(message_writer.flush_pending)
+typing_indicators = TypingIndicators(send=send_typing_users)
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.chat_id = self.scope["url_route"]["kwargs"]["chat_id"]
-        self.chat_group_name = "chat_%s" % self.chat_id
+        self.chat_group_name = get_group_name(self.chat_id)
         # current authorised user
         self.user = self.scope["user"]
+        # rendered once, sent with each message and typing event
+        self.user_card = self.scope.get("user_card")
+        if self.user and self.user_card is None:
+            self.user_card = await serialize_user(self.user)
 
         # Join chat group
         await self.channel_layer.group_add(self.chat_group_name, self.channel_name)
@@ -29,46 +80,84 @@ class ChatConsumer(AsyncWebsocketConsumer):
         so all json data should be in snake_case
         """
         payload = json.loads(text_data)
-        action = payload.get("action")
-        data = payload.get("data")
-        if action == "chat_typing":
-            typing_user = None
-            if self.user:
-                typing_user = await serialize_user(self.user)
-
-            await self.channel_layer.group_send(
-                self.chat_group_name,
-                {
-                    "type": "chat.typing",
-                    "data": {"action": action, "data": {"user": typing_user}},
-                },
-            )
+        handlers = {
+            "chat_typing": self.receive_typing,
+            "chat_history": self.receive_history,
+            "chat_read": self.receive_read,
+        }
+        # any other action is a chat_message
+        handler = handlers.get(payload.get("action"), self.receive_message)
+        await handler(payload.get("data"))
+
+    async def receive_typing(self, data):
+        # throttled and coalesced per chat, no database access
+        if self.user_card:
+            await typing_indicators.add(self.chat_group_name, self.user_card)
+
+    async def receive_history(self, data):
+        # infinite scroll, answered to this connection only
+        if not self.user:
             return
+        try:
+            history = await load_history(self.chat_id, self.user, data or {})
+        except ValueError as exc:
+            history, error = None, str(exc)
+        except ChatMessage.DoesNotExist:
+            history, error = None, "Message not found"
+        except ChatMembership.DoesNotExist as exc:
+            history, error = None, str(exc)
         else:
-            # action == 'chat_message'
-            chat_group = self.chat_id
-            data = {**data, "chat_group": chat_group}
-
-            if self.user:
-                data = {**data, "user": self.user}
-                data = await save_message(data)
-
-            # Send message to chat group
-            await self.channel_layer.group_send(
-                self.chat_group_name,
-                {
-                    "type": "chat.message",
-                    "data": {"action": "chat_message", "data": data},
-                },
+            error = None
+        await self.send(
+            text_data=json.dumps(
+                {"action": "chat_history", "data": history, "error": error}
             )
+        )
+
+    async def receive_read(self, data):
+        # read state is private to the reader, nothing is broadcast
+        if not self.user:
+            return
+        seq = (data or {}).get("seq")
+        try:
+            seq = None if seq in (None, "") else int(seq)
+        except (TypeError, ValueError):
+            await self.send_error("chat_read", "seq must be an integer")
+            return
+        data = await mark_read(self.chat_id, self.user, seq)
+        await self.send(text_data=json.dumps({"action": "chat_read", "data": data}))
+
+    async def receive_message(self, data):
+        chat_group = self.chat_id
+        data = {**data, "chat_group": chat_group}
+
+        if self.user:
+            # broadcast now, numbered and written in the background
+            try:
+                data = await message_writer.submit(
+                    chat_group, self.user, data, self.user_card
+                )
+            except ValidationError as exc:
+                await self.send_error("chat_message", exc.detail)
+                return
+            except (ChatGroup.DoesNotExist, ValueError):
+                await self.send_error("chat_message", "Chat not found")
+                return
+
+        # Send message to chat group, unread by every member so far
+        await self.channel_layer.group_send(
+            self.chat_group_name, frame_event("chat.message", "chat_message", data)
+        )
+
+    async def send_error(self, action, error):
+        await self.send(
+            text_data=json.dumps({"action": action, "data": None, "error": error})
+        )
 
-    async def chat_message(self, event):
-        # Receive message from chat group
-        data = event["data"]
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({**data}))
+    async def send_frame(self, event):
+        # Receive a frame from the chat group, encoded once by its sender,
+        # see `frame_event`
+        await self.send(text_data=event["frame"])
 
-    async def chat_typing(self, event):
-        # Rceive user typing
-        data = event["data"]
-        await self.send(text_data=json.dumps({**data}))
+    # messages, typing users and write status of messages
+    chat_message = chat_typing = chat_status = send_frame
@@ -0,0 +1,266 @@
+import asyncio
+import logging
+import uuid
+from collections import defaultdict
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+from chat.models import ChatGroup, ChatMessage, MessageFile
+from chat.serializers import ChatMessageSerializer, MessageFileSerializer
+from core.utils import camelize
+
+__all__ = [
+    "MessageWriter",
+]
+
+logger = logging.getLogger(__name__)
+
+
+# longest temporary id a client may give its message
+CLIENT_ID_MAX_LENGTH = 64
+
+
+def check_chat_group(chat_group_id):
+    """
+    Raises:
+        DoesNotExist: when the chat group does not exist
+    """
+    if not ChatGroup.objects.filter(pk=chat_group_id).exists():
+        raise ChatGroup.DoesNotExist("ChatGroup matching query does not exist.")
+
+
+@transaction.atomic
+def write_group(chat_group_id, pending):
+    # the chat group stays locked from numbering to commit, so that the
+    # messages of every process and of the message endpoint are numbered
+    # and dated in the order they are written
+    try:
+        last_seq = ChatGroup.objects.next_message_seq(chat_group_id, len(pending))
+    except IndexError:
+        raise ChatGroup.DoesNotExist("ChatGroup matching query does not exist.")
+    now = timezone.now()
+    for seq, (message, files) in enumerate(pending, last_seq - len(pending) + 1):
+        message.seq = seq
+        message.created_at = message.updated_at = now
+        for file in files:
+            file.created_at = now
+    ChatMessage.objects.bulk_insert(
+        [message for message, _ in pending],
+        [file for _, files in pending for file in files],
+    )
+
+
+def write_groups(groups):
+    """Number and insert the pending messages of each chat group in its own
+    transaction
+
+    Returns:
+        list: ids of the chat groups whose messages could not be written
+    """
+    failed = []
+    for chat_group_id, pending in groups.items():
+        try:
+            write_group(chat_group_id, pending)
+        except (DatabaseError, ChatGroup.DoesNotExist):
+            logger.exception("Writing the messages of chat %s failed", chat_group_id)
+            # the rolled back rows keep the ids and numbers they were given,
+            # and the files the id of their message, which another message
+            # may take before the retry
+            for message, files in pending:
+                message.seq = None
+                for instance in (message, *files):
+                    instance.pk = None
+                    instance._state.adding = True
+                for file in files:
+                    file.message = message
+            failed.append(chat_group_id)
+    return failed
+
+
+class MessageWriter:
+    """
+    Write-behind persistence of the messages sent over websockets.
+
+    `submit` validates a message as the message endpoint does and returns
+    it rendered for the broadcast without waiting on the database, with a
+    temporary `client_id`, the one given by the client if any, instead of
+    an id and a sequence number. A background task inserts the pending
+    messages of every consumer of the process every `interval` seconds, or
+    as soon as `batch_size` are waiting, with one `bulk_insert` per chat
+    group, numbering and dating them while the chat group is locked. Failed
+    groups are retried `retries` times with a growing delay. `notify` is
+    awaited after each attempt with the chat group id, "saved" or "failed"
+    and the `client_id`, `seq`, `id` and `created_at` of its messages.
+    `flush_pending` writes what is left when the process exits.
+    """
+
+    def __init__(
+        self,
+        notify=None,
+        interval=None,
+        batch_size=None,
+        retries=None,
+        retry_delay=0.1,
+    ):
+        self.notify = notify
+        self.interval = settings.CHAT_WRITE_INTERVAL if interval is None else interval
+        self.batch_size = batch_size or settings.CHAT_WRITE_BATCH_SIZE
+        self.retries = settings.CHAT_WRITE_RETRIES if retries is None else retries
+        self.retry_delay = retry_delay
+        self.pending = []
+        # ids of the chat groups known to exist, checked once per process
+        self.chat_groups = set()
+        self.loop = None
+        self.wakeup = None
+        self.task = None
+
+    async def submit(self, chat_group_id, user, data, user_card=None):
+        """Queue a message of `user` and return it rendered, with its
+        `client_id` but without an id or sequence number until it is written
+
+        Raises:
+            ValidationError: on invalid message data
+            DoesNotExist: when the chat group does not exist
+        """
+        self.bind()
+        message, files = self.build(int(chat_group_id), user, data)
+        if message.chat_group_id not in self.chat_groups:
+            await database_sync_to_async(check_chat_group)(message.chat_group_id)
+            self.chat_groups.add(message.chat_group_id)
+        self.pending.append((message, files))
+        self.start()
+        if len(self.pending) >= self.batch_size:
+            self.wakeup.set()
+        return self.render(message, files, user_card)
+
+    def build(self, chat_group_id, user, data):
+        serializer = ChatMessageSerializer(
+            data=data, context={"user": user}, omit=["chat_group"]
+        )
+        serializer.is_valid(raise_exception=True)
+        client_id = data.get("client_id") or uuid.uuid4().hex
+        if not isinstance(client_id, str) or len(client_id) > CLIENT_ID_MAX_LENGTH:
+            raise ValidationError(
+                {
+                    "client_id": [
+                        f"Ensure this is a string of at most "
+                        f"{CLIENT_ID_MAX_LENGTH} characters."
+                    ]
+                }
+            )
+        # provisional until the message is written
+        now = timezone.now()
+        message = ChatMessage(
+            **serializer.validated_data,
+            chat_group_id=chat_group_id,
+            created_by=user,
+            created_at=now,
+            updated_at=now,
+        )
+        message.client_id = client_id
+        file_serializer = MessageFileSerializer(
+            data=data.get("files") or [], many=True, context={"message": message}
+        )
+        file_serializer.is_valid(raise_exception=True)
+        files = [
+            MessageFile(**attachment, created_at=now)
+            for attachment in file_serializer.validated_data
+        ]
+        return message, files
+
+    def render(self, message, files, user_card):
+        # related managers refuse unsaved messages, files are rendered aside
+        data = ChatMessageSerializer(message, omit=["user", "files"]).data
+        files = MessageFileSerializer(files, many=True).data
+        return camelize(
+            {**data, "client_id": message.client_id, "user": user_card, "files": files}
+        )
+
+    def bind(self):
+        # the task belongs to one event loop, eg. one per test
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop, self.task = loop, None
+
+    def start(self):
+        if self.task is None:
+            self.wakeup = asyncio.Event()
+            self.task = self.loop.create_task(self.run())
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+            if not self.pending:
+                # started again by the next `submit`
+                self.task = None
+                return
+
+    async def flush(self):
+        """Write the pending messages, `batch_size` at a time"""
+        while self.pending:
+            batch = self.pending[: self.batch_size]
+            del self.pending[: self.batch_size]
+            groups = defaultdict(list)
+            for message, files in batch:
+                groups[message.chat_group_id].append((message, files))
+            await self.write(groups)
+
+    async def write(self, groups):
+        for attempt in range(self.retries + 1):
+            failed = await database_sync_to_async(write_groups)(groups)
+            for chat_group_id in groups.keys() - set(failed):
+                await self.report(chat_group_id, "saved", groups[chat_group_id])
+            groups = {chat_group_id: groups[chat_group_id] for chat_group_id in failed}
+            if not groups:
+                return
+            if attempt < self.retries:
+                await asyncio.sleep(self.retry_delay * 2**attempt)
+        for chat_group_id, pending in groups.items():
+            await self.report(chat_group_id, "failed", pending)
+
+    async def report(self, chat_group_id, status, pending):
+        if self.notify is None:
+            return
+        created_at = serializers.DateTimeField()
+        messages = [
+            {
+                "client_id": message.client_id,
+                "seq": message.seq,
+                "id": message.pk,
+                "created_at": created_at.to_representation(message.created_at),
+            }
+            for message, _ in pending
+        ]
+        try:
+            await self.notify(chat_group_id, status, messages)
+        except Exception:
+            logger.exception("Reporting the messages of chat %s failed", chat_group_id)
+
+    async def close(self):
+        """Write the pending messages and wait for the background task"""
+        if self.task is not None and self.loop is asyncio.get_running_loop():
+            self.wakeup.set()
+            await self.task
+        await self.flush()
+
+    def flush_pending(self):
+        """Write the pending messages synchronously, once the event loop
+        has stopped, eg. from an `atexit` hook"""
+        pending, self.pending = self.pending, []
+        groups = defaultdict(list)
+        for message, files in pending:
+            groups[message.chat_group_id].append((message, files))
+        for chat_group_id in write_groups(groups):
+            logger.error(
+                "Lost %s messages of chat %s", len(groups[chat_group_id]), chat_group_id
+            )